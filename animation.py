@@ -0,0 +1,129 @@
+"""アニメーション (GIF/WebP) のフレームごとの処理
+
+フレームは seek で1枚ずつ読み込み、リサイズや減色はスレッドで並列に行う
+(読み込みの先読みは上限付き)。ただし Pillow の save_all は全フレームを
+受け取ってから書き込むため、変換後のフレームはすべてメモリに保持する。
+減色などはフレームを順に置き換えながら行い、2組のフレームを同時には持たない。
+GIFは全フレームで共通のパレットを使い、フレーム間で色がちらつかないようにする。
+保存時は元の表示時間とループ回数を引き継ぎ、前のフレームから変化した範囲だけを
+書き込む (GIFは Pillow の optimize、WebPは libwebp の minimize_size による
+差分の最適化)。
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import memory
+import quantize
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+ANIMATED_FORMATS = ["gif", "webp"]
+MAX_FRAME_WORKERS = 4
+DEFAULT_DURATION = 100
+# 差分の最適化で「変化なし」に使う色を1つ空けておく
+GIF_COLORS = 255
+GIF_TRANSPARENCY = 255
+# これより不透明度の低い画素は、GIFでは透明にする
+ALPHA_THRESHOLD = 128
+
+
+def is_animated(img):
+    return getattr(img, "is_animated", False) and img.n_frames > 1
+
+
+def iter_frames(img):
+    """(RGBAのフレーム, 表示時間 ms) を順に返す
+
+    seek 後のフレームは前のフレームと合成済みのため、そのまま1枚の画像として扱える。
+    """
+    for index in range(img.n_frames):
+        img.seek(index)
+        yield img.convert("RGBA"), img.info.get("duration", DEFAULT_DURATION)
+
+
+def map_ordered(function, items, max_workers=MAX_FRAME_WORKERS):
+    """items を並列に処理し、結果を元の順に返す
+
+    items は必要になった分だけ読み進める (先読みは max_workers の2倍まで)。
+    """
+    with ThreadPoolExecutor(max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def frames_bytes(size, new_size, n_frames, image_format):
+    """全フレームの処理に必要なメモリ量を見積もる
+
+    保持する変換後のRGBAのフレームと、先読み中の元のサイズのフレーム。
+    GIFは保存時に Pillow が全フレームをPモードで複製して保持する。
+    """
+    frame = memory.image_bytes(new_size, "RGBA")
+    total = frame * n_frames
+    total += memory.image_bytes(size, "RGBA") * MAX_FRAME_WORKERS * 2
+    if image_format == "gif":
+        total += memory.image_bytes(new_size, "P") * n_frames
+    return total
+
+
+def uses_alpha(frame):
+    return frame.getextrema()[3][0] < 255
+
+
+def build_palette(frames, method=quantize.DEFAULT_QUANTIZE_METHOD):
+    """等間隔に選んだフレームから、全フレームで共通のパレットを作る"""
+    step = max(len(frames) // quantize.PALETTE_SAMPLE_COUNT, 1)
+    samples = [
+        frame.convert("RGB").resize(quantize.PALETTE_SAMPLE_SIZE)
+        for frame in frames[::step][: quantize.PALETTE_SAMPLE_COUNT]
+    ]
+    return quantize.palette_from_samples(samples, GIF_COLORS, method)
+
+
+def to_palette(frame, palette, alpha):
+    """共通のパレットに割り当てる。透過する画素は GIF_TRANSPARENCY にする
+
+    ディザリングはフレームごとに模様が変わり、差分が大きくなるため使わない。
+    """
+    quantized = frame.convert("RGB").quantize(
+        palette=quantize.palette_image(palette), dither=Image.Dither.NONE
+    )
+    if alpha:
+        mask = frame.getchannel("A").point(
+            lambda a: 255 if a < ALPHA_THRESHOLD else 0, "1"
+        )
+        quantized.paste(GIF_TRANSPARENCY, mask=mask)
+    return quantized
+
+
+def save_params(image_format, frames, durations, loop, alpha, quality=None):
+    """save_all で保存するための引数を返す (1枚目は含まない)"""
+    params = {
+        "save_all": True,
+        "append_images": frames[1:],
+        "duration": durations,
+    }
+    # ループの指定がないGIFは1回だけ再生する。GIFの1回の指定は解釈が
+    # 表示するソフトによって異なるため、その場合は指定を省く
+    if image_format == "gif":
+        if loop is not None and loop != 1:
+            params["loop"] = loop
+        params["optimize"] = True
+        if alpha:
+            # 透過のある画像は、前のフレームを消してから描画する
+            params.update(transparency=GIF_TRANSPARENCY, disposal=2)
+    else:
+        params["loop"] = 1 if loop is None else loop
+        params["minimize_size"] = True
+        if quality is not None:
+            params["quality"] = quality
+    return params
@@ -0,0 +1,51 @@
+"""画像ごとの出力形式の自動選択
+
+候補の形式 (JPEG・WebP・減色したPNG) でメモリ上に試しにエンコードし、
+元の画像との PSNR が基準以上のもののうち、最も小さいものを選ぶ。
+透過を使っている画像では、透過を保持できない JPEG は候補から外す。
+写真は JPEG/WebP、色数の少ないスクリーンショットやイラストは PNG が選ばれやすい。
+"""
+
+import quantize
+import settings
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+AUTO_FORMAT = settings.AUTO_FORMAT
+CANDIDATE_FORMATS = ["jpeg", "webp", "png"]
+ALPHA_FORMATS = ["webp", "png"]
+# 候補として認める画質の下限 (dB)
+DEFAULT_MIN_PSNR = settings.DEFAULT_MIN_PSNR
+
+
+def prepare_image(img):
+    """試行用に RGB/RGBA に揃え、(画像, 透過を使っているか) を返す
+
+    アルファがすべて不透明の場合は、不要なチャンネルを除いて RGB にする。
+    """
+    img = quantize.prepare_mode(img)
+    if img.mode == "RGBA":
+        if img.getextrema()[3][0] < 255:
+            return img, True
+        img = img.convert("RGB")
+    return img, False
+
+
+def candidate_formats(alpha):
+    return ALPHA_FORMATS if alpha else CANDIDATE_FORMATS
+
+
+def select_trial(trials, min_psnr=DEFAULT_MIN_PSNR):
+    """試行結果 (format・bytes・psnr を含む dict) から採用するものを返す
+
+    基準を満たすものがなければ、最も画質の高いものを選ぶ。
+    """
+    passed = [trial for trial in trials if trial["psnr"] >= min_psnr]
+    if passed:
+        return min(passed, key=lambda trial: trial["bytes"])
+    logger.debug(
+        f"PSNR {min_psnr}dB 以上の形式がないため、最も高画質の形式を選びます"
+    )
+    return max(trials, key=lambda trial: trial["psnr"])
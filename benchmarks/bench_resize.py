@@ -0,0 +1,63 @@
+# リサイズの通常パスと高速縮小 (draft + reducing_gap) の速度を比較する
+#
+#   $ python3 benchmarks/bench_resize.py --size 6000x4000 --value 800
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import processor  # noqa: E402
+
+
+def make_sample_jpeg(path, size):
+    """ノイズとグラデーションを合成した写真に近いJPEGを生成する"""
+    noise = Image.effect_noise(size, 48)
+    gradient = Image.linear_gradient("L").resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    Image.merge("RGB", (noise, gradient, radial)).save(path, quality=90)
+
+
+def run(path, new_size, fast, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with Image.open(path) as img:
+            if fast:
+                processor.fast_downscale(img, new_size)
+            else:
+                img.resize(new_size, Image.LANCZOS)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="6000x4000")
+    parser.add_argument("--value", type=int, default=800)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    new_size = processor.calc_resize(size, "width", args.value)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "sample.jpg")
+        make_sample_jpeg(path, size)
+
+        normal = run(path, new_size, False, args.repeat)
+        fast = run(path, new_size, True, args.repeat)
+
+    print(f"入力: {size[0]}x{size[1]} -> {new_size[0]}x{new_size[1]}")
+    print(f"通常 (Lanczos): {normal * 1000:.1f} ms")
+    print(f"高速縮小      : {fast * 1000:.1f} ms")
+    print(f"速度比        : {normal / fast:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# GUIの起動時間 (プロセスの開始から最初のウィンドウの表示まで) を計測する
+#
+# 毎回新しいプロセスで main を読み込み、ウィンドウを作って描画したところで終了する。
+# ディスプレイがない環境では、モジュールの読み込み時間だけを計測する。
+#
+#   $ python3 benchmarks/bench_startup.py --repeat 10
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスで実行するコード。時刻は time.time() で親と揃える
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+import main
+result = {{"imported": time.time()}}
+try:
+    root = main.create_root()
+except Exception as e:
+    result["error"] = str(e)
+else:
+    app = main.ImageProcessorApp(root)
+    root.update()
+    result["shown"] = time.time()
+    root.destroy()
+print(json.dumps(result))
+"""
+
+
+def run_once(python):
+    start = time.time()
+    completed = subprocess.run(
+        [python, "-c", CHILD.format(root=ROOT)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        "import_ms": (result["imported"] - start) * 1000,
+        "window_ms": (
+            (result["shown"] - start) * 1000 if "shown" in result else None
+        ),
+        "error": result.get("error"),
+    }
+
+
+def interpreter_ms(python):
+    start = time.perf_counter()
+    subprocess.run([python, "-c", "pass"], check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--python", default=sys.executable)
+    args = parser.parse_args()
+
+    # 1回目は .pyc の作成を含むため捨てる
+    run_once(args.python)
+    runs = [run_once(args.python) for _ in range(max(args.repeat, 1))]
+    baseline = statistics.median(
+        interpreter_ms(args.python) for _ in range(max(args.repeat, 1))
+    )
+
+    print(f"インタプリタの起動    : {baseline:.1f} ms")
+    print(
+        "main の読み込みまで   : "
+        f"{statistics.median(run['import_ms'] for run in runs):.1f} ms"
+    )
+    if runs[0]["window_ms"] is None:
+        print(f"ウィンドウ: 計測できません ({runs[0]['error']})")
+    else:
+        print(
+            "最初のウィンドウまで  : "
+            f"{statistics.median(run['window_ms'] for run in runs):.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
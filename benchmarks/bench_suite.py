@@ -0,0 +1,295 @@
+# 圧縮・形式変更・リサイズのスループットを計測するベンチマーク
+#
+# 対応する全形式・複数の解像度の画像を生成し、アプリと同じ
+# processor.iter_process を通して処理した結果をJSONで出力する。
+#
+#   $ python3 benchmarks/bench_suite.py -o before.json
+#   $ python3 benchmarks/bench_suite.py -o after.json
+#   $ python3 benchmarks/bench_suite.py --compare before.json after.json
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import processor  # noqa: E402
+import settings  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = ["640x480", "1920x1080", "4000x3000"]
+DEFAULT_COUNT = 8
+OPERATIONS = {
+    "compress": settings.OPERATION_COMPRESS,
+    "convert": settings.OPERATION_FORMAT,
+    "resize": settings.OPERATION_RESIZE,
+}
+# 比較時に「良くなった」とみなす方向 (1: 大きいほど良い, -1: 小さいほど良い)
+METRICS = {
+    "images_per_sec": 1,
+    "mb_per_sec": 1,
+    "p50_ms": -1,
+    "p95_ms": -1,
+    "peak_rss_mb": -1,
+}
+
+
+def parse_size(text):
+    width, height = (int(v) for v in text.lower().split("x"))
+    return width, height
+
+
+def make_image(size, seed):
+    """写真に近い、再現性のある画像を生成する (乱数は使わない)"""
+    extent = (-2.0 + seed * 0.01, -1.2, 0.8, 1.2)
+    mandelbrot = Image.effect_mandelbrot(size, extent, 64 + seed)
+    gradient = Image.linear_gradient("L").resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    return Image.merge("RGB", (mandelbrot, gradient, radial))
+
+
+def build_corpus(corpus_dir, sizes, count):
+    """形式・解像度ごとに count 枚の画像を生成し、{(ext, size): [パス]} を返す"""
+    corpus = {}
+    for size_text in sizes:
+        size = parse_size(size_text)
+        images = None
+        for ext in settings.SUPPORTED_EXTENSIONS:
+            paths = []
+            for i in range(count):
+                path = os.path.join(corpus_dir, f"{size_text}_{i}{ext}")
+                if not os.path.exists(path):
+                    if images is None:
+                        images = [make_image(size, j) for j in range(count)]
+                    img = images[i]
+                    if ext == ".png" and i % 2:
+                        # 透過を含むPNGも混ぜる
+                        img = img.convert("RGBA")
+                        img.putalpha(img.getchannel("G"))
+                    img.save(path)
+                paths.append(path)
+            corpus[(ext, size_text)] = paths
+    return corpus
+
+
+def percentile(values, ratio):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(ratio * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Linux はKB、macOS はバイト単位
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def run_case(case):
+    """1つの組み合わせを処理して計測結果を返す (別プロセスで実行される)"""
+    options = dict(settings.DEFAULT_OPTIONS, **case["options"])
+    input_bytes = sum(os.path.getsize(path) for path in case["paths"])
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        for _, result, error in processor.iter_process(
+            case["paths"],
+            OPERATIONS[case["operation"]],
+            options,
+            output_dir,
+            case["executor"],
+            case["workers"],
+        ):
+            if error is None:
+                latencies.append(result["seconds"])
+            else:
+                errors += 1
+        elapsed = time.perf_counter() - start
+
+    images = len(case["paths"])
+    return {
+        "operation": case["operation"],
+        "format": case["format"],
+        "size": case["size"],
+        "images": images,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "images_per_sec": round(images / elapsed, 2),
+        "mb_per_sec": round(input_bytes / (1024 * 1024) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_case_isolated(case):
+    """ピークメモリを組み合わせごとに計測するため、別プロセスで実行する"""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", "-"],
+        input=json.dumps(case),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout)
+
+
+def run_suite(args):
+    corpus_dir = args.corpus or os.path.join(
+        tempfile.gettempdir(), "edited_fig_bench_corpus"
+    )
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = build_corpus(corpus_dir, args.sizes, args.count)
+
+    operation_options = {
+        "compress": {},
+        "convert": {"target_format": args.target_format},
+        "resize": {"resize_by": "width", "resize_value": args.resize_value},
+    }
+
+    results = []
+    for operation in args.operations:
+        for (ext, size), paths in corpus.items():
+            case = {
+                "operation": operation,
+                "format": ext[1:],
+                "size": size,
+                "paths": paths,
+                "options": operation_options[operation],
+                "executor": args.executor,
+                "workers": args.workers,
+            }
+            result = run_case_isolated(case)
+            print(
+                f"{operation:8} {ext[1:]:5} {size:>9}: "
+                f"{result['images_per_sec']:8.2f} img/s "
+                f"p95 {result['p95_ms']:8.1f}ms",
+                file=sys.stderr,
+            )
+            results.append(result)
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "executor": args.executor,
+            "workers": args.workers,
+            "count": args.count,
+        },
+        "results": results,
+    }
+
+
+def compare(before_path, after_path):
+    """2つの結果を組み合わせごとに比較し、変化率を表示する"""
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+
+    def key(result):
+        return result["operation"], result["format"], result["size"]
+
+    before_results = {key(r): r for r in before["results"]}
+    rows = []
+    for result in after["results"]:
+        base = before_results.get(key(result))
+        if base is None:
+            continue
+        operation, image_format, size = key(result)
+        row = {"operation": operation, "format": image_format, "size": size}
+        for metric, direction in METRICS.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            row[metric] = {
+                "before": old,
+                "after": new,
+                "change_pct": round(change, 1),
+                "improved": change * direction > 0,
+            }
+        rows.append(row)
+
+    ratios = [
+        row["images_per_sec"]["after"] / row["images_per_sec"]["before"]
+        for row in rows
+        if "images_per_sec" in row
+    ]
+    summary = {
+        "cases": len(rows),
+        "geomean_speedup": (
+            round(statistics.geometric_mean(ratios), 3) if ratios else None
+        ),
+    }
+    return {"summary": summary, "results": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="結果のJSONの出力先")
+    parser.add_argument("--corpus", help="生成した画像の保存先")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT)
+    parser.add_argument(
+        "--operations",
+        nargs="+",
+        choices=list(OPERATIONS),
+        default=list(OPERATIONS),
+    )
+    parser.add_argument("--target-format", default="jpeg")
+    parser.add_argument("--resize-value", type=int, default=800)
+    parser.add_argument(
+        "--executor",
+        choices=settings.EXECUTOR_TYPES,
+        default=settings.DEFAULT_EXECUTOR,
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=settings.DEFAULT_MAX_WORKERS
+    )
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="結果を比較"
+    )
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        report = run_case(json.load(sys.stdin))
+    elif args.compare:
+        report = compare(*args.compare)
+    else:
+        report = run_suite(args)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
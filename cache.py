@@ -0,0 +1,146 @@
+"""処理結果のディスクキャッシュ
+
+入力ファイルの内容のハッシュと処理内容・パラメータからキーを作り、出力ファイルを
+キャッシュディレクトリに保存する。同じ画像を同じ設定で再処理する場合は、再エンコードせずに
+キャッシュからハードリンク (できなければコピー) する。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import outputs
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "edited_fig"
+)
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+MANIFEST_NAME = "edited_manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """ハードリンクを作成し、別ファイルシステムなどで失敗した場合はコピーする
+
+    途中で中断しても dst が消えたり書きかけになったりしないよう、
+    一時ファイルに作成してから名前の変更で置き換える。
+    """
+    tmp_path = outputs.temp_path(dst)
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ResultCache:
+    def __init__(
+        self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, source_hash, operation, params):
+        payload = json.dumps(
+            {"source": source_hash, "operation": operation, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key, ext):
+        # 1ディレクトリのファイル数が増えすぎないよう先頭2文字で分ける
+        return os.path.join(self.cache_dir, key[:2], f"{key}{ext}")
+
+    def restore(self, key, output_path):
+        """キャッシュがあれば出力先に配置してTrueを返す"""
+        _, ext = os.path.splitext(output_path)
+        entry = self.entry_path(key, ext)
+        if not os.path.exists(entry):
+            return False
+        link_or_copy(entry, output_path)
+        # LRUのため最終利用時刻を更新する
+        os.utime(entry)
+        logger.debug(f"キャッシュヒット: {output_path}")
+        return True
+
+    def store(self, key, output_path):
+        _, ext = os.path.splitext(output_path)
+        entry = self.entry_path(key, ext)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # 並列に書き込まれても壊れたファイルが見えないよう、一時ファイルから置き換える
+        # 同じ内容の入力が複数のI/O用のスレッドから同時に保存されることがあるため、
+        # 一時ファイルの名前はスレッドごとに分ける
+        tmp_path = outputs.temp_path(entry)
+        try:
+            shutil.copyfile(output_path, tmp_path)
+            os.replace(tmp_path, entry)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        """合計サイズが上限を超えている場合、最後に使われた時刻が古いものから削除する"""
+        entries = []
+        total = 0
+        for dir_path, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        if removed:
+            logger.info(f"キャッシュを{removed}件削除しました")
+        return removed
+
+
+def update_manifest(output_dir, records):
+    """出力ディレクトリのマニフェストに出力ファイルごとの情報を追記する
+
+    フォルダの構成を再現する場合に同じ名前のファイルが重ならないよう、
+    出力ディレクトリからの相対パスをキーにする。
+    """
+    outputs.update_json(
+        os.path.join(output_dir, MANIFEST_NAME),
+        {
+            os.path.relpath(record["output_path"], output_dir): record
+            for record in records
+        },
+    )
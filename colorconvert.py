@@ -0,0 +1,276 @@
+"""保存先の形式に合わせた画像のモードの変換 (ICCプロファイルによるカラーマネジメント付き)
+
+元のモードと透過の有無から、保存先の形式がそのまま扱えるモードになるまでの
+最小の変換の手順を決めて適用する (形式が扱えるモードなら何もしない)。
+各手順は Pillow の1回の変換で行い、16ビット・浮動小数点のグレースケールの
+8ビットへの縮小も point の線形変換 (C の処理) で行う。
+
+ICCプロファイルは、色空間の変わらない変換ではそのまま引き継ぎ、保存時に埋め込む。
+CMYKからRGBなど色空間が変わる場合は、プロファイルがあればsRGBへの変換
+(ImageCms) を行う。変換はプロファイルごとに1回だけ作成して使い回す。
+ImageCms は起動を遅くしないよう、初めて色の変換が必要になったときに読み込む。
+icc_mode が "srgb" の場合は、RGBの画像もプロファイルに従ってsRGBに変換し、
+変換元のプロファイルは埋め込まない。
+"""
+
+import hashlib
+import io
+import threading
+from functools import lru_cache
+
+from PIL import Image
+
+import settings
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+ICC_MODES = settings.ICC_MODES
+DEFAULT_ICC_MODE = settings.DEFAULT_ICC_MODE
+# 保存時にICCプロファイルを埋め込める形式 (Pillow の形式名)
+ICC_FORMATS = {"JPEG", "PNG", "WEBP", "TIFF"}
+# 透過を合成する背景色
+BACKGROUND = (255, 255, 255)
+# 保持する色の変換の数 (プロファイルと入出力のモードの組み合わせごと)
+MAX_TRANSFORMS = 16
+
+# 形式ごとに、変換せずに保存できるモード
+FORMAT_MODES = {
+    "jpeg": ("L", "RGB"),
+    "png": ("1", "L", "LA", "I", "I;16", "P", "RGB", "RGBA"),
+    "webp": ("RGB", "RGBA"),
+    "tiff": ("1", "L", "LA", "I", "I;16", "F", "P", "RGB", "RGBA", "CMYK"),
+    "bmp": ("1", "L", "P", "RGB", "RGBA"),
+    # GIFは保存時に Pillow がRGB/RGBAを減色する
+    "gif": ("1", "L", "P", "RGB", "RGBA"),
+}
+# 減色などのRGBの処理に使うモード
+RGB_MODES = ("RGB", "RGBA")
+
+# モード -> ICCプロファイルの色空間 (ヘッダーの16-20バイト目)
+MODE_SPACES = {
+    "1": "GRAY",
+    "L": "GRAY",
+    "LA": "GRAY",
+    "I": "GRAY",
+    "I;16": "GRAY",
+    "I;16B": "GRAY",
+    "I;16L": "GRAY",
+    "F": "GRAY",
+    "P": "RGB",
+    "PA": "RGB",
+    "RGB": "RGB",
+    "RGBA": "RGB",
+    "CMYK": "CMYK",
+    "LAB": "Lab",
+}
+# 8ビットに縮小するグレースケールのモード
+HIGH_BIT_MODES = ("I", "I;16", "I;16B", "I;16L", "F")
+
+_transforms = {}
+_transforms_lock = threading.Lock()
+_cms_warned = False
+
+
+def next_step(mode, transparency, supported):
+    """対応するモードに近づける1つの手順の (名前, 変換後のモード) を返す"""
+    if mode in ("RGBa", "La"):
+        return "unpremultiply", mode.upper()
+    if mode in ("P", "PA"):
+        alpha = transparency or mode == "PA"
+        return "expand", "RGBA" if alpha else "RGB"
+    if mode == "1":
+        return "expand", "L"
+    if mode in HIGH_BIT_MODES:
+        return "reduce_depth", "L"
+    if mode == "RGBA":
+        return "flatten", "RGB"
+    if mode == "LA":
+        if "RGBA" in supported:
+            return "to_rgb", "RGBA"
+        return "flatten", "L"
+    return "to_rgb", "RGB"
+
+
+@lru_cache(maxsize=256)
+def plan(mode, transparency, supported):
+    """mode を supported のいずれかにするまでの手順 [(名前, モード)] を返す
+
+    すでに対応するモードの場合は空のリストを返す (変換しない)。
+    """
+    steps = []
+    while mode not in supported:
+        step, mode = next_step(mode, transparency, supported)
+        steps.append((step, mode))
+    return steps
+
+
+def convert_for_format(img, image_format, icc_mode=DEFAULT_ICC_MODE):
+    """image_format (jpeg/png/...) で保存できるモードに変換する"""
+    return convert_modes(
+        img, FORMAT_MODES.get(image_format.lower(), RGB_MODES), icc_mode
+    )
+
+
+def convert_modes(img, supported, icc_mode=DEFAULT_ICC_MODE):
+    """supported のいずれかのモードに、最小の手順で変換する"""
+    transparency = "transparency" in img.info
+    for step, mode in plan(img.mode, transparency, tuple(supported)):
+        logger.debug(f"モードの変換: {img.mode} -> {mode} ({step})")
+        if step == "reduce_depth":
+            img = reduce_depth(img)
+        elif step == "flatten":
+            img = flatten_alpha(img)
+        elif step == "to_rgb":
+            img = to_rgb(img, mode)
+        else:
+            img = img.convert(mode)
+    if icc_mode == "srgb" and img.mode in RGB_MODES:
+        img = apply_profile(img, img.mode)
+    return img
+
+
+def reduce_depth(img):
+    """16ビット・32ビット・浮動小数点のグレースケールを8ビットにする
+
+    16ビットは上位8ビットを使う。範囲の分からない値は最小値と最大値で正規化する。
+    Image.convert("L") は255を超える値をすべて255にするため使わない。
+    """
+    if img.mode in ("I;16B", "I;16L"):
+        img = img.convert("I")
+    if img.mode == "I;16":
+        return img.point(lambda v: v * (1 / 256)).convert("L")
+    low, high = img.getextrema()
+    if img.mode == "I" and low >= 0 and high <= 0xFFFF:
+        scale, low = 1 / 256, 0
+    elif img.mode == "F" and low >= 0 and high <= 1:
+        scale, low = 255, 0
+    else:
+        scale = 255 / (high - low) if high > low else 0
+    return img.point(lambda v: (v - low) * scale).convert("L")
+
+
+def flatten_alpha(img, color=BACKGROUND):
+    """RGBA/LAの画像を背景色の上に合成したRGB/Lの画像を返す
+
+    背景は出力そのものとして作り、画像自身のアルファをマスクにして貼り付けるため、
+    合成用の画像全体のコピーを別に作らずに済む。
+    """
+    if img.mode == "LA":
+        # ITU-R BT.601 の輝度
+        red, green, blue = color
+        background = Image.new(
+            "L", img.size, (red * 299 + green * 587 + blue * 114) // 1000
+        )
+    else:
+        background = Image.new("RGB", img.size, color)
+    background.paste(img, (0, 0), img)
+    if "icc_profile" in img.info:
+        background.info["icc_profile"] = img.info["icc_profile"]
+    return background
+
+
+def to_rgb(img, mode):
+    """RGB/RGBAにする。色空間が変わる場合は、プロファイルに従ってsRGBに変換する"""
+    if matching_profile(img) is not None:
+        return apply_profile(img, mode)
+    converted = img.convert(mode)
+    converted.info.pop("icc_profile", None)
+    return converted
+
+
+def matching_profile(img):
+    """画像のモードと色空間が一致するICCプロファイル (なければ None)
+
+    Image.convert はプロファイルを引き継ぐため、モードの変わった画像では
+    色空間が合わないプロファイルを埋め込まないよう確認する。
+    """
+    profile = img.info.get("icc_profile")
+    if not profile or len(profile) < 20:
+        return None
+    space = profile[16:20].decode("latin-1").strip()
+    return profile if MODE_SPACES.get(img.mode) == space else None
+
+
+def apply_profile(img, mode):
+    """埋め込まれたプロファイルからsRGBに変換し、mode の画像を返す
+
+    プロファイルがない・すでにsRGB・変換できない場合は、Pillow の変換だけを行う。
+    """
+    profile = matching_profile(img)
+    transform = None
+    if profile is not None:
+        transform = get_transform(profile, img.mode, mode)
+    if transform is None:
+        converted = img if img.mode == mode else img.convert(mode)
+        if profile is not None and converted.mode != img.mode:
+            converted.info.pop("icc_profile", None)
+        return converted
+    converted = transform.apply(img)
+    converted.info = {
+        key: value
+        for key, value in img.info.items()
+        if key not in ("icc_profile", "transparency")
+    }
+    return converted
+
+
+def get_transform(profile, in_mode, out_mode):
+    """プロファイルからsRGBへの変換を返す (作成したものは使い回す)
+
+    変換の必要がない (sRGBのRGB) 場合や、作成できない場合は None を返す。
+    """
+    global _cms_warned
+    ImageCms = image_cms()
+    if ImageCms is None:
+        if not _cms_warned:
+            _cms_warned = True
+            logger.warning(
+                "ImageCms が使えないため、ICCプロファイルによる色の変換は行いません"
+            )
+        return None
+
+    key = (hashlib.sha1(profile).digest(), in_mode, out_mode)
+    with _transforms_lock:
+        if key in _transforms:
+            return _transforms[key]
+    try:
+        source = ImageCms.ImageCmsProfile(io.BytesIO(profile))
+        if in_mode in RGB_MODES and ImageCms.getProfileDescription(
+            source
+        ).startswith("sRGB"):
+            transform = None
+        else:
+            # 複数のスレッドから同時に使えるよう、変換内の1画素のキャッシュを無効にする
+            transform = ImageCms.buildTransform(
+                source,
+                srgb_profile(),
+                in_mode,
+                out_mode,
+                renderingIntent=ImageCms.Intent.PERCEPTUAL,
+                flags=ImageCms.Flags.NOCACHE,
+            )
+    except (ImageCms.PyCMSError, OSError, ValueError) as e:
+        logger.debug(f"ICCプロファイルの変換を作成できません: {e}")
+        transform = None
+    with _transforms_lock:
+        if len(_transforms) >= MAX_TRANSFORMS:
+            _transforms.pop(next(iter(_transforms)))
+        _transforms[key] = transform
+    return transform
+
+
+@lru_cache(maxsize=1)
+def image_cms():
+    """PIL.ImageCms を読み込む (LittleCMS なしでビルドされた Pillow では None)"""
+    try:
+        from PIL import ImageCms
+    except ImportError:
+        return None
+    return ImageCms
+
+
+@lru_cache(maxsize=1)
+def srgb_profile():
+    return image_cms().createProfile("sRGB")
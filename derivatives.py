@@ -0,0 +1,65 @@
+"""1回のデコードから複数の幅の派生画像 (レスポンシブ画像のセット) を作成する
+
+大きい幅から順に、1つ前の段階の画像を縮小して次の幅を作る (カスケード縮小)。
+元の解像度から縮小するのは最初の1回だけになるため、幅の数が増えても
+フル解像度の処理は増えない。作成した派生画像は出力ディレクトリのマニフェストに記録する。
+"""
+
+import os
+
+from PIL import Image
+
+import outputs
+import settings
+import sources
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+MANIFEST_NAME = "derivatives.json"
+DEFAULT_WIDTHS = settings.DEFAULT_DERIVATIVE_WIDTHS
+DEFAULT_FORMATS = settings.DEFAULT_DERIVATIVE_FORMATS
+
+
+def plan_sizes(size, widths):
+    """作成するサイズを大きい順に返す
+
+    元画像より大きい幅は拡大になるため、元画像の幅に揃える。
+    高さは段階ごとの誤差が積み重ならないよう、元画像の縦横比から求める。
+    作成するサイズが1つもない場合は ValueError を送出する。
+    """
+    width, height = size
+    planned = sorted({min(w, width) for w in widths if w > 0}, reverse=True)
+    if not planned:
+        raise ValueError(f"作成する派生画像の幅がありません: {widths}")
+    return [(w, max(round(height * w / width), 1)) for w in planned]
+
+
+def cascade(img, sizes, reducing_gap=None):
+    """sizes の順に (サイズ, 縮小した画像) を返す
+
+    各段階は1つ前の段階の画像から縮小する。
+    """
+    current = img
+    for size in sizes:
+        if current.size != size:
+            current = current.resize(
+                size, Image.LANCZOS, reducing_gap=reducing_gap
+            )
+        yield size, current
+
+
+def variant_path(image_path, output_dir, width, image_format, name_suffix=""):
+    base_name, _ = os.path.splitext(sources.source_basename(image_path))
+    return os.path.join(
+        output_dir, f"{base_name}{name_suffix}_{width}w.{image_format}"
+    )
+
+
+def update_manifest(output_dir, records):
+    """元画像ごとの派生画像の一覧を、出力ディレクトリのマニフェストに書き込む"""
+    outputs.update_json(
+        os.path.join(output_dir, MANIFEST_NAME),
+        {record["source"]: record for record in records},
+    )
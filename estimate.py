@@ -0,0 +1,193 @@
+"""圧縮後のサイズと画質の概算
+
+処理待ちの画像から数枚を選び、画像の数か所から切り出したタイルを並べたサンプルを
+現在の設定でメモリ上にエンコードする。サンプルの1画素あたりのバイト数から
+各画像の出力サイズを見積もり、元のファイルサイズの比率で全体に広げる。
+画質は元のサンプルとの SSIM (ブロックごとの平均) と PSNR で表す。
+"""
+
+import io
+import math
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import processor
+import quality
+import sources
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+SAMPLE_COUNT = 8
+# 1枚あたり SAMPLE_GRID x SAMPLE_GRID 個のタイルを使う (JPEGのMCUに揃えて16の倍数)
+SAMPLE_GRID = 3
+SAMPLE_TILE = 96
+# 準備したサンプルを保持する画像数
+SAMPLE_CACHE_SIZE = SAMPLE_COUNT * 4
+
+
+def pick_samples(paths, count=SAMPLE_COUNT):
+    """全体から等間隔に count 件を選ぶ"""
+    if len(paths) <= count:
+        return list(paths)
+    step = len(paths) / count
+    return [paths[int(i * step)] for i in range(count)]
+
+
+def prepare_sample(path, grid=SAMPLE_GRID, tile=SAMPLE_TILE):
+    """(サンプル画像, 元画像の画素数) を返す
+
+    画像全体から等間隔に grid x grid 個のタイルを切り出して並べる。
+    縮小すると1画素あたりの情報量が増えて見積もりが大きくなりすぎるため、
+    タイルは元の解像度のまま切り出す (サンプルはキャッシュするため、デコードは1回)。
+    """
+    with Image.open(sources.open_source(path)) as img:
+        width, height = img.size
+        tile_width, tile_height = min(tile, width), min(tile, height)
+        sample = Image.new(img.mode, (tile_width * grid, tile_height * grid))
+        if img.mode == "P":
+            sample.putpalette(img.getpalette())
+        for row in range(grid):
+            for column in range(grid):
+                left = int((width - tile_width) * (column + 0.5) / grid)
+                top = int((height - tile_height) * (row + 0.5) / grid)
+                sample.paste(
+                    img.crop(
+                        (left, top, left + tile_width, top + tile_height)
+                    ),
+                    (column * tile_width, row * tile_height),
+                )
+    return sample, width * height
+
+
+def encode_sample(sample, ext, options):
+    """compress_image と同じ設定でエンコードしたバイト列を返す"""
+    quality = processor.compress_quality_to_jpeg(options["compress_quality"])
+    if ext.lower() == ".png":
+        quantized, _, _ = processor.quantize_png(
+            sample, processor.PNG_COLORS, options
+        )
+        return processor.encode_to_buffer(quantized, "PNG", optimize=True)
+    return processor.encode_to_buffer(
+        sample,
+        processor.format_for_ext(ext),
+        quality=quality,
+        optimize=True,
+    )
+
+
+class LiveEstimator:
+    """設定の変更に合わせて、概算を1つの作業スレッドで計算する
+
+    submit のたびに前の計算は取り消される (サンプルの区切りごとに確認する)。
+    結果は results キューに (世代, 概算の dict) の形で入る。
+    """
+
+    def __init__(self, sample_count=SAMPLE_COUNT):
+        self.sample_count = sample_count
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.results = queue.Queue()
+        self.generation = 0
+        # パスと更新時刻をキーに、準備したサンプルを保持する
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def submit(self, paths, options):
+        self.generation += 1
+        self.executor.submit(
+            self._estimate, list(paths), dict(options), self.generation
+        )
+        return self.generation
+
+    def cancel(self):
+        self.generation += 1
+
+    def sample(self, path):
+        key = (path, sources.stat_source(path))
+        with self.lock:
+            sample = self.samples.get(key)
+        if sample is None:
+            sample = prepare_sample(path)
+            with self.lock:
+                if len(self.samples) >= SAMPLE_CACHE_SIZE:
+                    self.samples.pop(next(iter(self.samples)))
+                self.samples[key] = sample
+        return sample
+
+    def _estimate(self, paths, options, generation):
+        try:
+            result = self.estimate(paths, options, generation)
+        except Exception as e:
+            logger.debug(f"概算に失敗しました: {e}")
+            return
+        if result is not None:
+            self.results.put((generation, result))
+
+    def estimate(self, paths, options, generation):
+        """概算を返す。途中で取り消された場合は None を返す"""
+        total_bytes = 0
+        for i, path in enumerate(paths):
+            if i % 1000 == 0 and generation != self.generation:
+                return None
+            total_bytes += sources.stat_source(path)[0]
+
+        sampled_input = 0
+        sampled_output = 0
+        ssim_scores = []
+        psnr_scores = []
+        for path in pick_samples(paths, self.sample_count):
+            if generation != self.generation:
+                return None
+            try:
+                sample, pixels = self.sample(path)
+                _, ext = os.path.splitext(path)
+                data = encode_sample(sample, ext, options)
+                with Image.open(io.BytesIO(data)) as encoded:
+                    original = quality.comparable(sample)
+                    encoded = quality.comparable(encoded)
+                    ssim_scores.append(quality.ssim(original, encoded))
+                    psnr_scores.append(quality.psnr(original, encoded))
+            except Exception as e:
+                logger.debug(f"概算に使えない画像です ({path}): {e}")
+                continue
+            sampled_input += sources.stat_source(path)[0]
+            sampled_output += (
+                len(data) / (sample.width * sample.height) * pixels
+            )
+
+        if not sampled_input:
+            return None
+        projected = sampled_output * total_bytes / sampled_input
+        finite_psnr = [v for v in psnr_scores if math.isfinite(v)]
+        return {
+            "samples": len(ssim_scores),
+            "total_bytes": total_bytes,
+            "projected_bytes": int(projected),
+            "savings": 1 - projected / total_bytes if total_bytes else 0.0,
+            "ssim": sum(ssim_scores) / len(ssim_scores),
+            "psnr": (
+                sum(finite_psnr) / len(finite_psnr)
+                if finite_psnr
+                else math.inf
+            ),
+        }
+
+    def poll(self):
+        """最新の世代の結果を返す。なければ None"""
+        latest = None
+        while True:
+            try:
+                generation, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                latest = result
+        return latest
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
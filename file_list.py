@@ -0,0 +1,348 @@
+"""大量のファイルを扱うためのファイルリスト
+
+PathStore は重複を除いたパスと処理状態をインデックス付きで保持する。
+VirtualFileList は表示範囲の行だけを Canvas に描画するため、
+数万件を追加してもウィジェットの更新コストは表示行数分で済む。
+ThumbnailGrid も同様に、表示範囲のサムネイルだけを描画する。
+"""
+
+import tkinter as tk
+import tkinter.font as tkfont
+from tkinter import ttk
+
+import sources
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+STATUS_LABELS = {
+    STATUS_PENDING: "待機",
+    STATUS_RUNNING: "処理中",
+    STATUS_DONE: "完了",
+    STATUS_ERROR: "エラー",
+}
+STATUS_COLORS = {
+    STATUS_PENDING: "gray40",
+    STATUS_RUNNING: "blue",
+    STATUS_DONE: "green4",
+    STATUS_ERROR: "red3",
+}
+
+
+class PathStore:
+    def __init__(self):
+        self.paths = []
+        self.statuses = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __getitem__(self, i):
+        return self.paths[i]
+
+    def extend(self, paths):
+        """未登録のパスだけを末尾に追加し、追加された件数を返す"""
+        added = 0
+        for path in paths:
+            if path in self.index:
+                continue
+            self.index[path] = len(self.paths)
+            self.paths.append(path)
+            self.statuses.append(STATUS_PENDING)
+            added += 1
+        return added
+
+    def clear(self):
+        self.paths = []
+        self.statuses = []
+        self.index = {}
+
+    def set_status(self, path, status):
+        i = self.index.get(path)
+        if i is not None:
+            self.statuses[i] = status
+        return i
+
+    def reset_statuses(self):
+        self.statuses = [STATUS_PENDING] * len(self.paths)
+
+    def reset_running(self):
+        """処理中のまま終わった (取り消した) ものを待機に戻す"""
+        self.statuses = [
+            STATUS_PENDING if status == STATUS_RUNNING else status
+            for status in self.statuses
+        ]
+
+    def count(self, status):
+        return self.statuses.count(status)
+
+
+class VirtualScrollFrame(ttk.Frame):
+    """行単位でスクロールし、表示範囲だけを Canvas に描画するフレームの基底クラス
+
+    サブクラスは total_rows と refresh を実装する。top は表示範囲の先頭の行。
+    """
+
+    # ホイール (Linux のボタン4/5) 1回でスクロールする行数
+    WHEEL_ROWS = 1
+
+    def __init__(self, parent, row_height, height, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.top = 0
+        self.row_height = row_height
+
+        self.canvas = tk.Canvas(
+            self,
+            height=row_height * height,
+            background="white",
+            highlightthickness=0,
+        )
+        self.scrollbar = ttk.Scrollbar(
+            self, orient=tk.VERTICAL, command=self.yview
+        )
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<MouseWheel>", self.on_mousewheel)
+        self.canvas.bind(
+            "<Button-4>", lambda e: self.scroll_rows(-self.WHEEL_ROWS)
+        )
+        self.canvas.bind(
+            "<Button-5>", lambda e: self.scroll_rows(self.WHEEL_ROWS)
+        )
+
+    def total_rows(self):
+        raise NotImplementedError
+
+    def refresh(self):
+        raise NotImplementedError
+
+    def visible_rows(self):
+        return max(self.canvas.winfo_height() // self.row_height, 1)
+
+    def max_top(self):
+        return max(self.total_rows() - self.visible_rows(), 0)
+
+    def yview(self, *args):
+        if args[0] == tk.MOVETO:
+            self.top = int(float(args[1]) * self.total_rows())
+        elif args[0] == tk.SCROLL:
+            step = int(args[1])
+            if args[2] == tk.PAGES:
+                step *= self.visible_rows()
+            self.top += step
+        self.top = min(max(self.top, 0), self.max_top())
+        self.refresh()
+
+    def scroll_rows(self, rows):
+        self.yview(tk.SCROLL, rows, tk.UNITS)
+
+    def on_mousewheel(self, event):
+        # Windows は120単位、macOS は1単位で通知される
+        delta = event.delta if abs(event.delta) < 120 else event.delta // 120
+        self.scroll_rows(-delta)
+
+    def see_end(self):
+        self.top = self.max_top()
+        self.refresh()
+
+    def update_scrollbar(self):
+        total = self.total_rows()
+        if total:
+            self.scrollbar.set(
+                self.top / total,
+                min(self.top + self.visible_rows(), total) / total,
+            )
+        else:
+            self.scrollbar.set(0, 1)
+
+
+class VirtualFileList(VirtualScrollFrame):
+    STATUS_WIDTH = 70
+    WHEEL_ROWS = 3
+
+    def __init__(self, parent, store, height=5, **kwargs):
+        self.store = store
+        self.font = tkfont.nametofont("TkFixedFont")
+        super().__init__(
+            parent, self.font.metrics("linespace") + 2, height, **kwargs
+        )
+
+    def total_rows(self):
+        return len(self.store)
+
+    def refresh(self, *args):
+        """表示範囲の行だけを描き直す"""
+        self.canvas.delete("row")
+        self.top = min(self.top, self.max_top())
+        end = min(self.top + self.visible_rows() + 1, len(self.store))
+
+        for y, i in enumerate(range(self.top, end)):
+            status = self.store.statuses[i]
+            y_pos = y * self.row_height + 1
+            self.canvas.create_text(
+                4,
+                y_pos,
+                anchor=tk.NW,
+                text=STATUS_LABELS[status],
+                fill=STATUS_COLORS[status],
+                font=self.font,
+                tags="row",
+            )
+            self.canvas.create_text(
+                self.STATUS_WIDTH,
+                y_pos,
+                anchor=tk.NW,
+                text=self.store.paths[i],
+                font=self.font,
+                tags="row",
+            )
+        self.update_scrollbar()
+
+    def refresh_row(self, i):
+        """指定した行が表示範囲内にある場合だけ再描画する"""
+        if i is not None and self.top <= i <= self.top + self.visible_rows():
+            self.refresh()
+
+
+class ThumbnailGrid(VirtualScrollFrame):
+    """表示範囲のサムネイルだけを Canvas に並べて描画する
+
+    サムネイルの作成は loader (thumbnails.ThumbnailLoader) が別スレッドで行う。
+    PhotoImage は表示中のセルの分だけ保持し、スクロールで外れたものは捨てる。
+    """
+
+    PADDING = 8
+    POLL_MS = 50
+
+    def __init__(self, parent, store, loader, height=2, **kwargs):
+        self.store = store
+        self.loader = loader
+        self.photos = {}
+        self.failed = set()
+
+        self.font = tkfont.nametofont("TkDefaultFont")
+        thumb_width, thumb_height = loader.size
+        self.cell_width = thumb_width + self.PADDING * 2
+        cell_height = (
+            thumb_height + self.font.metrics("linespace") + self.PADDING * 2
+        )
+        super().__init__(parent, cell_height, height, **kwargs)
+
+        # 非表示の間に追加されたファイルは、タブが表示された時点で読み込む
+        self.bind("<Map>", lambda e: self.refresh())
+        self.after(self.POLL_MS, self.poll)
+
+    def columns(self):
+        return max(self.canvas.winfo_width() // self.cell_width, 1)
+
+    def total_rows(self):
+        columns = self.columns()
+        return (len(self.store) + columns - 1) // columns
+
+    def visible_range(self):
+        columns = self.columns()
+        start = self.top * columns
+        # 一部だけ見えている下端の行も含める
+        end = min(start + (self.visible_rows() + 1) * columns, len(self.store))
+        return start, end
+
+    def clear(self):
+        self.loader.cancel()
+        self.photos = {}
+        self.failed = set()
+        self.top = 0
+        self.refresh()
+
+    def refresh(self):
+        """表示範囲を描き直し、まだないサムネイルの作成を要求する"""
+        if not self.winfo_ismapped():
+            return
+        self.top = min(self.top, self.max_top())
+        start, end = self.visible_range()
+        visible = self.store.paths[start:end]
+
+        # 表示範囲から外れたサムネイルは保持しない
+        keep = set(visible)
+        self.photos = {p: v for p, v in self.photos.items() if p in keep}
+
+        self.loader.cancel()
+        self.loader.request(
+            [
+                p
+                for p in visible
+                if p not in self.photos and p not in self.failed
+            ]
+        )
+        self.draw()
+
+    def draw(self):
+        self.canvas.delete("cell")
+        columns = self.columns()
+        start, end = self.visible_range()
+        thumb_width, thumb_height = self.loader.size
+
+        for offset, i in enumerate(range(start, end)):
+            path = self.store.paths[i]
+            row, column = divmod(offset, columns)
+            x = column * self.cell_width + self.PADDING
+            y = row * self.row_height + self.PADDING
+
+            photo = self.photos.get(path)
+            if photo is not None:
+                self.canvas.create_image(
+                    x + thumb_width // 2,
+                    y + thumb_height // 2,
+                    image=photo,
+                    tags="cell",
+                )
+            else:
+                self.canvas.create_rectangle(
+                    x,
+                    y,
+                    x + thumb_width,
+                    y + thumb_height,
+                    outline="gray80",
+                    fill="red3" if path in self.failed else "gray95",
+                    tags="cell",
+                )
+            self.canvas.create_text(
+                x + thumb_width // 2,
+                y + thumb_height + 2,
+                anchor=tk.N,
+                text=self.label(path),
+                font=self.font,
+                width=thumb_width,
+                tags="cell",
+            )
+        self.update_scrollbar()
+
+    def label(self, path):
+        name = sources.source_basename(path)
+        return name if len(name) <= 18 else f"{name[:8]}…{name[-8:]}"
+
+    def poll(self):
+        # 別スレッドで作成したサムネイルを、メインループで PhotoImage にする
+        items = self.loader.poll()
+        if items:
+            # ImageTk はサムネイルを表示するまで読み込まない
+            from PIL import ImageTk
+
+            start, end = self.visible_range()
+            visible = set(self.store.paths[start:end])
+            for path, img, error in items:
+                if path not in visible:
+                    continue
+                if error is not None:
+                    self.failed.add(path)
+                else:
+                    self.photos[path] = ImageTk.PhotoImage(img)
+            self.draw()
+        self.after(self.POLL_MS, self.poll)
@@ -0,0 +1,213 @@
+"""バッチ処理のジョブの状態管理と計測
+
+Job は一時停止・再開・取り消しの要求を保持し、処理側 (processor.iter_process) が
+ファイルの区切りごとに確認する。処理の進み具合からスループットと残り時間を求め、
+ファイルごとの段階別の処理時間をJSON Lines形式で出力することもできる。
+journal (journal.Journal) を指定すると、ファイルごとの状態の変化を記録し、
+異常終了後に残りのファイルから再開できるようにする。
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from logger import Logger
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_CANCELLED = "cancelled"
+JOB_DONE = "done"
+
+# 1ファイルの処理の段階。StageTimer はこの名前で時間を記録する
+STAGES = ["open", "decode", "transform", "encode", "write"]
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (
+                time.perf_counter() - start
+            )
+
+    def as_dict(self):
+        return dict(self.stages)
+
+
+class Job:
+    def __init__(self, total, metrics_path=None, journal=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.total = total
+        self.state = JOB_PENDING
+        self.completed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cached = 0
+        self.stage_totals = dict.fromkeys(STAGES, 0.0)
+        self.started_at = None
+        self.finished_at = None
+        self.paused_seconds = 0.0
+        self.paused_at = None
+
+        # set されている間は処理を続け、clear すると一時停止する
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+        self.journal = journal
+        # 処理を投入したファイルのパスを受け取る (ワーカーの管理スレッドから呼ばれる)
+        self.on_started = None
+        self.metrics = None
+        if metrics_path:
+            self.metrics = Logger(
+                "INFO",
+                name=f"metrics.{self.id}",
+                filename=metrics_path,
+                fmt="%(message)s",
+            )
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def paused(self):
+        return not self.resume_event.is_set()
+
+    def start(self):
+        self.state = JOB_RUNNING
+        self.started_at = time.perf_counter()
+
+    def pause(self):
+        with self.lock:
+            if self.state == JOB_RUNNING:
+                self.state = JOB_PAUSED
+                self.paused_at = time.perf_counter()
+                self.resume_event.clear()
+
+    def resume(self):
+        with self.lock:
+            if self.state == JOB_PAUSED:
+                self.state = JOB_RUNNING
+                self.paused_seconds += time.perf_counter() - self.paused_at
+                self.paused_at = None
+                self.resume_event.set()
+
+    def cancel(self):
+        self.cancel_event.set()
+        # 一時停止中でも待機を抜けられるようにする
+        self.resume_event.set()
+
+    def wait_if_paused(self, timeout=None):
+        return self.resume_event.wait(timeout)
+
+    def mark_started(self, image_path):
+        """ファイルの処理を投入したときに呼ぶ"""
+        if self.journal:
+            self.journal.file_started(image_path)
+        if self.on_started:
+            self.on_started(image_path)
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+        if self.state != JOB_CANCELLED:
+            self.state = JOB_CANCELLED if self.cancelled else JOB_DONE
+        if self.journal:
+            # すべて成功した場合は、再開や書き出しの必要がないため記録を残さない
+            self.journal.finish(
+                self.state, keep=self.state != JOB_DONE or self.failed > 0
+            )
+        if self.metrics:
+            self.metrics.json_line({"event": "job", **self.summary()})
+            self.metrics.close()
+
+    def record(self, image_path, result, error):
+        """1ファイルの結果を集計し、メトリクスを出力する"""
+        with self.lock:
+            self.completed += 1
+            if error is None:
+                self.succeeded += 1
+                if result.get("cached"):
+                    self.cached += 1
+                for name, seconds in result.get("stages", {}).items():
+                    self.stage_totals[name] = (
+                        self.stage_totals.get(name, 0.0) + seconds
+                    )
+            else:
+                self.failed += 1
+
+        if self.journal:
+            self.journal.file_finished(image_path, error)
+        if self.metrics:
+            record = {
+                "event": "file",
+                "job_id": self.id,
+                "path": image_path,
+                "status": "done" if error is None else "error",
+            }
+            if error is None:
+                record["seconds"] = result.get("seconds")
+                record["cached"] = result.get("cached", False)
+                record["stages"] = result.get("stages", {})
+                record["output_path"] = result.get("output_path")
+                if "format" in result:
+                    record["format"] = result["format"]
+            else:
+                record["error"] = str(error)
+            self.metrics.json_line(record)
+
+    def elapsed(self):
+        """一時停止していた時間を除いた経過時間 (秒)"""
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or time.perf_counter()
+        paused = self.paused_seconds
+        if self.paused_at is not None:
+            paused += end - self.paused_at
+        return max(end - self.started_at - paused, 0.0)
+
+    def throughput(self):
+        """1秒あたりの処理枚数"""
+        elapsed = self.elapsed()
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """残りの処理にかかる時間の見込み (秒)。見積もれない場合は None"""
+        rate = self.throughput()
+        if rate <= 0:
+            return None
+        return (self.total - self.completed) / rate
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "total": self.total,
+            "completed": self.completed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cached": self.cached,
+            "elapsed": round(self.elapsed(), 4),
+            "throughput": round(self.throughput(), 3),
+            "stages": {k: round(v, 4) for k, v in self.stage_totals.items()},
+        }
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
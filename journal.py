@@ -0,0 +1,327 @@
+"""ジョブの進み具合をファイルに記録し、異常終了後に再開できるようにする
+
+ジョブごとに1つの JSON Lines ファイルへ、開始 (対象のパスと設定)・ファイルごとの
+状態の変化 (処理開始・完了・失敗)・終了を追記していく。追記のみのため、途中で
+強制終了しても欠けるのは最後の1行だけで、それまでの記録は読み込める。
+終了の記録のないジョブは、完了していないファイルと失敗したファイルだけを処理し直せる。
+失敗したファイルの一覧は、1行に1パスのテキストとして書き出せる
+(python -m processor の入力に "-" を指定して標準入力から渡せる)。
+
+    $ python -m journal list
+    $ python -m journal failures 3f2a9c -o failures.txt
+    $ python -m journal remaining 3f2a9c | python -m processor compress - -o out
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+DEFAULT_JOURNAL_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "edited_fig_jobs"
+)
+JOURNAL_EXTENSION = ".jsonl"
+# 保持するジャーナルの数 (古いものから削除する)
+MAX_JOURNALS = 20
+# ディスクへの同期の間隔 (秒)。書き込みごとに同期すると大量のファイルで遅くなる
+FSYNC_SECONDS = 1.0
+
+FILE_RUNNING = "running"
+FILE_DONE = "done"
+FILE_ERROR = "error"
+# 再開しないことを選んだジョブの終了の状態
+JOB_ABANDONED = "abandoned"
+
+
+class Journal:
+    """1つのジョブの記録。ワーカーの結果を受け取るスレッドから呼ばれる"""
+
+    def __init__(self, path):
+        self.path = path
+        self.id = os.path.splitext(os.path.basename(path))[0]
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.synced_at = time.monotonic()
+
+    @classmethod
+    def create(
+        cls,
+        image_paths,
+        operation,
+        options,
+        output_dir,
+        journal_dir=DEFAULT_JOURNAL_DIR,
+    ):
+        os.makedirs(journal_dir, exist_ok=True)
+        prune(journal_dir)
+        journal = cls(
+            os.path.join(
+                journal_dir, uuid.uuid4().hex[:12] + JOURNAL_EXTENSION
+            )
+        )
+        journal.write(
+            {
+                "event": "start",
+                "time": time.time(),
+                "operation": operation,
+                "options": options,
+                "output_dir": os.path.abspath(output_dir),
+                "paths": list(image_paths),
+            },
+            sync=True,
+        )
+        return journal
+
+    @classmethod
+    def reopen(cls, path, image_paths):
+        """記録のあるジョブを再開する。image_paths は今回処理するファイル"""
+        journal = cls(path)
+        journal.write(
+            {"event": "resume", "time": time.time(), "paths": image_paths},
+            sync=True,
+        )
+        return journal
+
+    def write(self, record, sync=False):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(line)
+            self.file.flush()
+            now = time.monotonic()
+            if sync or now - self.synced_at >= FSYNC_SECONDS:
+                os.fsync(self.file.fileno())
+                self.synced_at = now
+
+    def file_started(self, image_path):
+        self.write(
+            {"event": "file", "path": image_path, "status": FILE_RUNNING}
+        )
+
+    def file_finished(self, image_path, error=None):
+        record = {"event": "file", "path": image_path, "status": FILE_DONE}
+        if error is not None:
+            record.update(status=FILE_ERROR, error=str(error))
+        self.write(record)
+
+    def finish(self, state, keep=True):
+        """終了を記録する。keep が False の場合は記録を削除する"""
+        self.write(
+            {"event": "finish", "time": time.time(), "state": state},
+            sync=True,
+        )
+        self.close()
+        if not keep:
+            remove(self.path)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def load(path):
+    """記録を読み込み、ジョブの状態を dict で返す
+
+    statuses はパス -> 最後の状態、errors はパス -> 最後のエラー。
+    state は終了の状態 (終了の記録がなければ None)。
+    壊れた行 (書き込み途中で終了した最後の行など) は読み飛ばす。
+    """
+    job = {
+        "path": path,
+        "id": os.path.splitext(os.path.basename(path))[0],
+        "time": None,
+        "operation": None,
+        "options": {},
+        "output_dir": None,
+        "paths": [],
+        "statuses": {},
+        "errors": {},
+        "state": None,
+    }
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.debug(f"読み込めない行を飛ばします: {path}")
+                continue
+            event = record.get("event")
+            if event == "start":
+                for key in ["time", "operation", "options", "output_dir"]:
+                    job[key] = record[key]
+                job["paths"] = record["paths"]
+            elif event == "resume":
+                # 再開後にまた終了した場合は、終了の記録を取り消す
+                job["state"] = None
+            elif event == "file":
+                job["statuses"][record["path"]] = record["status"]
+                if record["status"] == FILE_ERROR:
+                    job["errors"][record["path"]] = record.get("error", "")
+            elif event == "finish":
+                job["state"] = record["state"]
+    return job
+
+
+def remaining(job):
+    """完了していないファイル (未着手・処理中・失敗) を元の順に返す"""
+    return [
+        path for path in job["paths"] if job["statuses"].get(path) != FILE_DONE
+    ]
+
+
+def failures(job):
+    """失敗したファイルの [(パス, エラー)] を返す"""
+    return [
+        (path, job["errors"].get(path, ""))
+        for path in job["paths"]
+        if job["statuses"].get(path) == FILE_ERROR
+    ]
+
+
+def list_journals(journal_dir=DEFAULT_JOURNAL_DIR):
+    """ジャーナルのパスを新しい順に返す"""
+    try:
+        names = os.listdir(journal_dir)
+    except FileNotFoundError:
+        return []
+    paths = [
+        os.path.join(journal_dir, name)
+        for name in names
+        if name.endswith(JOURNAL_EXTENSION)
+    ]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def find_resumable(journal_dir=DEFAULT_JOURNAL_DIR):
+    """終了の記録がなく、完了していないファイルのある最新のジョブを返す"""
+    for path in list_journals(journal_dir):
+        try:
+            job = load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"ジャーナルを読み込めません ({path}): {e}")
+            continue
+        if job["state"] is None and job["operation"] and remaining(job):
+            return job
+    return None
+
+
+def find_journal(key, journal_dir=DEFAULT_JOURNAL_DIR):
+    """パスまたはジョブIDの先頭部分からジャーナルのパスを求める"""
+    if os.path.isfile(key):
+        return key
+    matches = [
+        path
+        for path in list_journals(journal_dir)
+        if os.path.basename(path).startswith(key)
+    ]
+    if not matches:
+        raise ValueError(f"ジョブが見つかりません: {key}")
+    if len(matches) > 1:
+        raise ValueError(f"該当するジョブが複数あります: {key}")
+    return matches[0]
+
+
+def abandon(path):
+    """再開しないジョブとして終了を記録する (失敗の一覧は書き出せるよう残す)"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(
+            json.dumps(
+                {
+                    "event": "finish",
+                    "time": time.time(),
+                    "state": JOB_ABANDONED,
+                }
+            )
+            + "\n"
+        )
+
+
+def write_path_list(path, image_paths):
+    """1行に1パスで書き出す"""
+    with open(path, "w", encoding="utf-8") as f:
+        for image_path in image_paths:
+            f.write(image_path + "\n")
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.debug(f"ジャーナルを削除できません ({path}): {e}")
+
+
+def prune(journal_dir, keep=MAX_JOURNALS):
+    """新しいジョブのために、古いジャーナルを keep - 1 件まで減らす"""
+    for path in list_journals(journal_dir)[max(keep - 1, 0) :]:
+        remove(path)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m journal",
+        description="ジョブの記録の一覧・失敗したファイルの書き出しを行います。",
+    )
+    parser.add_argument("--journal-dir", default=DEFAULT_JOURNAL_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="ジョブの一覧")
+    for name, text in [
+        ("failures", "失敗したファイルの一覧"),
+        ("remaining", "完了していないファイル (失敗を含む) の一覧"),
+    ]:
+        subparser = subparsers.add_parser(name, help=text)
+        subparser.add_argument("job", help="ジョブIDの先頭部分またはパス")
+        subparser.add_argument(
+            "-o", "--output", help="書き出し先 (省略時は標準出力)"
+        )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "list":
+        for path in list_journals(args.journal_dir):
+            job = load(path)
+            done = sum(
+                1 for status in job["statuses"].values() if status == FILE_DONE
+            )
+            started = (
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(job["time"]))
+                if job["time"]
+                else "-"
+            )
+            print(
+                f"{job['id']}  {started}  {job['operation']}  "
+                f"{done}/{len(job['paths'])}  失敗: {len(failures(job))}  "
+                f"{job['state'] or '未完了'}"
+            )
+        return 0
+
+    try:
+        job = load(find_journal(args.job, args.journal_dir))
+    except (OSError, ValueError) as e:
+        logger.error(str(e))
+        return 1
+    if args.command == "failures":
+        image_paths = [path for path, _ in failures(job)]
+    else:
+        image_paths = remaining(job)
+    if args.output:
+        write_path_list(args.output, image_paths)
+    else:
+        for image_path in image_paths:
+            print(image_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
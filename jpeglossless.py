@@ -0,0 +1,263 @@
+"""JPEGを再エンコードせずに行う処理 (向きの補正・メタデータの削除・再パック)
+
+メタデータの削除はマーカーのセグメント単位で行い、画像データ (スキャン) には触れない。
+EXIFの向きに合わせた回転・反転と、プログレッシブ化・ハフマン表の最適化は
+DCT係数のまま変換する jpegtran がある場合に行う。jpegtran がない場合や、
+画像のサイズがMCUの倍数でなく無劣化で回転できない場合は、回転せずに
+EXIFの向きの指定を残す (表示は正しいまま、画質も変わらない)。
+"""
+
+import shutil
+import struct
+import subprocess
+
+from PIL import Image
+
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+EXIF_ORIENTATION = 0x0112
+JPEG_EXTENSIONS = [".jpg", ".jpeg"]
+JPEGTRAN_TIMEOUT = 60
+_jpegtran_warned = False
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+SOS = 0xDA
+APP0 = 0xE0
+APP1 = 0xE1
+APP2 = 0xE2
+APP14 = 0xEE
+COM = 0xFE
+# 長さを持たない単独のマーカー (TEM, RST0-7)
+STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+# 削除しても画素の解釈が変わらないセグメント (JFIF・ICC・Adobe以外のAPPnとコメント)
+METADATA_MARKERS = {*range(APP1, APP14), 0xEF, COM}
+ICC_PROFILE = b"ICC_PROFILE\x00"
+EXIF_HEADER = b"Exif\x00\x00"
+
+# EXIFの向き -> jpegtran の変換
+ORIENTATION_TRANSFORMS = {
+    2: ["-flip", "horizontal"],
+    3: ["-rotate", "180"],
+    4: ["-flip", "vertical"],
+    5: ["-transpose"],
+    6: ["-rotate", "90"],
+    7: ["-transverse"],
+    8: ["-rotate", "270"],
+}
+
+
+def is_jpeg_path(path):
+    return path.lower().endswith(tuple(JPEG_EXTENSIONS))
+
+
+def find_jpegtran():
+    return shutil.which("jpegtran")
+
+
+def split_segments(data):
+    """最初のスキャンの前までのセグメントと、それ以降のデータに分ける
+
+    戻り値は ([(マーカー, セグメント全体のバイト列), ...], 残りのデータ)。
+    """
+    if not data.startswith(SOI):
+        raise ValueError("JPEGではありません")
+    segments = []
+    offset = len(SOI)
+    while offset < len(data):
+        if data[offset] != 0xFF:
+            raise ValueError(f"マーカーが見つかりません (位置: {offset})")
+        # マーカーの前の埋め草 (0xFF の連続) を飛ばす
+        start = offset
+        while data[offset + 1] == 0xFF:
+            offset += 1
+        marker = data[offset + 1]
+        if marker == SOS:
+            return segments, data[offset:]
+        if marker in STANDALONE_MARKERS:
+            end = offset + 2
+        else:
+            (length,) = struct.unpack_from(">H", data, offset + 2)
+            end = offset + 2 + length
+        segments.append((marker, data[start:end]))
+        offset = end
+    raise ValueError("画像データがありません")
+
+
+def join_segments(segments, scan):
+    return b"".join([SOI, *(segment for _, segment in segments), scan])
+
+
+def exif_payload(segments):
+    """EXIFのセグメントの (位置, TIFF部分の開始位置) を返す。なければ None"""
+    for i, (marker, segment) in enumerate(segments):
+        if marker == APP1 and segment[4:10] == EXIF_HEADER:
+            return i, 10
+    return None
+
+
+def find_orientation(segment, tiff_offset):
+    """EXIFの0番目のIFDから向きの (値, 値の位置) を返す。なければ (1, None)"""
+    tiff = segment[tiff_offset:]
+    if tiff[:2] == b"II":
+        endian = "<"
+    elif tiff[:2] == b"MM":
+        endian = ">"
+    else:
+        return 1, None
+    try:
+        (ifd_offset,) = struct.unpack_from(f"{endian}I", tiff, 4)
+        (count,) = struct.unpack_from(f"{endian}H", tiff, ifd_offset)
+        for i in range(count):
+            entry = ifd_offset + 2 + i * 12
+            tag, _, _ = struct.unpack_from(f"{endian}HHI", tiff, entry)
+            if tag == EXIF_ORIENTATION:
+                (value,) = struct.unpack_from(f"{endian}H", tiff, entry + 8)
+                return value, tiff_offset + entry + 8
+    except struct.error:
+        logger.debug("EXIFのIFDが壊れています")
+    return 1, None
+
+
+def read_orientation(segments):
+    found = exif_payload(segments)
+    if found is None:
+        return 1
+    i, tiff_offset = found
+    return find_orientation(segments[i][1], tiff_offset)[0]
+
+
+def reset_orientation(segments):
+    """EXIFの向きをその場で 1 (補正不要) に書き換える。他のタグはそのまま残す"""
+    found = exif_payload(segments)
+    if found is None:
+        return segments
+    i, tiff_offset = found
+    marker, segment = segments[i]
+    value, position = find_orientation(segment, tiff_offset)
+    if position is None or value == 1:
+        return segments
+    endian = "<" if segment[tiff_offset : tiff_offset + 2] == b"II" else ">"
+    patched = bytearray(segment)
+    struct.pack_into(f"{endian}H", patched, position, 1)
+    return segments[:i] + [(marker, bytes(patched))] + segments[i + 1 :]
+
+
+def orientation_segment(orientation):
+    """向きだけを含む最小のEXIFのセグメントを作る"""
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = orientation
+    payload = exif.tobytes()
+    return APP1, b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def strip_segments(segments, orientation=1):
+    """メタデータのセグメントを除く。ICCプロファイル (APP2) は色の解釈に必要なため残す
+
+    向きの補正が済んでいない場合は、向きだけのEXIFを入れ直す。
+    """
+    kept = []
+    for marker, segment in segments:
+        if marker == APP2 and segment[4:16] == ICC_PROFILE:
+            kept.append((marker, segment))
+        elif marker not in METADATA_MARKERS:
+            kept.append((marker, segment))
+    if orientation != 1:
+        # JFIF (APP0) の直後に置く
+        position = 1 if kept and kept[0][0] == APP0 else 0
+        kept.insert(position, orientation_segment(orientation))
+    return kept
+
+
+def truncate_after_eoi(scan):
+    """EOIより後ろのデータ (マルチピクチャの付属画像など) を除く
+
+    画像データ中の 0xFF は 0xFF00 にエスケープされるため、最初のEOIが画像の終わり。
+    """
+    end = scan.find(EOI)
+    return scan if end < 0 else scan[: end + len(EOI)]
+
+
+def run_jpegtran(jpegtran, data, args):
+    completed = subprocess.run(
+        [jpegtran, "-copy", "all", *args],
+        input=data,
+        capture_output=True,
+        timeout=JPEGTRAN_TIMEOUT,
+        check=False,
+    )
+    if completed.returncode != 0 or not completed.stdout:
+        raise RuntimeError(
+            completed.stderr.decode("utf-8", "replace").strip()
+            or f"jpegtran が終了コード {completed.returncode} で終了しました"
+        )
+    return completed.stdout
+
+
+def warn_missing_jpegtran():
+    # バッチの全ファイルで同じ警告を繰り返さない
+    global _jpegtran_warned
+    if not _jpegtran_warned:
+        _jpegtran_warned = True
+        logger.warning(
+            "jpegtran がないため、回転とプログレッシブ化・最適化は行いません"
+        )
+
+
+def transform(
+    data, rotate=True, strip=True, progressive=False, optimize=False
+):
+    """(変換後のデータ, 処理内容の dict) を返す
+
+    dict の orientation は元の向き、rotated は回転・反転したか、
+    repacked はプログレッシブ化・ハフマン表の最適化を行ったか、
+    stripped_bytes は削除したメタデータのバイト数。
+    """
+    segments, scan = split_segments(data)
+    orientation = read_orientation(segments)
+    info = {
+        "orientation": orientation,
+        "rotated": False,
+        "repacked": False,
+        "stripped_bytes": 0,
+    }
+
+    rotate_args = []
+    if rotate and orientation in ORIENTATION_TRANSFORMS:
+        # サイズがMCUの倍数でない場合は端を削らずに失敗させる
+        rotate_args = ["-perfect", *ORIENTATION_TRANSFORMS[orientation]]
+    repack_args = (["-progressive"] if progressive else []) + (
+        ["-optimize"] if optimize else []
+    )
+    if rotate_args or repack_args:
+        jpegtran = find_jpegtran()
+        if jpegtran is None:
+            warn_missing_jpegtran()
+        else:
+            try:
+                data = run_jpegtran(jpegtran, data, rotate_args + repack_args)
+                info["rotated"] = bool(rotate_args)
+            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                if not rotate_args:
+                    raise
+                logger.info(
+                    f"無劣化で回転できないため向きの指定を残します: {e}"
+                )
+                if repack_args:
+                    data = run_jpegtran(jpegtran, data, repack_args)
+            info["repacked"] = bool(repack_args)
+            segments, scan = split_segments(data)
+
+    if info["rotated"]:
+        orientation = 1
+        segments = reset_orientation(segments)
+    if strip:
+        before = sum(len(segment) for _, segment in segments) + len(scan)
+        segments = strip_segments(segments, orientation)
+        scan = truncate_after_eoi(scan)
+        after = sum(len(segment) for _, segment in segments) + len(scan)
+        info["stripped_bytes"] = max(before - after, 0)
+    return join_segments(segments, scan), info
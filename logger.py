@@ -1,15 +1,34 @@
+import json
 import logging
 
+
 class Logger:
-    def __init__(self, log_level=logging.DEBUG):
-        self.logger = logging.getLogger(__name__)
+    def __init__(
+        self,
+        log_level=logging.DEBUG,
+        name=__name__,
+        filename=None,
+        fmt="[%(levelname)s] %(message)s",
+    ):
+        self.logger = logging.getLogger(name)
         self.logger.setLevel(log_level)
 
-        handler = logging.StreamHandler()
-        handler.setLevel(log_level)
-        formatter = logging.Formatter('[%(levelname)s] %(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        # 複数のモジュールから生成してもハンドラが重複しないようにする
+        if not self.logger.handlers:
+            if filename:
+                handler = logging.FileHandler(filename, encoding="utf-8")
+            else:
+                handler = logging.StreamHandler()
+            formatter = logging.Formatter(fmt)
+            handler.setFormatter(formatter)
+            self.logger.addHandler(handler)
+
+        # 専用のロガー (メトリクスなど) は通常のログに混ぜない
+        if name != __name__:
+            self.logger.propagate = False
+
+    def set_level(self, log_level):
+        self.logger.setLevel(log_level)
 
     def debug(self, message):
         self.logger.debug(message)
@@ -26,6 +45,18 @@ class Logger:
     def critical(self, message):
         self.logger.critical(message)
 
+    def json_line(self, record):
+        """dict を1行のJSONとして出力する (JSON Lines)"""
+        self.logger.info(
+            json.dumps(record, ensure_ascii=False, sort_keys=True)
+        )
+
+    def close(self):
+        for handler in list(self.logger.handlers):
+            handler.close()
+            self.logger.removeHandler(handler)
+
+
 if __name__ == "__main__":
     logger = Logger()
     logger.debug("debug message")
@@ -1,21 +1,48 @@
 import os
+import sys
 import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from tkinter.scrolledtext import ScrolledText
-
-import tkinterdnd2
-from PIL import Image
-from tkinterdnd2 import DND_FILES
 
+import presets
+import settings
+import sources
+from file_list import (
+    STATUS_DONE,
+    STATUS_ERROR,
+    STATUS_RUNNING,
+    PathStore,
+    ThumbnailGrid,
+    VirtualFileList,
+)
+from job import Job, format_eta
 from logger import Logger
+from metadata import MetadataProber, RunningSummary, format_bytes
 
 log_level = "WARNING"
 logger = Logger(log_level)
 
-DEFAULT_COMPRESS_RATE = 7
-DEFAULT_RESIZE_VALUE = 800
-PNG_COLORS = 256
+DEFAULT_COMPRESS_RATE = settings.DEFAULT_COMPRESS_RATE
+DEFAULT_RESIZE_VALUE = settings.DEFAULT_RESIZE_VALUE
+SOURCE_POLL_MS = 100
+METADATA_POLL_MS = 200
+# 設定の変更から概算の開始までの待ち時間 (スライダーの操作中は計算しない)
+ESTIMATE_DELAY_MS = 300
+ESTIMATE_POLL_MS = 100
+# リサイズの設定の変更から、リサイズ後の推定の再計算までの待ち時間
+PROJECTION_DELAY_MS = 200
+DEFAULT_TARGET_KB = 200
+# 省メモリモードでのワーカー1つあたりのメモリ上限
+LOW_MEMORY_LIMIT = 512 * 1024 * 1024
+METRICS_FILENAME = "edited_metrics.jsonl"
+OUTPUT_ARCHIVE_NAME = "edited_fig.zip"
+# 無劣化JPEGタブの設定 (jpegtran が必要な処理は、ない場合は行わない)
+LOSSLESS_SETTINGS = [
+    ("lossless_rotate", "EXIFの向きに合わせて回転 (jpegtran)"),
+    ("strip_metadata", "EXIF・GPSなどのメタデータを削除"),
+    ("progressive", "プログレッシブ形式に変換 (jpegtran)"),
+    ("optimize_huffman", "ハフマン表を最適化 (jpegtran)"),
+]
 
 
 class ImageProcessorApp:
@@ -24,22 +51,166 @@ class ImageProcessorApp:
         self.root.title("画像処理アプリ")
         self.root.geometry("800x500")
 
-        # 出力ディレクトリの設定
+        # 出力ディレクトリの設定 (作成は実行時に行う)
         self.output_dir = os.path.join(
             os.path.expanduser("~"), "Downloads", "edited_fig"
         )
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
 
-        # ドラッグ&ドロップ対応
-        self.root.drop_target_register(DND_FILES)
-        self.root.dnd_bind("<<Drop>>", self.drop)
+        # ドラッグ&ドロップ対応 (tkinterdnd2 のウィンドウの場合のみ)
+        if hasattr(self.root, "drop_target_register"):
+            from tkinterdnd2 import DND_FILES
+
+            self.root.drop_target_register(DND_FILES)
+            self.root.dnd_bind("<<Drop>>", self.drop)
+
+        # 画像ファイルパスリスト (重複を除き、処理状態も保持する)
+        self.image_paths = PathStore()
+        # フォルダやアーカイブの中の列挙はバックグラウンドで行う
+        self.scanner = sources.SourceScanner()
+
+        # 画像のサイズなどはバックグラウンドで取得する
+        self.metadata = MetadataProber()
+        self.metadata_errors = 0
+        # 取得済みの情報の集計 (届いた結果だけを加える)
+        self.summary = RunningSummary()
+        self.projection_after_id = None
+
+        # プレビューのサムネイルもバックグラウンドで作成する
+        # (サムネイルの表示を初めて選択したときに作る)
+        self.thumbnail_grid = None
+
+        # 圧縮後のサイズと画質の概算もバックグラウンドで計算する
+        # (初めてファイルが追加されたときに作る)
+        self.estimator = None
+        self.estimate_after_id = None
+        self.last_estimate_quality = None
+
+        # 実行中のジョブ (一時停止・取り消しの要求を処理スレッドに伝える)
+        self.job = None
+        # 直前のジョブで失敗したファイル (一覧の書き出し用)
+        self.failed_paths = []
+
+        # UIの構築 (各タブの中身は初めて選択されたときに作る)
+        self.tab_builders = {}
+        self.create_variables()
+        self.summary.set_resize(*self.get_resize_setting())
+        self.create_ui()
+        self.root.after(SOURCE_POLL_MS, self.poll_sources)
+        self.root.after(METADATA_POLL_MS, self.poll_metadata)
+        self.root.after(ESTIMATE_POLL_MS, self.poll_estimate)
+        # 前回のジョブが途中で終了していれば、ウィンドウの表示後に再開を確認する
+        self.root.after_idle(self.offer_resume)
 
-        # 画像ファイルパスリスト
-        self.image_paths = []
+    def create_variables(self):
+        """各タブの設定の変数を作る
 
-        # UIの構築
-        self.create_ui()
+        タブの中身を作る前でも、設定の取得やプリセットの反映ができるようにする。
+        """
+        # 圧縮タブ
+        self.compress_quality = tk.DoubleVar(value=DEFAULT_COMPRESS_RATE)
+        self.use_target_size = tk.BooleanVar(value=False)
+        self.target_kb = tk.IntVar(value=DEFAULT_TARGET_KB)
+        self.quantize_method = tk.StringVar(
+            value=settings.DEFAULT_OPTIONS["quantize_method"]
+        )
+        self.shared_palette = tk.BooleanVar(value=False)
+
+        # 整数の値が変わったときだけ概算し直す
+        def update_estimate(*args):
+            if int(self.compress_quality.get()) != self.last_estimate_quality:
+                self.schedule_estimate()
+
+        self.compress_quality.trace_add("write", update_estimate)
+        self.quantize_method.trace_add(
+            "write", lambda *args: self.schedule_estimate()
+        )
+
+        # 形式変更タブ
+        self.target_format = tk.StringVar(value="jpeg")
+        self.auto_min_psnr = tk.DoubleVar(
+            value=settings.DEFAULT_OPTIONS["auto_min_psnr"]
+        )
+        self.icc_mode = tk.StringVar(
+            value=settings.DEFAULT_OPTIONS["icc_mode"]
+        )
+
+        # リサイズタブ
+        self.resize_by = tk.StringVar(value="width")
+        self.resize_value = tk.IntVar(value=DEFAULT_RESIZE_VALUE)
+        self.fast_resize = tk.BooleanVar(
+            value=settings.DEFAULT_OPTIONS["fast_resize"]
+        )
+
+        # 設定が変わったらリサイズ後の推定サイズを更新する
+        self.resize_by.trace_add(
+            "write", lambda *args: self.schedule_projection()
+        )
+        self.resize_value.trace_add(
+            "write", lambda *args: self.schedule_projection()
+        )
+
+        # パイプラインタブ
+        self.pipeline_steps = {
+            step: tk.BooleanVar(value=True) for step in settings.PIPELINE_STEPS
+        }
+        self.preset_name = tk.StringVar()
+
+        # 派生サイズタブ
+        self.derivative_widths = tk.StringVar(
+            value=", ".join(
+                str(w) for w in settings.DEFAULT_OPTIONS["derivative_widths"]
+            )
+        )
+        self.derivative_formats = {
+            image_format: tk.BooleanVar(
+                value=image_format
+                in settings.DEFAULT_OPTIONS["derivative_formats"]
+            )
+            for image_format in settings.TARGET_FORMATS
+        }
+
+        # 無劣化JPEGタブ
+        self.lossless_settings = {
+            name: tk.BooleanVar(value=settings.DEFAULT_OPTIONS[name])
+            for name, _ in LOSSLESS_SETTINGS
+        }
+
+    def build_thumbnail_grid(self, view_control):
+        """サムネイルの表示を初めて選択したときに作る"""
+        if self.thumbnail_grid is not None or view_control.select() != str(
+            self.thumbnail_frame
+        ):
+            return
+        import thumbnails
+
+        self.thumbnail_grid = ThumbnailGrid(
+            self.thumbnail_frame,
+            self.image_paths,
+            thumbnails.ThumbnailLoader(),
+        )
+        self.thumbnail_grid.pack(fill=tk.BOTH, expand=True)
+
+    def get_estimator(self):
+        if self.estimator is None:
+            import estimate
+
+            self.estimator = estimate.LiveEstimator()
+        return self.estimator
+
+    def add_tab(self, text, setup):
+        """タブを追加し、中身を作る関数 setup は初めて選択されたときに呼ぶ"""
+        tab = ttk.Frame(self.tab_control)
+        self.tab_control.add(tab, text=text)
+        self.tab_builders[str(tab)] = setup
+        return tab
+
+    def build_tab(self, event=None):
+        setup = self.tab_builders.pop(str(self.tab_control.select()), None)
+        if setup is not None:
+            setup()
+
+    def is_tab_built(self, tab):
+        return str(tab) not in self.tab_builders
 
     def create_ui(self):
         logger.debug("create_ui")
@@ -57,6 +228,11 @@ class ImageProcessorApp:
         )
         select_btn.pack(side=tk.LEFT, padx=5)
 
+        folder_btn = ttk.Button(
+            top_frame, text="フォルダ選択", command=self.select_folder
+        )
+        folder_btn.pack(side=tk.LEFT, padx=5)
+
         # 出力ディレクトリ設定
         ttk.Label(top_frame, text="出力先:").pack(side=tk.LEFT, padx=(20, 5))
         self.output_entry = ttk.Entry(top_frame)
@@ -68,31 +244,55 @@ class ImageProcessorApp:
         )
         output_btn.pack(side=tk.LEFT, padx=5)
 
-        # タブコントロール
-        self.tab_control = ttk.Notebook(main_frame)
-        self.tab_control.pack(fill=tk.BOTH, expand=True, pady=10)
+        # 出力を1つのZIPにまとめる
+        self.archive_output = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            top_frame, text="ZIPにまとめる", variable=self.archive_output
+        ).pack(side=tk.LEFT, padx=5)
 
-        # 圧縮タブ
-        self.compress_tab = ttk.Frame(self.tab_control)
-        self.tab_control.add(self.compress_tab, text="圧縮")
-        self.setup_compress_tab()
-
-        # 形式変更タブ
-        self.format_tab = ttk.Frame(self.tab_control)
-        self.tab_control.add(self.format_tab, text="形式変更")
-        self.setup_format_tab()
+        # 入力のフォルダの構成を出力先にも再現する
+        self.mirror_dirs = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            top_frame, text="フォルダ構成を保つ", variable=self.mirror_dirs
+        ).pack(side=tk.LEFT, padx=5)
 
-        # リサイズタブ
-        self.resize_tab = ttk.Frame(self.tab_control)
-        self.tab_control.add(self.resize_tab, text="リサイズ")
-        self.setup_resize_tab()
+        # タブコントロール (最初に表示する圧縮タブ以外は選択時に中身を作る)
+        self.tab_control = ttk.Notebook(main_frame)
+        self.tab_control.pack(fill=tk.BOTH, expand=True, pady=10)
+        self.compress_tab = self.add_tab("圧縮", self.setup_compress_tab)
+        self.format_tab = self.add_tab("形式変更", self.setup_format_tab)
+        self.resize_tab = self.add_tab("リサイズ", self.setup_resize_tab)
+        self.pipeline_tab = self.add_tab(
+            settings.OPERATION_PIPELINE, self.setup_pipeline_tab
+        )
+        self.derivatives_tab = self.add_tab(
+            settings.OPERATION_DERIVATIVES, self.setup_derivatives_tab
+        )
+        self.lossless_tab = self.add_tab(
+            settings.OPERATION_LOSSLESS, self.setup_lossless_tab
+        )
+        self.build_tab()
+        self.tab_control.bind("<<NotebookTabChanged>>", self.build_tab)
 
         # ファイルリスト表示
         file_frame = ttk.LabelFrame(main_frame, text="選択されたファイル")
         file_frame.pack(fill=tk.BOTH, expand=True, pady=5)
 
-        self.file_list = ScrolledText(file_frame, height=5)
-        self.file_list.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        # 一覧とサムネイルを切り替えて表示する
+        view_control = ttk.Notebook(file_frame)
+        view_control.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        self.file_list = VirtualFileList(
+            view_control, self.image_paths, height=5
+        )
+        view_control.add(self.file_list, text="一覧")
+
+        self.thumbnail_frame = ttk.Frame(view_control)
+        view_control.add(self.thumbnail_frame, text="サムネイル")
+        view_control.bind(
+            "<<NotebookTabChanged>>",
+            lambda event: self.build_thumbnail_grid(view_control),
+        )
 
         # 実行ボタン
         execute_frame = ttk.Frame(main_frame)
@@ -103,6 +303,41 @@ class ImageProcessorApp:
         )
         self.progress.pack(fill=tk.X, side=tk.LEFT, expand=True, padx=5)
 
+        # 並列処理の設定
+        ttk.Label(execute_frame, text="実行方式:").pack(side=tk.LEFT, padx=5)
+        self.executor_type = tk.StringVar(value=settings.DEFAULT_EXECUTOR)
+        ttk.Combobox(
+            execute_frame,
+            textvariable=self.executor_type,
+            values=settings.EXECUTOR_TYPES,
+            state="readonly",
+            width=8,
+        ).pack(side=tk.LEFT, padx=5)
+
+        ttk.Label(execute_frame, text="並列数:").pack(side=tk.LEFT, padx=5)
+        self.max_workers = tk.IntVar(value=settings.DEFAULT_MAX_WORKERS)
+        ttk.Spinbox(
+            execute_frame,
+            from_=1,
+            to=settings.DEFAULT_MAX_WORKERS * 2,
+            textvariable=self.max_workers,
+            width=4,
+        ).pack(side=tk.LEFT, padx=5)
+
+        # 巨大な画像を帯状に処理し、同時に処理する量をメモリ上限で調整する
+        self.low_memory = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            execute_frame, text="省メモリ", variable=self.low_memory
+        ).pack(side=tk.LEFT, padx=5)
+
+        # 同じ画像・同じ設定の処理結果を再利用する (CLIと同じく既定では使わない)
+        self.use_cache = tk.BooleanVar(
+            value=settings.DEFAULT_OPTIONS["use_cache"]
+        )
+        ttk.Checkbutton(
+            execute_frame, text="キャッシュ", variable=self.use_cache
+        ).pack(side=tk.LEFT, padx=5)
+
         self.execute_btn = ttk.Button(
             execute_frame, text="実行", command=self.execute
         )
@@ -114,6 +349,36 @@ class ImageProcessorApp:
         )
         cancel_btn.pack(side=tk.LEFT, padx=5)
 
+        # 実行中の状態 (処理速度と残り時間) と一時停止
+        job_frame = ttk.Frame(main_frame)
+        job_frame.pack(fill=tk.X)
+
+        self.job_status_label = ttk.Label(job_frame, text="")
+        self.job_status_label.pack(side=tk.LEFT, padx=5)
+
+        self.pause_btn = ttk.Button(
+            job_frame,
+            text="一時停止",
+            command=self.toggle_pause,
+            state=tk.DISABLED,
+        )
+        self.pause_btn.pack(side=tk.RIGHT, padx=5)
+
+        # 失敗したファイルの一覧を書き出す (python -m processor に "-" で渡せる)
+        self.export_failures_btn = ttk.Button(
+            job_frame,
+            text="失敗の一覧を保存",
+            command=self.export_failures,
+            state=tk.DISABLED,
+        )
+        self.export_failures_btn.pack(side=tk.RIGHT, padx=5)
+
+        # ファイルごとの段階別の処理時間を出力ディレクトリに書き出す
+        self.export_metrics = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            job_frame, text="計測結果を出力", variable=self.export_metrics
+        ).pack(side=tk.RIGHT, padx=5)
+
     def setup_compress_tab(self):
         logger.debug("setup_compress_tab")
         frame = ttk.Frame(self.compress_tab, padding="10")
@@ -123,7 +388,6 @@ class ImageProcessorApp:
             row=0, column=0, sticky=tk.W, pady=10
         )
 
-        self.compress_quality = tk.DoubleVar(value=DEFAULT_COMPRESS_RATE)
         quality_scale = ttk.Scale(
             frame,
             from_=1,
@@ -150,8 +414,58 @@ class ImageProcessorApp:
             text="低い値ほど低品質になり、ファイルサイズが小さくなります。",
         ).grid(row=1, column=0, columnspan=3, sticky=tk.W, pady=10)
 
+        # 目標サイズ指定 (指定したサイズに収まる最高の品質を探索する)
+        ttk.Checkbutton(
+            frame,
+            text="目標サイズを指定 (KB以下):",
+            variable=self.use_target_size,
+        ).grid(row=2, column=0, sticky=tk.W, pady=10)
+
+        ttk.Entry(frame, textvariable=self.target_kb, width=10).grid(
+            row=2, column=1, sticky=tk.W, padx=5
+        )
+
+        # PNGの減色エンジン
+        ttk.Label(frame, text="PNGの減色方式:").grid(
+            row=3, column=0, sticky=tk.W, pady=10
+        )
+        # 使えるエンジンの確認には Pillow が必要なため、一覧を開くときに取得する
+        quantize_combo = ttk.Combobox(
+            frame,
+            textvariable=self.quantize_method,
+            values=[self.quantize_method.get()],
+            state="readonly",
+            width=14,
+            postcommand=lambda: self.load_quantize_methods(quantize_combo),
+        )
+        quantize_combo.grid(row=3, column=1, sticky=tk.W, padx=5)
+
+        ttk.Checkbutton(
+            frame,
+            text="共通のパレットを使う (スクリーンショットやアイコン向け)",
+            variable=self.shared_palette,
+        ).grid(row=4, column=0, columnspan=3, sticky=tk.W)
+
+        # 数枚のサンプルを現在の設定でエンコードした概算
+        estimate_frame = ttk.LabelFrame(frame, text="概算", padding="5")
+        estimate_frame.grid(
+            row=5, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10
+        )
+        self.estimate_label = ttk.Label(
+            estimate_frame, text="ファイルを選択してください"
+        )
+        self.estimate_label.pack(anchor=tk.W)
+
+    def load_quantize_methods(self, combo):
+        import quantize
+
+        combo.config(values=quantize.available_methods())
+
     def setup_format_tab(self):
         logger.debug("setup_format_tab")
+        import autoformat
+        import colorconvert
+
         frame = ttk.Frame(self.format_tab, padding="10")
         frame.pack(fill=tk.BOTH, expand=True)
 
@@ -159,14 +473,37 @@ class ImageProcessorApp:
             row=0, column=0, sticky=tk.W, pady=10
         )
 
-        self.target_format = tk.StringVar(value="jpeg")
-        formats = ["jpeg", "png", "webp", "tiff", "bmp", "gif"]
-
         format_combo = ttk.Combobox(
-            frame, textvariable=self.target_format, values=formats
+            frame,
+            textvariable=self.target_format,
+            values=settings.TARGET_FORMATS + [autoformat.AUTO_FORMAT],
         )
         format_combo.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5)
 
+        # auto: 画像ごとに JPEG/WebP/PNG を試し、基準の画質を満たす最小の形式を選ぶ
+        ttk.Label(frame, text="auto の画質の下限 (PSNR dB):").grid(
+            row=1, column=0, sticky=tk.W, pady=10
+        )
+        ttk.Entry(frame, textvariable=self.auto_min_psnr, width=10).grid(
+            row=1, column=1, sticky=tk.W, padx=5
+        )
+        ttk.Label(
+            frame,
+            text="auto では圧縮の品質の設定で試し、最も小さい形式で保存します。",
+        ).grid(row=2, column=0, columnspan=2, sticky=tk.W)
+
+        # keep: ICCプロファイルを引き継ぐ / srgb: sRGBに変換して元のプロファイルを除く
+        ttk.Label(frame, text="ICCプロファイル:").grid(
+            row=3, column=0, sticky=tk.W, pady=10
+        )
+        ttk.Combobox(
+            frame,
+            textvariable=self.icc_mode,
+            values=colorconvert.ICC_MODES,
+            state="readonly",
+            width=8,
+        ).grid(row=3, column=1, sticky=tk.W, padx=5)
+
     def setup_resize_tab(self):
         logger.debug("setup_resize_tab")
         frame = ttk.Frame(self.resize_tab, padding="10")
@@ -182,7 +519,6 @@ class ImageProcessorApp:
 
         resize_frame = ttk.Frame(frame)
         resize_frame.pack(fill=tk.X, pady=10)
-        self.resize_by = tk.StringVar(value="width")
         ttk.Radiobutton(
             resize_frame,
             text="幅を指定",
@@ -196,7 +532,6 @@ class ImageProcessorApp:
             value="height",
         ).grid(row=1, column=0, padx=5, sticky=tk.W)
 
-        self.resize_value = tk.IntVar(value=DEFAULT_RESIZE_VALUE)
         ttk.Entry(resize_frame, textvariable=self.resize_value, width=10).grid(
             row=0, column=1, rowspan=2, padx=5
         )
@@ -204,6 +539,155 @@ class ImageProcessorApp:
             row=0, column=2, rowspan=2, padx=5, sticky=tk.W
         )
 
+        # 高速縮小 (JPEGの縮小デコード + 段階的な縮小)
+        ttk.Checkbutton(
+            frame,
+            text="高速縮小 (画質よりも速度を優先)",
+            variable=self.fast_resize,
+        ).pack(anchor=tk.W, pady=5)
+
+        self.update_image_info()
+
+    def setup_pipeline_tab(self):
+        logger.debug("setup_pipeline_tab")
+        frame = ttk.Frame(self.pipeline_tab, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(
+            frame,
+            text="各タブの設定を使い、選択した処理をまとめて実行します。"
+            "(読み込みと保存は1回ずつ)",
+        ).grid(row=0, column=0, columnspan=4, sticky=tk.W, pady=10)
+
+        step_labels = {
+            settings.STEP_RESIZE: "リサイズ",
+            settings.STEP_CONVERT: "形式変更",
+            settings.STEP_COMPRESS: "圧縮",
+        }
+        for i, step in enumerate(settings.PIPELINE_STEPS):
+            ttk.Checkbutton(
+                frame,
+                text=f"{i + 1}. {step_labels[step]}",
+                variable=self.pipeline_steps[step],
+            ).grid(row=1, column=i, sticky=tk.W, padx=5)
+
+        # プリセットの保存と読み込み
+        ttk.Label(frame, text="プリセット:").grid(
+            row=2, column=0, sticky=tk.W, pady=10
+        )
+        self.preset_combo = ttk.Combobox(
+            frame, textvariable=self.preset_name, values=presets.list_presets()
+        )
+        self.preset_combo.grid(row=2, column=1, sticky=(tk.W, tk.E), padx=5)
+        ttk.Button(frame, text="読み込み", command=self.load_preset).grid(
+            row=2, column=2, padx=5
+        )
+        ttk.Button(frame, text="保存", command=self.save_preset).grid(
+            row=2, column=3, padx=5
+        )
+
+    def setup_derivatives_tab(self):
+        logger.debug("setup_derivatives_tab")
+        frame = ttk.Frame(self.derivatives_tab, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(
+            frame,
+            text="1回の読み込みで、指定した幅と形式の画像をまとめて作成します。"
+            "(画質は圧縮タブの設定)",
+        ).grid(row=0, column=0, columnspan=4, sticky=tk.W, pady=10)
+
+        ttk.Label(frame, text="幅 (カンマ区切り):").grid(
+            row=1, column=0, sticky=tk.W
+        )
+        ttk.Entry(frame, textvariable=self.derivative_widths).grid(
+            row=1, column=1, columnspan=3, sticky=(tk.W, tk.E), padx=5
+        )
+
+        ttk.Label(frame, text="形式:").grid(
+            row=2, column=0, sticky=tk.W, pady=10
+        )
+        for i, image_format in enumerate(settings.TARGET_FORMATS):
+            ttk.Checkbutton(
+                frame,
+                text=image_format,
+                variable=self.derivative_formats[image_format],
+            ).grid(row=2 + i // 3, column=1 + i % 3, sticky=tk.W, padx=5)
+
+    def setup_lossless_tab(self):
+        logger.debug("setup_lossless_tab")
+        frame = ttk.Frame(self.lossless_tab, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(
+            frame,
+            text="JPEGを再エンコードせずに処理します (画質は変わりません)。",
+        ).grid(row=0, column=0, sticky=tk.W, pady=10)
+
+        for row, (name, text) in enumerate(LOSSLESS_SETTINGS, start=1):
+            ttk.Checkbutton(
+                frame, text=text, variable=self.lossless_settings[name]
+            ).grid(row=row, column=0, sticky=tk.W)
+
+    def save_preset(self):
+        logger.debug("save_preset")
+        name = self.preset_name.get().strip()
+        if not name:
+            messagebox.showinfo("情報", "プリセット名を入力してください")
+            return
+        import processor
+
+        try:
+            presets.save_preset(
+                name, processor.recipe_from_options(self.get_options())
+            )
+        except Exception as e:
+            messagebox.showerror(
+                "エラー", f"プリセットの保存に失敗しました: {str(e)}"
+            )
+            return
+        self.preset_combo.config(values=presets.list_presets())
+
+    def load_preset(self):
+        logger.debug("load_preset")
+        name = self.preset_name.get().strip()
+        if not name:
+            return
+        try:
+            recipe = presets.load_preset(name)
+        except Exception as e:
+            messagebox.showerror(
+                "エラー", f"プリセットの読み込みに失敗しました: {str(e)}"
+            )
+            return
+        self.apply_recipe(recipe)
+
+    def apply_recipe(self, recipe):
+        """プリセットの設定を各タブに反映する"""
+        variables = {
+            "compress_quality": self.compress_quality,
+            "target_format": self.target_format,
+            "auto_min_psnr": self.auto_min_psnr,
+            "icc_mode": self.icc_mode,
+            "resize_by": self.resize_by,
+            "resize_value": self.resize_value,
+            "fast_resize": self.fast_resize,
+            "quantize_method": self.quantize_method,
+            "low_memory": self.low_memory,
+        }
+        for name, variable in variables.items():
+            if recipe.get(name) is not None:
+                variable.set(recipe[name])
+
+        target_bytes = recipe.get("target_bytes")
+        self.use_target_size.set(bool(target_bytes))
+        if target_bytes:
+            self.target_kb.set(target_bytes // 1024)
+
+        steps = recipe.get("pipeline_steps", settings.PIPELINE_STEPS)
+        for step, variable in self.pipeline_steps.items():
+            variable.set(step in steps)
+
     def select_files(self):
         logger.debug("select_files")
         files = filedialog.askopenfilenames(
@@ -211,56 +695,176 @@ class ImageProcessorApp:
                 (
                     "画像ファイル",
                     "*.jpg *.jpeg *.png *.webp *.tiff *.bmp *.gif",
-                )
+                ),
+                (
+                    "アーカイブ",
+                    " ".join(f"*{ext}" for ext in sources.ARCHIVE_EXTENSIONS),
+                ),
             ]
         )
         if files:
-            self.image_paths.extend(list(files))
-            self.update_file_list()
-            self.update_image_info()
+            self.scanner.submit(files, self.is_valid_image)
+
+    def select_folder(self):
+        logger.debug("select_folder")
+        dir_path = filedialog.askdirectory()
+        if dir_path:
+            self.scanner.submit([dir_path], self.is_valid_image)
 
     def drop(self, event):
         logger.debug("drop")
         files = self.root.tk.splitlist(event.data)
-        logger.debug(f"files: {files}")
-        valid_files = [f for f in files if self.is_valid_image(f)]
-        if valid_files:
-            self.image_paths.extend(valid_files)
-            logger.debug(f"image_paths: {self.image_paths}")
-            self.update_file_list()
-            self.update_image_info()
+        logger.debug(f"files: {len(files)}件")
+        # フォルダとアーカイブは中の画像を別スレッドで列挙して追加する
+        self.scanner.submit(files, self.is_valid_image)
+
+    def poll_sources(self):
+        # 列挙の済んだファイルをメインループから定期的に追加する
+        paths = self.scanner.poll()
+        if paths:
+            self.add_files(paths)
+        self.root.after(SOURCE_POLL_MS, self.poll_sources)
+
+    def add_files(self, files):
+        logger.debug("add_files")
+        added = self.image_paths.extend(files)
+        logger.debug(f"追加: {added}件, 合計: {len(self.image_paths)}件")
+        if added:
+            self.metadata.submit(self.image_paths.paths[-added:])
+        self.update_file_list()
+        self.update_image_info()
+        if added:
+            self.schedule_estimate()
 
     def is_valid_image(self, file_path):
         logger.debug("is_valid_image")
-        _, ext = os.path.splitext(file_path)
-        return ext.lower() in [
-            ".jpg",
-            ".jpeg",
-            ".png",
-            ".webp",
-            ".tiff",
-            ".bmp",
-            ".gif",
-        ]
+        return settings.is_valid_image(file_path)
 
     def update_file_list(self):
         logger.debug("update_file_list")
-        self.file_list.delete(1.0, tk.END)
-        for path in self.image_paths:
-            self.file_list.insert(tk.END, f"{path}\n")
-        logger.debug(f"image_paths: {self.image_paths}")
+        # 追加されたファイルが見えるよう末尾を表示する (描画は表示行のみ)
+        self.file_list.see_end()
+        if self.thumbnail_grid is not None:
+            self.thumbnail_grid.see_end()
+
+    def poll_metadata(self):
+        # メタデータ取得の結果をメインループから定期的に反映する
+        items = self.metadata.poll()
+        if items:
+            for path, info, error in items:
+                if error is not None:
+                    self.metadata_errors += 1
+                elif path in self.image_paths.index:
+                    # 取り消し前に取得を始めていたファイルは集計しない
+                    self.summary.add(info)
+            self.update_image_info()
+        self.root.after(METADATA_POLL_MS, self.poll_metadata)
+
+    def schedule_projection(self):
+        """リサイズの設定が落ち着いてから、リサイズ後の推定を計算し直す"""
+        if self.projection_after_id is not None:
+            self.root.after_cancel(self.projection_after_id)
+        self.projection_after_id = self.root.after(
+            PROJECTION_DELAY_MS, self.update_projection
+        )
+
+    def update_projection(self):
+        self.projection_after_id = None
+        self.summary.set_resize(*self.get_resize_setting())
+        self.update_image_info()
+
+    def schedule_estimate(self):
+        """設定が落ち着いてから概算を始める (連続した変更はまとめて1回にする)"""
+        if self.estimate_after_id is not None:
+            self.root.after_cancel(self.estimate_after_id)
+        self.estimate_after_id = self.root.after(
+            ESTIMATE_DELAY_MS, self.start_estimate
+        )
+
+    def start_estimate(self):
+        logger.debug("start_estimate")
+        self.estimate_after_id = None
+        if not self.image_paths:
+            if self.estimator is not None:
+                self.estimator.cancel()
+            self.estimate_label.config(text="ファイルを選択してください")
+            return
+        self.last_estimate_quality = int(self.compress_quality.get())
+        options = dict(
+            settings.DEFAULT_OPTIONS,
+            compress_quality=self.last_estimate_quality,
+            quantize_method=self.quantize_method.get(),
+        )
+        self.get_estimator().submit(self.image_paths.paths, options)
+        self.estimate_label.config(text="計算中...")
+
+    def poll_estimate(self):
+        result = None
+        if self.estimator is not None:
+            result = self.estimator.poll()
+        if result is not None:
+            self.estimate_label.config(
+                text=(
+                    f"{format_bytes(result['total_bytes'])} → "
+                    f"約 {format_bytes(result['projected_bytes'])} "
+                    f"({result['savings']:.0%} 削減)\n"
+                    f"SSIM: {result['ssim']:.3f}, "
+                    f"PSNR: {result['psnr']:.1f}dB "
+                    f"({result['samples']}枚のサンプルから)"
+                )
+            )
+        self.root.after(ESTIMATE_POLL_MS, self.poll_estimate)
+
+    def get_resize_setting(self):
+        try:
+            return self.resize_by.get(), int(self.resize_value.get())
+        except (tk.TclError, ValueError):
+            # 入力途中の値などは推定の対象外にする
+            return None, None
 
     def update_image_info(self):
         logger.debug("update_image_info")
-        if self.image_paths:
-            try:
-                img = Image.open(self.image_paths[0])
-                width, height = img.size
-                self.current_size_label.config(
-                    text=f"幅: {width}px, 高さ: {height}px"
-                )
-            except Exception as e:
-                self.current_size_label.config(text=f"エラー: {str(e)}")
+        # リサイズタブの中身がまだない場合は、作成時に更新する
+        if not self.is_tab_built(self.resize_tab):
+            return
+        if not self.image_paths:
+            self.current_size_label.config(text="ファイルを選択してください")
+            return
+
+        # 集計は済んでいるため、ここでは表示だけを行う
+        summary = self.summary.summary
+        total = len(self.image_paths)
+
+        lines = []
+        if summary["count"] == 0:
+            lines.append("読み込み中...")
+        elif total == 1:
+            width, height = summary["min_size"]
+            lines.append(f"幅: {width}px, 高さ: {height}px")
+        else:
+            (min_w, min_h), (max_w, max_h) = (
+                summary["min_size"],
+                summary["max_size"],
+            )
+            lines.append(
+                f"{summary['count']}/{total}枚 "
+                f"({format_bytes(summary['total_bytes'])}) "
+                f"幅: {min_w}-{max_w}px, 高さ: {min_h}-{max_h}px"
+            )
+        if summary["count"] and summary["projected_min_size"]:
+            (min_w, min_h), (max_w, max_h) = (
+                summary["projected_min_size"],
+                summary["projected_max_size"],
+            )
+            lines.append(
+                f"リサイズ後: 幅: {min_w}-{max_w}px, 高さ: {min_h}-{max_h}px "
+                f"(推定 {format_bytes(summary['projected_bytes'])})"
+            )
+        if summary["rotated"]:
+            lines.append(f"EXIFで回転指定のある画像: {summary['rotated']}枚")
+        if self.metadata_errors:
+            lines.append(f"エラー: {self.metadata_errors}枚")
+        self.current_size_label.config(text="\n".join(lines))
 
     def show_preview(self):
         logger.debug("show_preview")
@@ -268,24 +872,21 @@ class ImageProcessorApp:
             messagebox.showinfo("情報", "画像を選択してください")
             return
 
-        try:
-            img = Image.open(self.image_paths[0])
-            width, height = img.size
-
-            if self.resize_by.get() == "width":
-                new_width = self.resize_value.get()
-                new_height = int(height * (new_width / width))
-            else:
-                new_height = self.resize_value.get()
-                new_width = int(width * (new_height / height))
-
-            self.current_size_label.config(
-                text=f"元のサイズ: {width}px x {height}px\n新しいサイズ: {new_width}px x {new_height}px"
-            )
-        except Exception as e:
-            messagebox.showerror(
-                "エラー", f"プレビューの生成中にエラーが発生しました: {str(e)}"
-            )
+        info = self.metadata.cache.get(self.image_paths[0])
+        resize_by, resize_value = self.get_resize_setting()
+        if info is None or resize_by is None:
+            messagebox.showinfo("情報", "画像の情報を取得中です")
+            return
+        self.tab_control.select(self.resize_tab)
+        self.build_tab()
+
+        width, height = info["width"], info["height"]
+        new_width, new_height = settings.calc_resize(
+            (width, height), resize_by, resize_value
+        )
+        self.current_size_label.config(
+            text=f"元のサイズ: {width}px x {height}px\n新しいサイズ: {new_width}px x {new_height}px"
+        )
 
     def change_output_dir(self):
         logger.debug("change_output_dir")
@@ -296,6 +897,9 @@ class ImageProcessorApp:
             self.output_entry.insert(0, self.output_dir)
 
     def execute(self):
+        import journal
+        import processor
+
         logger.debug("execute")
         if not self.image_paths:
             messagebox.showinfo("情報", "画像を選択してください")
@@ -315,126 +919,373 @@ class ImageProcessorApp:
         # 現在のタブを取得
         current_tab = self.tab_control.tab(self.tab_control.select(), "text")
 
+        # Tkの変数はワーカーから参照できないため、UIスレッドで値を退避する
+        try:
+            options = self.get_options()
+        except (tk.TclError, ValueError) as e:
+            messagebox.showerror("エラー", f"設定値が不正です: {str(e)}")
+            return
+
+        image_paths = list(self.image_paths)
+        # 再開時に同じフォルダへ出力できるよう、基準のフォルダも記録に残す
+        options = processor.resolve_mirror_root(image_paths, options)
+        try:
+            job_journal = journal.Journal.create(
+                image_paths, current_tab, options, self.output_dir
+            )
+        except OSError as e:
+            logger.warning(f"ジョブの記録を作成できません: {e}")
+            job_journal = None
+        self.start_job(current_tab, image_paths, options, job_journal)
+
+    def start_job(
+        self, operation, image_paths, options, job_journal, name_paths=None
+    ):
+        """image_paths の処理を別スレッドで開始する
+
+        name_paths は再開時の元のジョブの全件 (processor.iter_process を参照)。
+        """
+        try:
+            max_workers = max(int(self.max_workers.get()), 1)
+        except (tk.TclError, ValueError):
+            max_workers = settings.DEFAULT_MAX_WORKERS
+
+        metrics_path = None
+        if self.export_metrics.get():
+            metrics_path = os.path.join(self.output_dir, METRICS_FILENAME)
+        self.job = Job(len(image_paths), metrics_path, job_journal)
+        # 投入したファイルを「処理中」にする (UIの更新はメインループで行う)
+        self.job.on_started = lambda path: self.root.after(
+            0, lambda: self.update_row_status(path, STATUS_RUNNING)
+        )
+
         # 処理を別スレッドで実行
         self.execute_btn.config(state=tk.DISABLED)
+        self.pause_btn.config(state=tk.NORMAL, text="一時停止")
+        self.export_failures_btn.config(state=tk.DISABLED)
         self.progress["value"] = 0
-        self.progress["maximum"] = len(self.image_paths)
+        self.progress["maximum"] = len(image_paths)
+        self.image_paths.reset_statuses()
+        self.file_list.refresh()
 
         thread = threading.Thread(
-            target=self.process_images, args=(current_tab,)
+            target=self.process_images,
+            args=(
+                operation,
+                image_paths,
+                options,
+                self.executor_type.get(),
+                max_workers,
+                self.job,
+                name_paths,
+            ),
         )
         thread.daemon = True
         thread.start()
 
-    def process_images(self, operation):
+    def offer_resume(self):
+        """途中で終了したジョブがあれば、残りのファイルから再開するか確認する"""
+        import journal
+
+        job = journal.find_resumable()
+        if job is None:
+            return
+        paths = journal.remaining(job)
+        failed = len(journal.failures(job))
+        if not messagebox.askyesno(
+            "再開",
+            "前回の処理が途中で終了しています。\n"
+            f"処理: {job['operation']} ({len(job['paths'])}枚)\n"
+            f"未完了: {len(paths) - failed}枚, 失敗: {failed}枚\n"
+            f"出力先: {job['output_dir']}\n\n"
+            "未完了と失敗のファイルだけを処理し直しますか?",
+        ):
+            # 失敗の一覧は python -m journal で書き出せるよう、記録は残す
+            journal.abandon(job["path"])
+            return
+
+        try:
+            os.makedirs(job["output_dir"], exist_ok=True)
+            job_journal = journal.Journal.reopen(job["path"], paths)
+        except OSError as e:
+            messagebox.showerror("エラー", f"再開できません: {str(e)}")
+            return
+        self.output_dir = job["output_dir"]
+        self.output_entry.delete(0, tk.END)
+        self.output_entry.insert(0, self.output_dir)
+        self.add_files(paths)
+        # 処理のモジュールは再開する場合だけ読み込む (起動時に確認するため)
+        import processor
+
+        # 前回と同じ設定・出力の名前で処理する (画面の設定は変えない)
+        self.start_job(
+            job["operation"],
+            paths,
+            processor.resume_options(job),
+            job_journal,
+            name_paths=job["paths"],
+        )
+
+    def export_failures(self):
+        import journal
+
+        logger.debug("export_failures")
+        if not self.failed_paths:
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".txt",
+            initialfile="failures.txt",
+            filetypes=[("テキスト", "*.txt")],
+        )
+        if not path:
+            return
+        try:
+            journal.write_path_list(path, self.failed_paths)
+        except OSError as e:
+            messagebox.showerror("エラー", f"保存に失敗しました: {str(e)}")
+
+    def get_options(self):
+        logger.debug("get_options")
+        return {
+            "compress_quality": int(self.compress_quality.get()),
+            "target_format": self.target_format.get(),
+            "auto_min_psnr": float(self.auto_min_psnr.get()),
+            "icc_mode": self.icc_mode.get(),
+            "resize_by": self.resize_by.get(),
+            "resize_value": int(self.resize_value.get()),
+            "fast_resize": self.fast_resize.get(),
+            "target_bytes": (
+                int(self.target_kb.get()) * 1024
+                if self.use_target_size.get()
+                else None
+            ),
+            "max_encode_passes": settings.DEFAULT_MAX_ENCODE_PASSES,
+            "quantize_method": self.quantize_method.get(),
+            "shared_palette": self.shared_palette.get(),
+            "low_memory": self.low_memory.get(),
+            "memory_limit": (
+                LOW_MEMORY_LIMIT if self.low_memory.get() else None
+            ),
+            "use_cache": self.use_cache.get(),
+            "cache_dir": settings.DEFAULT_OPTIONS["cache_dir"],
+            "cache_max_bytes": settings.DEFAULT_OPTIONS["cache_max_bytes"],
+            "pipeline_steps": [
+                step
+                for step, variable in self.pipeline_steps.items()
+                if variable.get()
+            ],
+            "derivative_widths": settings.parse_widths(
+                self.derivative_widths.get()
+            ),
+            "derivative_formats": [
+                image_format
+                for image_format, variable in self.derivative_formats.items()
+                if variable.get()
+            ],
+            **{
+                name: variable.get()
+                for name, variable in self.lossless_settings.items()
+            },
+            "mirror_dirs": self.mirror_dirs.get(),
+            "output_archive": (
+                os.path.join(self.output_entry.get(), OUTPUT_ARCHIVE_NAME)
+                if self.archive_output.get()
+                else None
+            ),
+        }
+
+    def process_images(
+        self,
+        operation,
+        image_paths,
+        options,
+        executor_type,
+        max_workers,
+        job,
+        name_paths=None,
+    ):
+        import processor
+
         logger.debug("process_images")
         success_count = 0
         error_count = 0
+        failed_paths = []
 
-        for i, image_path in enumerate(self.image_paths):
-            try:
-                self.root.after(
-                    0, lambda val=i: self.progress.config(value=val + 1)
+        try:
+            # 完了した順に結果を受け取り、進捗を更新する
+            for i, (image_path, result, error) in enumerate(
+                processor.iter_process(
+                    image_paths,
+                    operation,
+                    options,
+                    self.output_dir,
+                    executor_type,
+                    max_workers,
+                    job,
+                    name_paths=name_paths,
                 )
-
-                img = Image.open(image_path)
-                file_name = os.path.basename(image_path)
-                base_name, ext = os.path.splitext(file_name)
-
-                logger.debug(f"拡張子: {ext}")
-
-                # 処理タイプに応じた処理
-                if operation == "圧縮":
-                    # 1から10の入力を5から95に変換
-                    quality = (int(self.compress_quality.get()) - 1) * 10 + 5
-                    output_path = os.path.join(
-                        self.output_dir, f"{base_name}_edited{ext}"
-                    )
-                    if ext.lower()[1:] == "png":
-                        img.quantize(colors=PNG_COLORS).save(
-                            output_path, quality=quality, optimize=True
+            ):
+                if error is None:
+                    logger.debug(f"出力: {result['output_path']}")
+                    if "quantize_seconds" in result:
+                        logger.info(
+                            f"{image_path}: 減色 {result['quantize_method']} "
+                            f"{result['quantize_seconds'] * 1000:.1f}ms"
                         )
-                    else:
-                        img.save(output_path, quality=quality, optimize=True)
-
-                elif operation == "形式変更":
-                    target_format = self.target_format.get()
-                    output_path = os.path.join(
-                        self.output_dir, f"{base_name}_edited.{target_format}"
-                    )
-
-                    # PNGなどの形式に透過処理を適用
-                    if (
-                        target_format.lower() in ["png", "webp"]
-                        and img.mode != "RGBA"
-                    ):
-                        img = img.convert("RGBA")
-                    elif (
-                        target_format.lower() in ["jpeg", "jpg"]
-                        and img.mode == "RGBA"
-                    ):
-                        # JPEGは透過をサポートしないため、白背景を適用
-                        background = Image.new(
-                            "RGBA", img.size, (255, 255, 255)
+                    if "variants" in result:
+                        logger.info(
+                            f"{image_path}: "
+                            f"派生画像 {len(result['variants'])}件"
                         )
-                        img = Image.alpha_composite(background, img)
-                        img = img.convert("RGB")
-
-                    img.save(output_path, format=target_format.upper())
-
-                elif operation == "リサイズ":
-                    width, height = img.size
+                    if "encode_passes" in result:
+                        logger.info(
+                            f"{image_path}: {result['bytes']}B, "
+                            f"試行: {result['encode_passes']}回"
+                        )
+                    if "frames" in result:
+                        logger.info(
+                            f"{image_path}: {result['frames']}フレーム "
+                            f"({result['bytes']}B)"
+                        )
+                    if "trials" in result:
+                        logger.info(
+                            f"{image_path}: 形式 {result['format']} "
+                            f"({result['bytes']}B)"
+                        )
+                    success_count += 1
+                    status = STATUS_DONE
+                else:
+                    error_count += 1
+                    failed_paths.append(image_path)
+                    logger.error(f"エラー ({image_path}): {str(error)}")
+                    status = STATUS_ERROR
 
-                    if self.resize_by.get() == "width":
-                        new_width = self.resize_value.get()
-                        new_height = int(height * (new_width / width))
-                    else:
-                        new_height = self.resize_value.get()
-                        new_width = int(width * (new_height / height))
+                self.root.after(
+                    0,
+                    lambda val=i, path=image_path, st=status: (
+                        self.update_progress(val + 1, path, st)
+                    ),
+                )
+        except Exception as e:
+            # Executorの生成自体に失敗した場合は残りをすべてエラーとする
+            logger.error(f"並列処理の開始に失敗しました: {str(e)}")
+            error_count = len(image_paths) - success_count
 
-                    resized_img = img.resize(
-                        (new_width, new_height), Image.LANCZOS
-                    )
-                    output_path = os.path.join(
-                        self.output_dir, f"{base_name}_edited{ext}"
-                    )
-                    resized_img.save(output_path)
+        self.root.after(
+            0,
+            lambda: self.processing_complete(
+                job, success_count, error_count, failed_paths
+            ),
+        )
 
-                success_count += 1
+    def update_progress(self, value, image_path, status):
+        self.progress.config(value=value)
+        self.update_row_status(image_path, status)
+        self.update_job_status()
 
-            except Exception as e:
-                error_count += 1
-                print(f"エラー ({image_path}): {str(e)}")
+    def update_row_status(self, image_path, status):
+        row = self.image_paths.set_status(image_path, status)
+        self.file_list.refresh_row(row)
 
-        self.root.after(
-            0, lambda: self.processing_complete(success_count, error_count)
+    def update_job_status(self):
+        if self.job is None:
+            return
+        text = (
+            f"{self.job.completed}/{self.job.total}枚  "
+            f"{self.job.throughput():.1f}枚/秒  "
+            f"残り {format_eta(self.job.eta())}"
         )
+        if self.job.paused:
+            text += "  (一時停止中)"
+        self.job_status_label.config(text=text)
 
-    def processing_complete(self, success_count, error_count):
+    def toggle_pause(self):
+        logger.debug("toggle_pause")
+        if self.job is None:
+            return
+        if self.job.paused:
+            self.job.resume()
+            self.pause_btn.config(text="一時停止")
+        else:
+            self.job.pause()
+            self.pause_btn.config(text="再開")
+        self.update_job_status()
+
+    def processing_complete(
+        self, job, success_count, error_count, failed_paths
+    ):
         logger.debug("processing_complete")
+        self.job = None
+        self.failed_paths = failed_paths
+        if job.cancelled:
+            self.image_paths.reset_running()
+            self.file_list.refresh()
         self.execute_btn.config(state=tk.NORMAL)
+        self.pause_btn.config(state=tk.DISABLED, text="一時停止")
+        if failed_paths:
+            self.export_failures_btn.config(state=tk.NORMAL)
+        self.job_status_label.config(
+            text=(
+                f"{job.completed}/{job.total}枚  {job.elapsed():.1f}秒  "
+                f"{job.throughput():.1f}枚/秒"
+            )
+        )
+        if job.cancelled:
+            title, message = "取り消し", "処理を取り消しました"
+        else:
+            title, message = "完了", "処理が完了しました"
         messagebox.showinfo(
-            "完了",
-            f"処理が完了しました\n成功: {success_count}\nエラー: {error_count}",
+            title,
+            f"{message}\n成功: {success_count}\nエラー: {error_count}",
         )
 
     def cancel_upload(self):
         logger.debug("cancel_upload")
+        # 実行中の場合は処理を取り消し、ファイルの選択はそのままにする
+        if self.job is not None:
+            self.job.cancel()
+            self.pause_btn.config(state=tk.DISABLED)
+            return
+
         # アップロードした画像のファイルを削除する
-        self.image_paths = []
+        self.image_paths.clear()
+        self.scanner.cancel()
+        self.metadata.cancel()
+        self.summary.reset()
+        if self.thumbnail_grid is not None:
+            self.thumbnail_grid.clear()
+        if self.estimator is not None:
+            self.estimator.cancel()
+        self.estimate_label.config(text="ファイルを選択してください")
+        self.metadata_errors = 0
         self.update_file_list()
         self.update_image_info()
 
 
-if __name__ == "__main__":
+def create_root():
+    """ルートウィンドウを作る。tkinterdnd2 があればドラッグ&ドロップに対応させる
+
+    tkinterdnd2 はウィンドウを作るときまで読み込まない。
+    """
     try:
-        root = tkinterdnd2.TkinterDnD.Tk()
+        import tkinterdnd2
+
+        return tkinterdnd2.TkinterDnD.Tk()
     except ImportError:
-        root = tk.Tk()
         logger.error(
             "tkinterdnd2がインストールされていないため、ドラッグ&ドロップ機能は無効です。"
         )
         logger.error("インストールするには: pip install tkinterdnd2")
+        return tk.Tk()
+
+
+if __name__ == "__main__":
+    # PyInstaller のアプリでは、プロセスプールのワーカーが起動処理を再実行しないようにする
+    # (multiprocessing は起動を遅くするため、アプリの場合だけ読み込む)
+    if getattr(sys, "frozen", False):
+        import multiprocessing
 
+        multiprocessing.freeze_support()
+    root = create_root()
     app = ImageProcessorApp(root)
     root.mainloop()
@@ -0,0 +1,154 @@
+"""巨大な画像を扱うためのメモリ管理
+
+画像全体を展開せずに帯状 (ストリップ) に読み込む処理と、
+同時に処理する画像のメモリ使用量の見積もりを上限以内に抑えるための管理を行う。
+"""
+
+import math
+import threading
+
+from PIL import Image, ImageMode
+
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+# 帯状に読み込む際の1回あたりの行数
+DEFAULT_BAND_ROWS = 256
+# 帯状の読み込みに対応するモード (1画素が整数バイトで並ぶもの)
+BANDABLE_MODES = ["L", "LA", "RGB", "RGBA", "CMYK", "I;16"]
+
+
+def bytes_per_pixel(mode):
+    if mode == "1":
+        return 1
+    image_mode = ImageMode.getmode(mode)
+    itemsize = int(image_mode.typestr[-1]) if image_mode.typestr else 1
+    return len(image_mode.bands) * itemsize
+
+
+def image_bytes(size, mode):
+    return size[0] * size[1] * bytes_per_pixel(mode)
+
+
+def plan_raw_bands(img):
+    """画素が非圧縮で上から順に並んでいる場合、ストリップの一覧を返す
+
+    戻り値は (先頭行, 行数, ファイル内のオフセット, 1行のバイト数) のリスト。
+    圧縮されている形式や下から並ぶ形式 (BMP) などは None を返す。
+    """
+    if img.mode not in BANDABLE_MODES or not img.tile:
+        return None
+
+    width, height = img.size
+    strips = []
+    for tile in sorted(img.tile, key=lambda t: t[1][1]):
+        codec_name, extents, offset, args = tile[:4]
+        x0, y0, x1, y1 = extents
+        if codec_name != "raw" or x0 != 0 or x1 != width:
+            return None
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if rawmode != img.mode or orientation != 1:
+            return None
+        row_bytes = stride or width * bytes_per_pixel(img.mode)
+        strips.append((y0, y1 - y0, offset, row_bytes))
+
+    # すべての行が欠けずに並んでいることを確認する
+    next_row = 0
+    for top, rows, _, _ in strips:
+        if top != next_row:
+            return None
+        next_row += rows
+    return strips if next_row == height else None
+
+
+def iter_raw_bands(path, strips, size, mode, band_rows=DEFAULT_BAND_ROWS):
+    """plan_raw_bands の結果に従い、(先頭行, 帯状の画像) を順に返す"""
+    width, _ = size
+    with open(path, "rb") as f:
+        for strip_top, strip_rows, offset, row_bytes in strips:
+            for start in range(0, strip_rows, band_rows):
+                rows = min(band_rows, strip_rows - start)
+                f.seek(offset + start * row_bytes)
+                data = f.read(rows * row_bytes)
+                band = Image.frombuffer(
+                    mode, (width, rows), data, "raw", mode, row_bytes, 1
+                )
+                yield strip_top + start, band
+
+
+def banded_reduce(path, factor, band_rows=DEFAULT_BAND_ROWS):
+    """画像全体を展開せずに、整数倍 (factor) で縮小した画像を返す
+
+    帯状に読み込み、factor の倍数の行ごとに Image.reduce を適用するため、
+    結果は画像全体に reduce を行った場合と一致する。
+    対応していない形式の場合は None を返す。
+    """
+    with Image.open(path) as img:
+        strips = plan_raw_bands(img)
+        size, mode = img.size, img.mode
+    if strips is None:
+        return None
+
+    width, height = size
+    band_rows = max(band_rows - band_rows % factor, factor)
+    reduced = Image.new(
+        mode, (math.ceil(width / factor), math.ceil(height / factor))
+    )
+    pending = None
+    out_top = 0
+    for _, band in iter_raw_bands(path, strips, size, mode, band_rows):
+        if pending is not None:
+            merged = Image.new(mode, (width, pending.height + band.height))
+            merged.paste(pending, (0, 0))
+            merged.paste(band, (0, pending.height))
+            band = merged
+
+        usable = band.height - band.height % factor
+        if usable:
+            part = band.crop((0, 0, width, usable)).reduce(factor)
+            reduced.paste(part, (0, out_top))
+            out_top += part.height
+        pending = (
+            band.crop((0, usable, width, band.height))
+            if usable < band.height
+            else None
+        )
+
+    if pending is not None:
+        reduced.paste(pending.reduce(factor), (0, out_top))
+    return reduced
+
+
+class MemoryBudget:
+    """同時に処理する画像の見積もりメモリの合計を上限以内に抑える
+
+    上限を超える画像も、他に処理中のものがなければ単独で実行する。
+    limit が None の場合は制限しない。
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.in_use = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self, amount):
+        with self.lock:
+            if (
+                self.limit is None
+                or self.in_use == 0
+                or self.in_use + amount <= self.limit
+            ):
+                if self.limit is not None and amount > self.limit:
+                    logger.warning(
+                        f"メモリ上限を超える画像のため単独で処理します "
+                        f"({amount // (1024 * 1024)}MB)"
+                    )
+                self.in_use += amount
+                return True
+            return False
+
+    def release(self, amount):
+        with self.lock:
+            self.in_use -= amount
@@ -0,0 +1,226 @@
+"""画像のメタデータ (ヘッダー情報) をバックグラウンドで取得する
+
+Image.open はヘッダーだけを読み込み、画素のデコードは行わないため、
+サイズ・モード・形式・EXIFの向きは画素を展開せずに取得できる。
+結果はパスと更新時刻をキーにメモリ上へキャッシュする。
+Pillow はGUIの起動を遅くしないよう、初めて画像を読み込むときに読み込む。
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+import sources
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+# ネットワーク越しのファイルでも待ち時間を重ねられるよう、I/O待ち前提で多めにする
+DEFAULT_PROBE_WORKERS = 8
+EXIF_ORIENTATION = 0x0112
+
+
+def probe_image(path):
+    """ヘッダーだけを読み込んで画像の情報を dict で返す"""
+    from PIL import Image
+
+    file_size, mtime = sources.stat_source(path)
+    with Image.open(sources.open_stream(path)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        return {
+            "path": path,
+            "mtime": mtime,
+            "file_size": file_size,
+            "width": img.width,
+            "height": img.height,
+            "mode": img.mode,
+            "format": img.format,
+            "orientation": orientation,
+        }
+
+
+class MetadataCache:
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, mtime=None):
+        with self.lock:
+            info = self.entries.get(path)
+        if info is None:
+            return None
+        if mtime is not None and info["mtime"] != mtime:
+            return None
+        return info
+
+    def put(self, info):
+        with self.lock:
+            self.entries[info["path"]] = info
+
+    def lookup(self, path):
+        """ファイルの更新時刻が一致する場合だけキャッシュを返す"""
+        try:
+            _, mtime = sources.stat_source(path)
+        except (OSError, KeyError):
+            return None
+        return self.get(path, mtime)
+
+
+class MetadataProber:
+    """キューに追加されたファイルのメタデータを別スレッドで取得する
+
+    結果は results キューに (パス, 情報, 例外) の形で入る。
+    Tkのメインループからは poll で取り出して画面に反映する。
+    """
+
+    def __init__(self, cache=None, max_workers=DEFAULT_PROBE_WORKERS):
+        self.cache = cache or MetadataCache()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.results = queue.Queue()
+        self.generation = 0
+
+    def submit(self, paths):
+        generation = self.generation
+        for path in paths:
+            self.executor.submit(self._probe, path, generation)
+
+    def cancel(self):
+        """取り消し前に投入されたファイルの結果を捨てる"""
+        self.generation += 1
+
+    def _probe(self, path, generation):
+        if generation != self.generation:
+            return
+        try:
+            info = self.cache.lookup(path)
+            if info is None:
+                info = probe_image(path)
+                self.cache.put(info)
+            self.results.put((path, info, None))
+        except Exception as e:
+            logger.debug(f"メタデータの取得に失敗しました ({path}): {e}")
+            self.results.put((path, None, e))
+
+    def poll(self):
+        """取得済みの結果をブロックせずにすべて取り出す"""
+        items = []
+        while True:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                return items
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def new_summary():
+    return {
+        "count": 0,
+        "total_bytes": 0,
+        "min_size": None,
+        "max_size": None,
+        "rotated": 0,
+        "projected_bytes": 0,
+        "projected_min_size": None,
+        "projected_max_size": None,
+    }
+
+
+def summarize(infos, resize_by=None, resize_value=None):
+    """複数の画像の情報を集計し、リサイズ後の推定サイズも含めて返す
+
+    リサイズ後のファイルサイズは画素数の比率で元のファイルサイズを按分した概算。
+    """
+    summary = new_summary()
+    for info in infos:
+        add_info(summary, info)
+        add_projection(summary, info, resize_by, resize_value)
+    return summary
+
+
+def add_info(summary, info):
+    width, height = info["width"], info["height"]
+    summary["count"] += 1
+    summary["total_bytes"] += info["file_size"]
+    summary["min_size"] = min_size(summary["min_size"], (width, height))
+    summary["max_size"] = max_size(summary["max_size"], (width, height))
+    if info["orientation"] not in (None, 1):
+        summary["rotated"] += 1
+
+
+def add_projection(summary, info, resize_by, resize_value):
+    width, height = info["width"], info["height"]
+    if not (resize_by and resize_value and width and height):
+        return
+    new_size = settings.calc_resize((width, height), resize_by, resize_value)
+    ratio = (new_size[0] * new_size[1]) / (width * height)
+    summary["projected_bytes"] += int(info["file_size"] * ratio)
+    summary["projected_min_size"] = min_size(
+        summary["projected_min_size"], new_size
+    )
+    summary["projected_max_size"] = max_size(
+        summary["projected_max_size"], new_size
+    )
+
+
+class RunningSummary:
+    """取得済みの画像の情報を、届いた分だけ加えていく集計
+
+    メタデータの結果を受け取るたびに全件を集計し直すと、数万件では
+    Tkのメインループが止まるため、新しい結果だけを加える。リサイズ後の推定は
+    設定が変わったときだけ (set_resize) 全件から計算し直す。
+    """
+
+    def __init__(self):
+        self.resize_by = None
+        self.resize_value = None
+        self.reset()
+
+    def reset(self):
+        """集計を空にする (リサイズの設定はそのまま)"""
+        self.infos = {}
+        self.summary = new_summary()
+
+    def add(self, info):
+        """集計に加える。集計済みのパスは加えない"""
+        if info["path"] in self.infos:
+            return
+        self.infos[info["path"]] = info
+        add_info(self.summary, info)
+        add_projection(self.summary, info, self.resize_by, self.resize_value)
+
+    def set_resize(self, resize_by, resize_value):
+        if (resize_by, resize_value) == (self.resize_by, self.resize_value):
+            return
+        self.resize_by, self.resize_value = resize_by, resize_value
+        projected = new_summary()
+        for info in self.infos.values():
+            add_projection(projected, info, resize_by, resize_value)
+        for key in [
+            "projected_bytes",
+            "projected_min_size",
+            "projected_max_size",
+        ]:
+            self.summary[key] = projected[key]
+
+
+def min_size(current, size):
+    if current is None:
+        return size
+    return (min(current[0], size[0]), min(current[1], size[1]))
+
+
+def max_size(current, size):
+    if current is None:
+        return size
+    return (max(current[0], size[0]), max(current[1], size[1]))
+
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f}{unit}" if unit != "B" else f"{num_bytes}B"
+        num_bytes /= 1024
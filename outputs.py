@@ -0,0 +1,285 @@
+"""出力ファイルの名前の決定と書き込み
+
+出力は一時ファイルに書き込んでから名前の変更で置き換えるため、途中で異常終了しても
+書きかけのファイルが出力として残らない。既存の出力がハードリンク (キャッシュ) でも、
+置き換えなのでリンク先は書き換わらない。
+同じ名前になる入力 (別のフォルダやアーカイブにある同名のファイル) は、入力のパスの
+順に2つ目以降へ連番を付けて区別する。処理の完了順には依存しないため、同じ入力からは
+常に同じ名前になる。割り当てた名前は出力ディレクトリの NAMES_NAME に記録し
+(新しい割り当ては NAMES_LOG_NAME に追記し、溜まったらまとめて書き直す)、
+監視のバッチや再開したジョブ、後からの実行でも同じ入力には同じ名前を使う
+(一部の入力だけを処理し直しても、別の入力の出力を上書きしない)。
+iter_process ではワーカーはエンコードまでを行い、書き込みは呼び出し側の
+I/O用のスレッドで行う (collect_writes の中の書き込みは pending に溜める)。
+"""
+
+import glob
+import json
+import os
+import posixpath
+import threading
+from contextlib import contextmanager
+
+import sources
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+NAMES_NAME = "edited_names.json"
+NAMES_LOG_NAME = "edited_names.log"
+# 追記した割り当てがこの件数と記録済みの件数の多い方を超えたら、記録を書き直す
+# (書き直しの量が割り当ての総数に比例し、監視が長く続いても2乗で増えない)
+MIN_NAMES_COMPACT = 1000
+# ネットワーク越しの出力先でも待ち時間を重ねられるよう、I/O待ち前提で多めにする
+DEFAULT_IO_WORKERS = 4
+
+_local = threading.local()
+
+
+def temp_path(path):
+    """path と同じディレクトリの一時ファイルの名前 (プロセス・スレッドごとに異なる)
+
+    os.replace で置き換えられるよう、同じファイルシステム上に作る。
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(
+        directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+
+
+def write_atomic(path, data):
+    """一時ファイルに書き込み、名前の変更で置き換える
+
+    置き換える前にディスクへ書き出し (fsync)、クラッシュしても最終的な名前で
+    空や書きかけのファイルが残らないようにする。
+    """
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_json(path):
+    """JSONの記録 (dict) を読み込む。ない・読み込めない場合は空の dict を返す"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"記録を読み込めませんでした ({path}): {e}")
+        return {}
+
+
+def update_json(path, entries):
+    """JSONの記録に entries (dict) を追加・上書きし、一時ファイルから置き換える"""
+    data = load_json(path)
+    data.update(entries)
+    write_atomic(
+        path,
+        json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True).encode(
+            "utf-8"
+        ),
+    )
+
+
+@contextmanager
+def collect_writes(pending):
+    """このスレッドでの書き込みを、ディスクに書かずに pending (リスト) に溜める
+
+    pending が None の場合はそのまま書き込む。
+    """
+    previous = getattr(_local, "pending", None)
+    _local.pending = pending
+    try:
+        yield pending
+    finally:
+        _local.pending = previous
+
+
+def pending_writes():
+    return getattr(_local, "pending", None)
+
+
+def source_dir(path):
+    """入力のフォルダ。アーカイブ内の画像はアーカイブのあるフォルダ"""
+    archive_path, _ = sources.split_member(path)
+    return os.path.dirname(os.path.abspath(archive_path))
+
+
+def common_root(image_paths):
+    directories = {source_dir(path) for path in image_paths}
+    return os.path.commonpath(list(directories)) if directories else None
+
+
+def input_root(inputs):
+    """指定された入力 (ディレクトリ・ファイル・グロブ) に共通するフォルダ
+
+    標準入力 ("-") は除く。グロブはワイルドカードより前の部分をフォルダとして扱う。
+    """
+    directories = []
+    for item in inputs:
+        if item == "-":
+            continue
+        if glob.has_magic(item):
+            parts = []
+            for part in item.split(os.sep):
+                if glob.has_magic(part):
+                    break
+                parts.append(part)
+            directories.append(
+                os.path.abspath(os.sep.join(parts) or os.curdir)
+            )
+        elif os.path.isdir(item):
+            directories.append(os.path.abspath(item))
+        else:
+            directories.append(source_dir(item))
+    return os.path.commonpath(directories) if directories else None
+
+
+def source_subdir(path, root):
+    """root から見た入力のフォルダの相対パス
+
+    アーカイブ内の画像は、アーカイブの名前 (拡張子なし) をフォルダとして扱う。
+    root の外にある入力と、メンバー名の ".." などは出力先の外に出ないよう除く。
+    """
+    relative = os.path.relpath(source_dir(path), root)
+    parts = []
+    if relative != os.curdir and not relative.startswith(os.pardir):
+        parts.append(relative)
+
+    archive_path, member = sources.split_member(path)
+    if member is not None:
+        name = os.path.basename(archive_path)
+        for ext in sources.ARCHIVE_EXTENSIONS:
+            if name.lower().endswith(ext):
+                name = name[: -len(ext)]
+                break
+        parts.append(name)
+        parts.extend(
+            part
+            for part in posixpath.dirname(member).split("/")
+            if part not in ("", os.curdir, os.pardir)
+        )
+    return os.path.join(*parts) if parts else ""
+
+
+def name_claim(path, name_key, root=None):
+    """(出力ディレクトリからの相対パス, 名前の重なりを判定するキー) を返す"""
+    subdir = source_subdir(path, root) if root else ""
+    return subdir, posixpath.join(subdir.lower(), name_key(path))
+
+
+class NameRegistry:
+    """出力ディレクトリで割り当て済みの名前の記録
+
+    claims は名前のキー -> {入力の絶対パス: 連番} の dict。
+    iter_process の呼び出しごとに作り直さず、監視中は同じものを使い回す。
+    新しい割り当ては1行1件のJSONで追記し、全体の書き直しはまとめて行う。
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, NAMES_NAME)
+        self.log_path = os.path.join(output_dir, NAMES_LOG_NAME)
+        self.lock = threading.Lock()
+        self.claims = load_json(self.path)
+        self.saved_count = sum(
+            len(claimed) for claimed in self.claims.values()
+        )
+        self.logged_count = self.replay_log()
+
+    def replay_log(self):
+        """前回の実行で追記した割り当てを claims に反映し、その件数を返す"""
+        if not os.path.exists(self.log_path):
+            return 0
+        count = 0
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        key, source, number = json.loads(line)
+                    except ValueError:
+                        # 書き込み中に終了した最後の行
+                        continue
+                    self.claims.setdefault(key, {})[source] = number
+                    count += 1
+        except OSError as e:
+            logger.warning(
+                f"記録を読み込めませんでした ({self.log_path}): {e}"
+            )
+        return count
+
+    def suffix(self, path, key):
+        """割り当て済みの連番の文字列 (未割り当ては None)"""
+        with self.lock:
+            count = self.claims.get(key, {}).get(os.path.abspath(path))
+        if count is None:
+            return None
+        return f"_{count}" if count > 1 else ""
+
+    def plan(self, image_paths, name_key, root=None):
+        """入力のパス -> (出力ディレクトリからの相対パス, 名前に付ける連番) を返す
+
+        name_key(パス) は出力のファイル名が同じになるかを判定するキーを返す関数。
+        root を指定した場合は、root からの入力のフォルダの構成を出力先にも再現する。
+        割り当て済みの入力は前回と同じ連番にし、新しい入力には入力のパスの順に
+        使われていない最小の連番を割り当てる。
+        """
+        plan = {}
+        added = []
+        with self.lock:
+            for path in sorted(set(image_paths)):
+                subdir, key = name_claim(path, name_key, root)
+                claimed = self.claims.setdefault(key, {})
+                source = os.path.abspath(path)
+                count = claimed.get(source)
+                if count is None:
+                    used = set(claimed.values())
+                    count = 1
+                    while count in used:
+                        count += 1
+                    claimed[source] = count
+                    added.append((key, source, count))
+                    if count > 1:
+                        logger.warning(
+                            f"出力の名前が重なるため連番を付けます: {path}"
+                        )
+                plan[path] = (subdir, f"_{count}" if count > 1 else "")
+            if added:
+                self.record(added)
+        return plan
+
+    def record(self, added):
+        """新しい割り当てを追記し、追記が溜まった場合は記録全体を書き直す"""
+        self.logged_count += len(added)
+        if self.logged_count >= max(MIN_NAMES_COMPACT, self.saved_count):
+            self.save()
+            return
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            for claim in added:
+                f.write(json.dumps(claim, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self):
+        """記録全体を書き直し、追記した分を消す"""
+        write_atomic(
+            self.path,
+            json.dumps(
+                self.claims, ensure_ascii=False, indent=2, sort_keys=True
+            ).encode("utf-8"),
+        )
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.saved_count = sum(
+            len(claimed) for claimed in self.claims.values()
+        )
+        self.logged_count = 0
@@ -0,0 +1,51 @@
+"""パイプラインの設定 (レシピ) をプリセットとして保存・読み込みする
+
+プリセットはJSONファイルで、名前だけを指定した場合は PRESET_DIR に保存する。
+"""
+
+import json
+import os
+
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+PRESET_DIR = os.path.join(
+    os.path.expanduser("~"), ".config", "edited_fig", "presets"
+)
+PRESET_EXT = ".json"
+
+
+def preset_path(name):
+    """名前またはファイルのパスから、プリセットのパスを返す"""
+    if name.endswith(PRESET_EXT) or os.sep in name:
+        return name
+    return os.path.join(PRESET_DIR, f"{name}{PRESET_EXT}")
+
+
+def list_presets():
+    if not os.path.isdir(PRESET_DIR):
+        return []
+    return sorted(
+        os.path.splitext(name)[0]
+        for name in os.listdir(PRESET_DIR)
+        if name.endswith(PRESET_EXT)
+    )
+
+
+def save_preset(name, recipe):
+    path = preset_path(name)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(recipe, f, ensure_ascii=False, indent=2)
+    logger.debug(f"プリセットを保存しました: {path}")
+    return path
+
+
+def load_preset(name):
+    with open(preset_path(name), encoding="utf-8") as f:
+        recipe = json.load(f)
+    if not isinstance(recipe, dict):
+        raise ValueError(f"プリセットの形式が正しくありません: {name}")
+    return recipe
@@ -0,0 +1,1808 @@
+"""画像の圧縮・形式変更・リサイズを行うGUI非依存の処理モジュール
+
+Tkに依存しないため、ディスプレイのないサーバーやcronからも利用できる。
+
+    $ python -m processor compress "photos/*.jpg" -o out --quality 7
+    $ find src -name "*.png" | python -m processor convert - --format webp
+    $ python -m processor resize photos/ --by width --value 800
+    $ python -m processor compress inbox/ -o out --watch
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import io
+import os
+import sys
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+import animation
+import autoformat
+import cache
+import colorconvert
+import derivatives
+import memory
+import outputs
+import presets
+import quantize
+import sources
+from job import Job, StageTimer
+from logger import Logger
+from settings import (
+    CLI_OPERATIONS,
+    DEFAULT_EXECUTOR,
+    DEFAULT_MAX_ENCODE_PASSES,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_OPTIONS,
+    EXECUTOR_TYPES,
+    OPERATION_DERIVATIVES,
+    OPERATION_FORMAT,
+    OPERATION_LOSSLESS,
+    OPERATION_PIPELINE,
+    OPERATION_STEPS,
+    PIPELINE_STEPS,
+    STEP_COMPRESS,
+    STEP_CONVERT,
+    STEP_RESIZE,
+    TARGET_FORMATS,
+    calc_resize,
+    is_valid_image,
+)
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+# 拡張子 -> Pillow の形式名。Image.registered_extensions() は全形式の
+# プラグインを読み込むため、対応する拡張子はこの表から求める
+EXTENSION_FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".webp": "WEBP",
+    ".tiff": "TIFF",
+    ".bmp": "BMP",
+    ".gif": "GIF",
+}
+
+PNG_COLORS = 256
+# 目標サイズ指定の圧縮で探索する範囲
+MIN_QUALITY = 5
+MAX_QUALITY = 95
+MIN_PNG_COLORS = 2
+# 高速縮小時に、最終的なLanczosの前に整数倍の縮小を挟む際の係数
+REDUCING_GAP = 2.0
+# 一時停止中に取り消しを確認する間隔 (秒)
+PAUSE_POLL_SECONDS = 0.2
+# 派生画像のエンコード・書き込みを並列に行うスレッド数 (1ファイルあたり)
+MAX_DERIVATIVE_WRITERS = 4
+
+# キャッシュのキーに含める、段階ごとの出力に影響するパラメータ
+STEP_PARAMS = {
+    STEP_COMPRESS: [
+        "compress_quality",
+        "target_bytes",
+        "max_encode_passes",
+        "quantize_method",
+        "palette",
+    ],
+    STEP_CONVERT: ["target_format", "icc_mode", "auto_min_psnr"],
+    STEP_RESIZE: [
+        "resize_by",
+        "resize_value",
+        "fast_resize",
+        "low_memory",
+    ],
+}
+
+
+def get_steps(operation, options):
+    """処理に含まれる段階を、適用する順に返す"""
+    if operation == OPERATION_PIPELINE:
+        steps = options.get("pipeline_steps") or []
+        return [step for step in PIPELINE_STEPS if step in steps]
+    if operation == OPERATION_DERIVATIVES:
+        return [STEP_RESIZE]
+    if operation == OPERATION_LOSSLESS:
+        # 画素をデコードしないため、パイプラインの段階はない
+        return []
+    if operation not in OPERATION_STEPS:
+        raise ValueError(f"不明な処理です: {operation}")
+    return OPERATION_STEPS[operation]
+
+
+def recipe_from_options(options):
+    """プリセットとして保存する、バッチに依存しない設定を取り出す"""
+    recipe = {"pipeline_steps": get_steps(OPERATION_PIPELINE, options)}
+    for names in STEP_PARAMS.values():
+        for name in names:
+            # 共通パレットはバッチごとに作り直す
+            if name != "palette":
+                recipe[name] = options.get(name)
+    return recipe
+
+
+def cache_params(operation, options):
+    steps = get_steps(operation, options)
+    params = {"steps": steps}
+    for step in steps:
+        params.update({name: options.get(name) for name in STEP_PARAMS[step]})
+    return params
+
+
+def is_auto_format(operation, options):
+    """形式を画像ごとに自動で選ぶ場合 (出力の拡張子は処理後に決まる)"""
+    return (
+        STEP_CONVERT in get_steps(operation, options)
+        and options.get("target_format") == autoformat.AUTO_FORMAT
+    )
+
+
+def create_executor(executor_type, max_workers):
+    """並列処理用のExecutorを生成する (process: プロセスプール, thread: スレッドプール)"""
+    if executor_type == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers)
+    if executor_type == "process":
+        # multiprocessing はプロセスプールを作るまで読み込まない (GUIの起動を速くする)
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    raise ValueError(f"不明な実行方式です: {executor_type}")
+
+
+def compress_quality_to_jpeg(compress_quality):
+    """1から10の入力を5から95に変換"""
+    return (int(compress_quality) - 1) * 10 + 5
+
+
+def compress_image(img, ext, options, output_path, timer=None):
+    timer = timer or StageTimer()
+    if options.get("target_bytes"):
+        return compress_to_target(img, ext, options, output_path, timer)
+
+    quality = compress_quality_to_jpeg(options["compress_quality"])
+    if ext.lower()[1:] == "png":
+        with timer.stage("transform"):
+            quantized, method, seconds = quantize_png(img, PNG_COLORS, options)
+        save_output(
+            quantized, output_path, timer, quality=quality, optimize=True
+        )
+        return {"quantize_method": method, "quantize_seconds": seconds}
+    else:
+        save_output(img, output_path, timer, quality=quality, optimize=True)
+
+
+def quantize_png(img, colors, options):
+    return quantize.quantize_image(
+        img,
+        colors,
+        options.get("quantize_method", quantize.DEFAULT_QUANTIZE_METHOD),
+        options.get("palette"),
+    )
+
+
+def encode_to_buffer(img, image_format, **params):
+    if image_format in colorconvert.ICC_FORMATS:
+        # 色空間の合うICCプロファイルだけを埋め込む (JPEGは指定しないと
+        # 埋め込まれず、PNGなどは変換後に合わなくなったものも埋め込まれる)
+        params.setdefault("icc_profile", colorconvert.matching_profile(img))
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, **params)
+    return buffer.getvalue()
+
+
+def format_for_ext(ext):
+    """拡張子から Pillow の形式名を求める"""
+    ext = ext.lower()
+    if ext in EXTENSION_FORMATS:
+        return EXTENSION_FORMATS[ext]
+    return Image.registered_extensions()[ext]
+
+
+def save_output(img, output_path, timer, image_format=None, **params):
+    """メモリ上でエンコードしてから書き込む
+
+    エンコードと書き込みの時間を分けて計測するため、img.save(パス) は使わない。
+    """
+    if image_format is None:
+        image_format = format_for_ext(os.path.splitext(output_path)[1])
+    with timer.stage("encode"):
+        data = encode_to_buffer(img, image_format, **params)
+    write_output(output_path, data, timer)
+    return data
+
+
+def write_output(output_path, data, timer):
+    pending = outputs.pending_writes()
+    if pending is not None:
+        # 書き込みは iter_process のI/O用のスレッドで行う
+        pending.append((output_path, data))
+        return
+    with timer.stage("write"):
+        outputs.write_atomic(output_path, data)
+
+
+def search_encode(encode, low, high, target_bytes, max_passes):
+    """目標サイズ以下になる最大のパラメータを二分探索する
+
+    encode はパラメータを受け取ってエンコード結果のbytesを返す関数。
+    最大値で収まる場合は1回で終了する。目標に届かない場合は、試した中で
+    最も小さい結果を返す。戻り値は (パラメータ, データ, 試行回数, 目標達成)。
+    """
+    best = None
+    smallest = None
+    passes = 0
+    candidate = high
+    while low <= high and passes < max_passes:
+        data = encode(candidate)
+        passes += 1
+        if smallest is None or len(data) < len(smallest[1]):
+            smallest = (candidate, data)
+
+        if len(data) <= target_bytes:
+            best = (candidate, data)
+            low = candidate + 1
+        else:
+            high = candidate - 1
+        candidate = (low + high) // 2
+
+    if best is not None:
+        return best[0], best[1], passes, True
+    return smallest[0], smallest[1], passes, False
+
+
+def compress_to_target(img, ext, options, output_path, timer=None):
+    """目標のファイルサイズに収まる最高品質で圧縮する
+
+    JPEG/WebPは品質、PNGは減色後の色数を探索する。エンコードはメモリ上で行い、
+    デコード済みの画像を使い回す。それ以外の形式は通常通り1回だけ保存する。
+    """
+    timer = timer or StageTimer()
+    image_format = format_for_ext(ext)
+    target_bytes = options["target_bytes"]
+    max_passes = max(
+        options.get("max_encode_passes") or DEFAULT_MAX_ENCODE_PASSES, 1
+    )
+    img.load()
+    quantize_info = {}
+
+    if image_format in ("JPEG", "WEBP"):
+
+        def encode(quality):
+            with timer.stage("encode"):
+                return encode_to_buffer(
+                    img, image_format, quality=quality, optimize=True
+                )
+
+        low, high = MIN_QUALITY, MAX_QUALITY
+    elif image_format == "PNG":
+        quantize_info = {"quantize_seconds": 0.0}
+
+        def encode(colors):
+            with timer.stage("transform"):
+                quantized, method, seconds = quantize_png(img, colors, options)
+            quantize_info["quantize_method"] = method
+            quantize_info["quantize_seconds"] += seconds
+            with timer.stage("encode"):
+                return encode_to_buffer(quantized, image_format, optimize=True)
+
+        # 共通パレットを使う場合は色数が固定されるため探索しない
+        low = MIN_PNG_COLORS if options.get("palette") is None else PNG_COLORS
+        high = PNG_COLORS
+    else:
+
+        def encode(_):
+            with timer.stage("encode"):
+                return encode_to_buffer(img, image_format, optimize=True)
+
+        low = high = 0
+
+    value, data, passes, met = search_encode(
+        encode, low, high, target_bytes, max_passes
+    )
+    write_output(output_path, data, timer)
+
+    logger.debug(
+        f"目標サイズ: {target_bytes}B, 結果: {len(data)}B, 試行: {passes}回"
+    )
+    return {
+        "encode_passes": passes,
+        "search_value": value,
+        "bytes": len(data),
+        "met_target": met,
+        **quantize_info,
+    }
+
+
+def change_format(img, options, output_path, timer=None):
+    timer = timer or StageTimer()
+    target_format = options["target_format"]
+    with timer.stage("transform"):
+        img = convert_for_format(img, target_format, options)
+    save_output(img, output_path, timer, target_format.upper())
+
+
+def convert_for_format(img, target_format, options=None):
+    """変換先の形式に合わせて画像のモードを整える"""
+    icc_mode = (options or {}).get("icc_mode", colorconvert.DEFAULT_ICC_MODE)
+    return colorconvert.convert_for_format(img, target_format, icc_mode)
+
+
+def resize_image(img, options, output_path, timer=None):
+    timer = timer or StageTimer()
+    with timer.stage("transform"):
+        resized_img = resize_transform(img, options)
+    save_output(resized_img, output_path, timer)
+
+
+def resize_transform(img, options):
+    new_size = calc_resize(
+        img.size, options["resize_by"], options["resize_value"]
+    )
+    if options.get("low_memory"):
+        return low_memory_downscale(img, new_size)
+    if options.get("fast_resize"):
+        return fast_downscale(img, new_size)
+    return img.resize(new_size, Image.LANCZOS)
+
+
+def run_pipeline(img, ext, steps, options, output_path, timer=None):
+    """リサイズ → 形式変更 → 圧縮 の順に適用し、最後に1回だけエンコードする
+
+    圧縮の段階の情報 (試行回数など) があれば dict で返す。
+    """
+    timer = timer or StageTimer()
+    if STEP_RESIZE in steps:
+        with timer.stage("transform"):
+            img = resize_transform(img, options)
+
+    image_format = None
+    if STEP_CONVERT in steps:
+        image_format = options["target_format"]
+        if image_format == autoformat.AUTO_FORMAT:
+            return auto_format(img, steps, options, output_path, timer)
+        with timer.stage("transform"):
+            img = convert_for_format(img, image_format, options)
+        ext = f".{image_format}"
+
+    if STEP_COMPRESS in steps:
+        return compress_image(img, ext, options, output_path, timer)
+
+    if image_format:
+        save_output(img, output_path, timer, image_format.upper())
+    else:
+        save_output(img, output_path, timer)
+    return None
+
+
+def auto_format(img, steps, options, output_path, timer=None):
+    """候補の形式で並列に試しにエンコードし、選んだ形式で書き込む
+
+    試行は圧縮の品質の設定で行い、出力のパスの拡張子は選んだ形式に置き換える。
+    目標サイズの指定がある場合は、選んだ形式で改めて目標サイズに合わせる。
+    """
+    timer = timer or StageTimer()
+    with timer.stage("transform"):
+        img, alpha = autoformat.prepare_image(img)
+    formats = autoformat.candidate_formats(alpha)
+
+    # Image.save は保存中の設定を画像自身に保持するため、試行ごとに別の画像を渡す
+    with ThreadPoolExecutor(len(formats)) as executor:
+        futures = [
+            executor.submit(
+                encode_trial, img.copy() if i else img, image_format, options
+            )
+            for i, image_format in enumerate(formats)
+        ]
+        trials = []
+        for future in futures:
+            trial, stages = future.result()
+            trials.append(trial)
+            for name, seconds in stages.items():
+                timer.stages[name] = timer.stages.get(name, 0.0) + seconds
+
+    chosen = autoformat.select_trial(
+        trials, options.get("auto_min_psnr", autoformat.DEFAULT_MIN_PSNR)
+    )
+    base_path, _ = os.path.splitext(output_path)
+    output_path = f"{base_path}.{chosen['format']}"
+    result = {
+        "output_path": output_path,
+        "format": chosen["format"],
+        "trials": [
+            {key: trial[key] for key in ("format", "bytes", "psnr")}
+            for trial in trials
+        ],
+    }
+    if STEP_COMPRESS in steps and options.get("target_bytes"):
+        info = compress_image(
+            img, f".{chosen['format']}", options, output_path, timer
+        )
+        result.update(info or {})
+    else:
+        write_output(output_path, chosen["data"], timer)
+        result["bytes"] = chosen["bytes"]
+        if "quantize_method" in chosen:
+            result["quantize_method"] = chosen["quantize_method"]
+            result["quantize_seconds"] = chosen["quantize_seconds"]
+    logger.debug(
+        f"形式の自動選択: {chosen['format']} "
+        + ", ".join(
+            f"{trial['format']} {trial['bytes']}B {trial['psnr']:.1f}dB"
+            for trial in trials
+        )
+    )
+    return result
+
+
+def encode_trial(img, image_format, options):
+    """1つの形式でメモリ上にエンコードし、(試行結果, 段階別の処理時間) を返す
+
+    試行結果はエンコード結果 (data) とそのサイズ、デコードし直した画像の PSNR を含む。
+    """
+    import quality
+
+    timer = StageTimer()
+    trial = {"format": image_format}
+    if image_format == "png":
+        with timer.stage("transform"):
+            encoded, method, seconds = quantize_png(img, PNG_COLORS, options)
+        trial.update(quantize_method=method, quantize_seconds=seconds)
+        params = {"optimize": True}
+    else:
+        encoded = img
+        params = {
+            "quality": compress_quality_to_jpeg(options["compress_quality"]),
+            "optimize": True,
+        }
+    with timer.stage("encode"):
+        data = encode_to_buffer(encoded, image_format.upper(), **params)
+        with Image.open(io.BytesIO(data)) as decoded:
+            trial["psnr"] = quality.psnr(img, decoded.convert(img.mode))
+    trial.update(data=data, bytes=len(data))
+    return trial, timer.as_dict()
+
+
+def animated_output_format(img, ext, steps, options):
+    """アニメーションのまま保存する場合はその形式 (gif/webp) を返す
+
+    形式の自動選択では、アニメーションは元の形式のまま保存する。
+    出力がアニメーションに対応しない形式の場合は None (1枚目だけを処理する)。
+    """
+    if not animation.is_animated(img):
+        return None
+    image_format = ext.lower()[1:]
+    if STEP_CONVERT in steps and not is_auto_format(OPERATION_FORMAT, options):
+        image_format = options["target_format"]
+    if image_format not in animation.ANIMATED_FORMATS:
+        return None
+    return image_format
+
+
+def process_animation(img, image_format, steps, options, output_path, timer):
+    """全フレームをリサイズ・減色し、アニメーションとして保存する
+
+    フレームは1枚ずつ読み込みながら、リサイズをスレッドで並列に行う。
+    保存には全フレームが必要なため、変換後のフレームはすべて保持する
+    (必要なメモリ量はフレーム数に比例する。estimate_job_bytes を参照)。
+    GIFは変換後のフレームから共通のパレットを作り、減色も並列に行う。
+    減色・RGBへの変換は元のフレームを置き換えながら行う。
+    """
+    new_size = None
+    if STEP_RESIZE in steps:
+        new_size = calc_resize(
+            img.size, options["resize_by"], options["resize_value"]
+        )
+    reducing_gap = REDUCING_GAP if options.get("fast_resize") else None
+
+    def transform(item):
+        frame, duration = item
+        if new_size is not None:
+            frame = frame.resize(
+                new_size, Image.LANCZOS, reducing_gap=reducing_gap
+            )
+        return frame, duration, animation.uses_alpha(frame)
+
+    frames = []
+    durations = []
+    alpha = False
+    loop = img.info.get("loop")
+    with timer.stage("transform"):
+        for frame, duration, frame_alpha in animation.map_ordered(
+            transform, animation.iter_frames(img)
+        ):
+            frames.append(frame)
+            durations.append(duration)
+            alpha = alpha or frame_alpha
+
+        result = {"format": image_format, "frames": len(frames)}
+        quality = None
+        if image_format == "gif":
+            palette = animation.build_palette(
+                frames,
+                options.get(
+                    "quantize_method", quantize.DEFAULT_QUANTIZE_METHOD
+                ),
+            )
+            quantized = animation.map_ordered(
+                lambda frame: animation.to_palette(frame, palette, alpha),
+                frames,
+            )
+            for index, frame in enumerate(quantized):
+                frames[index] = frame
+        else:
+            if not alpha:
+                for index, frame in enumerate(frames):
+                    frames[index] = frame.convert("RGB")
+            if STEP_COMPRESS in steps:
+                quality = compress_quality_to_jpeg(options["compress_quality"])
+
+    base_path, _ = os.path.splitext(output_path)
+    output_path = f"{base_path}.{image_format}"
+    params = animation.save_params(
+        image_format, frames, durations, loop, alpha, quality
+    )
+    data = save_output(
+        frames[0], output_path, timer, image_format.upper(), **params
+    )
+    result.update(output_path=output_path, bytes=len(data))
+    return result
+
+
+def decodes_lazily(steps, options):
+    """リサイズ時に縮小デコードや帯状の読み込みを行い、全体を展開しない場合"""
+    return STEP_RESIZE in steps and (
+        options.get("fast_resize") or options.get("low_memory")
+    )
+
+
+def fast_downscale(img, new_size):
+    """縮小時に不要な画素のデコードと補間を省いてリサイズする
+
+    JPEGはdraftでDCT領域の縮小デコード (1/2, 1/4, 1/8) を行い、指定サイズ以上の
+    最小の解像度だけを展開する。その後reducing_gapで整数倍の縮小を挟み、
+    最後のLanczosは目標サイズの数倍の画像に対してのみ行う。
+    拡大の場合は通常のLanczosと同じ結果になる。
+    """
+    width, height = img.size
+    if new_size[0] >= width and new_size[1] >= height:
+        return img.resize(new_size, Image.LANCZOS)
+
+    # 読み込み前に呼ぶ必要がある。JPEG以外では何もしない
+    img.draft(img.mode, new_size)
+    return img.resize(new_size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def reduce_factor(size, new_size):
+    """reducing_gap と同じ基準で、Lanczosの前に挟む整数倍の縮小率を求める"""
+    return max(
+        int(min(size[0] / new_size[0], size[1] / new_size[1]) / REDUCING_GAP),
+        1,
+    )
+
+
+def low_memory_downscale(img, new_size):
+    """画像全体を展開せずに縮小する
+
+    非圧縮のTIFFなど画素が順に並ぶ形式は、帯状に読み込みながら整数倍に縮小し、
+    縮小後の画像だけをLanczosで仕上げる。それ以外の形式は fast_downscale と同じ
+    (JPEGは縮小デコード) になる。
+    """
+    factor = reduce_factor(img.size, new_size)
+    if factor > 1 and img.filename:
+        reduced = memory.banded_reduce(img.filename, factor)
+        if reduced is not None:
+            return reduced.resize(new_size, Image.LANCZOS)
+    return fast_downscale(img, new_size)
+
+
+def process_derivatives(image_path, options, output_dir, name_suffix=""):
+    """1回のデコードで、指定された幅と形式の組み合わせをすべて作成する
+
+    縮小は大きい幅から順に前の段階の画像を使って行い、各段階のエンコードと書き込みは
+    段階ごとにスレッドで並列に行う (Pillowはエンコード中にGILを解放するため、
+    次の段階の縮小と重なる)。
+    派生画像は毎回作成し、結果のキャッシュは使わない。
+    """
+    start = time.perf_counter()
+    timer = StageTimer()
+    widths = options.get("derivative_widths") or derivatives.DEFAULT_WIDTHS
+    formats = options.get("derivative_formats") or derivatives.DEFAULT_FORMATS
+
+    with timer.stage("open"):
+        img = Image.open(sources.open_source(image_path))
+    sizes = derivatives.plan_sizes(img.size, widths)
+    result = {"cached": False, "source_size": img.size}
+
+    reducing_gap = None
+    if options.get("fast_resize"):
+        # 最大の幅以上の解像度だけをデコードする (JPEGのみ)
+        img.draft(img.mode, sizes[0])
+        reducing_gap = REDUCING_GAP
+    with timer.stage("decode"):
+        img.load()
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = quantize.prepare_mode(img)
+
+    with ThreadPoolExecutor(min(len(sizes), MAX_DERIVATIVE_WRITERS)) as writer:
+        futures = []
+        levels = derivatives.cascade(img, sizes, reducing_gap)
+        while True:
+            with timer.stage("transform"):
+                level = next(levels, None)
+            if level is None:
+                break
+            size, level_img = level
+            output_paths = [
+                derivatives.variant_path(
+                    image_path, output_dir, size[0], image_format, name_suffix
+                )
+                for image_format in formats
+            ]
+            futures.append(
+                writer.submit(
+                    write_derivatives,
+                    level_img,
+                    formats,
+                    output_paths,
+                    options,
+                    outputs.pending_writes(),
+                )
+            )
+        variants = []
+        for future in futures:
+            level_variants, stages = future.result()
+            variants.extend(level_variants)
+            for name, seconds in stages.items():
+                timer.stages[name] = timer.stages.get(name, 0.0) + seconds
+
+    result["output_path"] = variants[0]["path"]
+    result["variants"] = variants
+    result["stages"] = timer.as_dict()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def write_derivatives(img, formats, output_paths, options, pending=None):
+    """1つの段階の画像を各形式で書き込み、(派生画像の情報, 段階別の処理時間) を返す
+
+    Image.save は保存中の設定を画像自身に保持するため、同じ画像の保存は
+    1つのスレッドで順に行う。処理時間はこのスレッド専用の StageTimer で計測する。
+    pending には呼び出し元のスレッドの書き込み待ちのリストを渡す。
+    """
+    with outputs.collect_writes(pending):
+        return encode_derivatives(img, formats, output_paths, options)
+
+
+def encode_derivatives(img, formats, output_paths, options):
+    timer = StageTimer()
+    quality = compress_quality_to_jpeg(options["compress_quality"])
+    variants = []
+    for image_format, output_path in zip(formats, output_paths):
+        with timer.stage("transform"):
+            encoded = convert_for_format(img, image_format, options)
+        data = save_output(
+            encoded,
+            output_path,
+            timer,
+            image_format.upper(),
+            quality=quality,
+            optimize=True,
+        )
+        variants.append(
+            {
+                "path": output_path,
+                "format": image_format,
+                "width": img.width,
+                "height": img.height,
+                "bytes": len(data),
+            }
+        )
+    return variants, timer.as_dict()
+
+
+def process_lossless(image_path, options, output_dir, name_suffix=""):
+    """JPEGを再エンコードせずに、向きの補正・メタデータの削除・再パックを行う
+
+    画素はデコードしないため、大きなJPEGでも読み込みと書き込みの時間でほぼ済む。
+    出力が元のファイルと同じ内容になる場合があるため、結果のキャッシュは使わない。
+    """
+    import jpeglossless
+
+    if not jpeglossless.is_jpeg_path(image_path):
+        raise ValueError("無劣化の処理はJPEGのみ対応しています")
+    start = time.perf_counter()
+    timer = StageTimer()
+    output_path = get_output_path(
+        image_path, OPERATION_LOSSLESS, options, output_dir, name_suffix
+    )
+    with timer.stage("open"):
+        data = sources.read_source(image_path)
+    with timer.stage("transform"):
+        data, info = jpeglossless.transform(
+            data,
+            rotate=options.get("lossless_rotate", True),
+            strip=options.get("strip_metadata", True),
+            progressive=options.get("progressive", False),
+            optimize=options.get("optimize_huffman", False),
+        )
+    write_output(output_path, data, timer)
+    return {
+        "output_path": output_path,
+        "cached": False,
+        "bytes": len(data),
+        "lossless": info,
+        "stages": timer.as_dict(),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def derivatives_record(image_path, result, output_dir):
+    width, height = result["source_size"]
+    return {
+        "source": os.path.abspath(image_path),
+        "width": width,
+        "height": height,
+        "variants": [
+            dict(variant, path=os.path.relpath(variant["path"], output_dir))
+            for variant in result["variants"]
+        ],
+    }
+
+
+def fit_memory_limit(image_path, operation, options, memory_limit):
+    """1ファイルの見積もりをメモリ上限 (ワーカー1つあたり) に収める
+
+    (見積もり, 処理に使う options) を返す。上限を超える画像は、省メモリの処理
+    (帯状の読み込み) で見積もりが小さくなる場合はそちらで処理する。
+    それでも上限を超える画像は、MemoryBudget が他の処理の完了を待って単独で実行する。
+    """
+    try:
+        need = estimate_job_bytes(image_path, operation, options)
+        if need <= memory_limit or options.get("low_memory"):
+            return need, options
+        low_options = dict(options, low_memory=True)
+        low_need = estimate_job_bytes(image_path, operation, low_options)
+    except Exception as e:
+        logger.debug(f"メモリの見積もりに失敗しました: {e}")
+        return 0, options
+    if low_need >= need:
+        return need, options
+    logger.info(
+        f"{image_path}: メモリ上限を超えるため省メモリで処理します "
+        f"({need // (1024 * 1024)}MB -> {low_need // (1024 * 1024)}MB)"
+    )
+    return low_need, low_options
+
+
+def estimate_job_bytes(image_path, operation, options):
+    """ヘッダーから、1ファイルの処理に必要なメモリ量を見積もる"""
+    steps = get_steps(operation, options)
+    with Image.open(sources.open_stream(image_path)) as img:
+        size, mode = img.size, img.mode
+        strips = memory.plan_raw_bands(img)
+        is_jpeg = img.format == "JPEG"
+        animated_format = None
+        if operation not in (OPERATION_DERIVATIVES, OPERATION_LOSSLESS):
+            _, ext = os.path.splitext(image_path)
+            animated_format = animated_output_format(img, ext, steps, options)
+        if animated_format:
+            n_frames = img.n_frames
+
+    if operation == OPERATION_LOSSLESS:
+        # 元のデータと変換後のデータ
+        return sources.stat_source(image_path)[0] * 2
+    decoded = memory.image_bytes(size, mode)
+    if operation == OPERATION_DERIVATIVES:
+        # デコード結果と最大の派生画像、エンコード中の各段階の画像
+        widths = options.get("derivative_widths") or derivatives.DEFAULT_WIDTHS
+        largest = derivatives.plan_sizes(size, widths)[0]
+        return decoded + memory.image_bytes(largest, mode) * 2
+    if animated_format:
+        # 変換後の全フレームを保持するため、フレーム数に比例する
+        new_size = size
+        if STEP_RESIZE in steps:
+            new_size = calc_resize(
+                size, options["resize_by"], options["resize_value"]
+            )
+        return animation.frames_bytes(
+            size, new_size, n_frames, animated_format
+        )
+    if STEP_RESIZE not in steps:
+        # デコード結果に加え、モード変換や減色・エンコードの作業領域
+        return decoded * 2
+
+    new_size = calc_resize(size, options["resize_by"], options["resize_value"])
+    output = memory.image_bytes(new_size, mode)
+    if options.get("low_memory") or options.get("fast_resize"):
+        factor = reduce_factor(size, new_size)
+        if options.get("low_memory") and strips is not None and factor > 1:
+            band = size[0] * memory.bytes_per_pixel(mode)
+            band *= memory.DEFAULT_BAND_ROWS * 2
+            return band + decoded // (factor * factor) + output
+        if is_jpeg:
+            # 縮小デコードは最大で1/8まで
+            scale = min(max(size[0] // new_size[0], 1), 8)
+            return decoded // (scale * scale) * 2 + output
+    return decoded * 2 + output
+
+
+def get_output_path(
+    image_path, operation, options, output_dir, name_suffix=""
+):
+    """出力先のパスを返す
+
+    形式を自動で選ぶ場合は処理後に拡張子が決まるため、仮の拡張子 (.auto) になる。
+    name_suffix は同じ名前の入力を区別する連番 (outputs.NameRegistry)。
+    """
+    file_name = sources.source_basename(image_path)
+    base_name, ext = os.path.splitext(file_name)
+    if STEP_CONVERT in get_steps(operation, options):
+        ext = f".{options['target_format']}"
+    return os.path.join(output_dir, f"{base_name}{name_suffix}_edited{ext}")
+
+
+def output_name_key(image_path, operation, options):
+    """出力のファイル名が重なるかを判定するキー
+
+    大文字と小文字を区別しないファイルシステムに合わせて小文字にする。
+    派生サイズと形式の自動選択は拡張子が入力で決まらないため、名前の部分だけで判定する。
+    """
+    name = os.path.basename(
+        get_output_path(image_path, operation, options, "")
+    )
+    if operation == OPERATION_DERIVATIVES or is_auto_format(
+        operation, options
+    ):
+        name = os.path.splitext(name)[0]
+    return name.lower()
+
+
+def resolve_mirror_root(image_paths, options):
+    """フォルダの構成を再現する場合に、基準のフォルダを決めた options を返す
+
+    ジョブの記録に残せるよう、処理の開始前に全件から決める。
+    """
+    if options.get("mirror_dirs") and not options.get("mirror_root"):
+        return dict(options, mirror_root=outputs.common_root(image_paths))
+    return options
+
+
+def resume_options(job):
+    """ジョブの記録 (journal.load) から、再開に使う設定を返す
+
+    基準のフォルダは記録されたもの (古い記録では元の全件から決めたもの) を使う。
+    アーカイブへの出力は、前回のアーカイブに追加できる場合は追加し、
+    異常終了で壊れている・圧縮したTARで追加できない場合は、前回のアーカイブを
+    上書きしないよう別の名前のアーカイブに出力する。
+    """
+    options = resolve_mirror_root(
+        job["paths"], dict(DEFAULT_OPTIONS, **job["options"])
+    )
+    archive_path = options.get("output_archive")
+    if archive_path and os.path.exists(archive_path):
+        if sources.can_append(archive_path):
+            options["append_archive"] = True
+        else:
+            ext = sources.archive_extension(archive_path)
+            options["output_archive"] = (
+                f"{archive_path[: -len(ext)]}_{job['id']}{ext}"
+            )
+            logger.warning(
+                f"{archive_path} に追加できないため、"
+                f"{options['output_archive']} に出力します"
+            )
+    return options
+
+
+def name_root(options):
+    """フォルダの構成を再現する場合の基準のフォルダ (しない場合は None)"""
+    if options.get("mirror_dirs") and options.get("mirror_root"):
+        return options["mirror_root"]
+    return None
+
+
+def cache_key(result_cache, image_path, operation, options):
+    params = cache_params(operation, options)
+    return result_cache.make_key(
+        sources.hash_source(image_path, cache.hash_file), operation, params
+    )
+
+
+def process_image(image_path, operation, options, output_dir, name_suffix=""):
+    """1ファイル分の処理を行い、結果を dict で返す
+
+    プロセスプールから呼び出せるよう、設定値はすべて options (dict) で受け取る。
+    戻り値の output_path は出力先のパス、cached はキャッシュを利用したかどうか、
+    seconds はこのファイルの処理にかかった時間。
+    options の defer_writes が真の場合は書き込まずに、(出力のパス, データ) の
+    リストを戻り値の pending_writes に入れて返す (書き込みは commit_writes で行う)。
+    """
+    pending = [] if options.get("defer_writes") else None
+    with outputs.collect_writes(pending):
+        result = run_operation(
+            image_path, operation, options, output_dir, name_suffix
+        )
+    if pending:
+        result["pending_writes"] = pending
+    return result
+
+
+def run_operation(image_path, operation, options, output_dir, name_suffix):
+    if operation == OPERATION_DERIVATIVES:
+        return process_derivatives(
+            image_path, options, output_dir, name_suffix
+        )
+    if operation == OPERATION_LOSSLESS:
+        return process_lossless(image_path, options, output_dir, name_suffix)
+
+    start = time.perf_counter()
+    steps = get_steps(operation, options)
+    if not steps:
+        raise ValueError("パイプラインの処理が選択されていません")
+
+    output_path = get_output_path(
+        image_path, operation, options, output_dir, name_suffix
+    )
+    result = {"output_path": output_path, "cached": False}
+
+    result_cache = None
+    if options.get("use_cache"):
+        result_cache = cache.ResultCache(
+            options["cache_dir"], options["cache_max_bytes"]
+        )
+        key = cache_key(result_cache, image_path, operation, options)
+        result["cache_key"] = key
+        if result_cache.restore(key, output_path):
+            result["cached"] = True
+            result["seconds"] = time.perf_counter() - start
+            return result
+
+    timer = StageTimer()
+    with timer.stage("open"):
+        img = Image.open(sources.open_source(image_path))
+    _, ext = os.path.splitext(image_path)
+
+    logger.debug(f"拡張子: {ext}")
+
+    animated_format = animated_output_format(img, ext, steps, options)
+    if animated_format:
+        info = process_animation(
+            img, animated_format, steps, options, output_path, timer
+        )
+    else:
+        # 縮小デコードを行う場合は、デコードの時間はtransformに含まれる
+        if not decodes_lazily(steps, options):
+            with timer.stage("decode"):
+                img.load()
+
+        # 処理タイプに応じた処理 (1回のデコードと1回のエンコードで行う)
+        info = run_pipeline(img, ext, steps, options, output_path, timer)
+    if info:
+        result.update(info)
+    result["stages"] = timer.as_dict()
+
+    # 書き込みを後で行う場合は、キャッシュへの保存も書き込みの後に行う
+    if result_cache is not None and outputs.pending_writes() is None:
+        result_cache.store(key, output_path)
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def iter_process(
+    image_paths,
+    operation,
+    options,
+    output_dir,
+    executor_type=DEFAULT_EXECUTOR,
+    max_workers=DEFAULT_MAX_WORKERS,
+    job=None,
+    executor=None,
+    registry=None,
+    name_paths=None,
+    output_archive=None,
+):
+    """画像を並列に処理し、完了した順に (入力パス, 結果, 例外) を返す
+
+    成功時は例外がNone、失敗時は結果がNoneになる。
+    キャッシュを使う場合は、全件の完了後に出力ディレクトリのマニフェストを更新し、
+    キャッシュの容量を上限まで削減する。
+    job (job.Job) を指定した場合は、一時停止中は新たな投入を止め、
+    取り消されると未着手の画像を処理せずに終了する。結果は job にも記録する。
+    executor を指定した場合は、新たに作らずにそれを使う (終了もしない)。
+    registry (outputs.NameRegistry) は出力の名前の記録。省略時は出力ディレクトリの
+    記録を読み込む。name_paths には、ジョブの再開などで image_paths が一部の場合に
+    元のジョブの全件を渡す (出力の名前と基準のフォルダは全件から決める)。
+    options の output_archive にパスを指定した場合は、出力を完了した順に
+    1つのアーカイブ (ZIP/TAR) へ追加し、出力ディレクトリからは削除する
+    (append_archive が真の場合は既存のアーカイブに追加する)。
+    output_archive (sources.OutputArchive) を指定した場合は、開き直さずにそれに
+    追加する (閉じるのは呼び出し側)。
+    """
+    records = []
+    derivative_records = []
+    if operation in (
+        OPERATION_DERIVATIVES,
+        OPERATION_LOSSLESS,
+    ) or is_auto_format(operation, options):
+        # 出力が複数になる・出力のパスが処理前に決まらない・再エンコードしないため、
+        # 結果のキャッシュは使わない
+        options = dict(options, use_cache=False)
+    if (
+        STEP_COMPRESS in get_steps(operation, options)
+        and options.get("shared_palette")
+        and options.get("palette") is None
+    ):
+        options = dict(
+            options, palette=build_batch_palette(image_paths, options)
+        )
+
+    # 書き込みはワーカーでは行わず、I/O用のスレッドでエンコードと並行して行う
+    io_workers = options.get("io_workers", outputs.DEFAULT_IO_WORKERS)
+    if io_workers:
+        options = dict(options, defer_writes=True)
+    if name_paths is None:
+        name_paths = image_paths
+    options = resolve_mirror_root(name_paths, options)
+    # 出力の名前は完了順に依存しないよう、投入前に全件分を決めておく
+    # (以前の実行で割り当てた名前は記録から引き継ぐ)
+    os.makedirs(output_dir, exist_ok=True)
+    if registry is None:
+        registry = outputs.NameRegistry(output_dir)
+    names = registry.plan(
+        name_paths,
+        lambda path: output_name_key(path, operation, options),
+        name_root(options),
+    )
+    for subdir in {subdir for subdir, _ in names.values() if subdir}:
+        os.makedirs(os.path.join(output_dir, subdir), exist_ok=True)
+
+    # メモリ上限はワーカー1つあたりの値で、同時実行分の合計を上限とする
+    # (1ファイルで上限を超える画像は、省メモリの処理に切り替える)
+    memory_limit = options.get("memory_limit")
+    budget = memory.MemoryBudget(
+        memory_limit * max_workers if memory_limit else None
+    )
+    # ワーカーが待たない程度に先行して投入し、残りは完了に応じて投入する
+    # (書き込み待ちのものも含める)
+    max_in_flight = max_workers * 2
+    queue = deque(image_paths)
+    if job:
+        job.start()
+
+    owns_archive = output_archive is None and options.get("output_archive")
+    if owns_archive:
+        output_archive = sources.OutputArchive(
+            options["output_archive"], options.get("append_archive", False)
+        )
+
+    if executor is None:
+        executor_context = create_executor(executor_type, max_workers)
+    else:
+        executor_context = nullcontext(executor)
+
+    with executor_context as executor, ThreadPoolExecutor(
+        max(io_workers, 1)
+    ) as io_executor:
+        futures = {}
+        # 書き込み中のもの: future -> (入力パス, メモリの見積もり, options, 結果)
+        writes = {}
+        while queue or futures or writes:
+            if job and job.cancelled:
+                queue.clear()
+                # 実行待ちのものは取り消し、実行中・書き込み中のものは完了を待つ
+                for future in [f for f in futures if f.cancel()]:
+                    budget.release(futures.pop(future)[1])
+                if not futures and not writes:
+                    break
+
+            while (
+                queue
+                and len(futures) + len(writes) < max_in_flight
+                and not (job and job.paused)
+            ):
+                image_path = queue[0]
+                need, job_options = 0, options
+                if memory_limit:
+                    need, job_options = fit_memory_limit(
+                        image_path, operation, options, memory_limit
+                    )
+                if not budget.try_acquire(need):
+                    break
+                queue.popleft()
+                if job:
+                    job.mark_started(image_path)
+                subdir, name_suffix = names[image_path]
+                future = executor.submit(
+                    process_image,
+                    image_path,
+                    operation,
+                    job_options,
+                    os.path.join(output_dir, subdir),
+                    name_suffix,
+                )
+                futures[future] = (image_path, need, job_options)
+
+            if not futures and not writes:
+                # 一時停止中で、実行中のものもない
+                job.wait_if_paused(PAUSE_POLL_SECONDS)
+                continue
+
+            done, _ = wait([*futures, *writes], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in writes:
+                    image_path, need, job_options, result = writes.pop(future)
+                else:
+                    image_path, need, job_options = futures.pop(future)
+                    result = None
+                try:
+                    if result is None:
+                        result = future.result()
+                        if "pending_writes" in result:
+                            # メモリは書き込みが終わるまで解放しない
+                            writes[
+                                io_executor.submit(
+                                    commit_writes, result, options
+                                )
+                            ] = (image_path, need, job_options, result)
+                            continue
+                    else:
+                        future.result()
+                except Exception as e:
+                    budget.release(need)
+                    if job:
+                        job.record(image_path, None, e)
+                    yield image_path, None, e
+                    continue
+                budget.release(need)
+
+                if options.get("use_cache"):
+                    records.append(
+                        manifest_record(
+                            image_path, operation, job_options, result
+                        )
+                    )
+                if operation == OPERATION_DERIVATIVES:
+                    derivative_records.append(
+                        derivatives_record(image_path, result, output_dir)
+                    )
+                if output_archive is not None:
+                    archive_outputs(output_archive, result, output_dir)
+                if job:
+                    job.record(image_path, result, None)
+                yield image_path, result, None
+
+    if owns_archive:
+        output_archive.close()
+    sources.close_readers()
+    if job:
+        job.finish()
+
+    if derivative_records:
+        derivatives.update_manifest(output_dir, derivative_records)
+
+    if options.get("use_cache"):
+        if records:
+            cache.update_manifest(output_dir, records)
+        cache.ResultCache(
+            options["cache_dir"], options["cache_max_bytes"]
+        ).evict()
+
+
+def commit_writes(result, options):
+    """ワーカーがエンコードした出力を書き込む (I/O用のスレッドで呼ばれる)
+
+    書き込みの時間は結果の stages に加える。
+    """
+    start = time.perf_counter()
+    for output_path, data in result.pop("pending_writes"):
+        outputs.write_atomic(output_path, data)
+    seconds = time.perf_counter() - start
+    stages = result.setdefault("stages", {})
+    stages["write"] = stages.get("write", 0.0) + seconds
+
+    if options.get("use_cache") and not result.get("cached"):
+        cache.ResultCache(
+            options["cache_dir"], options["cache_max_bytes"]
+        ).store(result["cache_key"], result["output_path"])
+
+
+def archive_outputs(output_archive, result, output_dir):
+    """出力ファイルをアーカイブに移す (フォルダの構成を再現する場合はその相対パスで)"""
+    if "variants" in result:
+        output_paths = [variant["path"] for variant in result["variants"]]
+    else:
+        output_paths = [result["output_path"]]
+    for output_path in output_paths:
+        # 同じ名前が既にあり追加されなかった場合も、出力ディレクトリには残さない
+        output_archive.add(
+            output_path, os.path.relpath(output_path, output_dir)
+        )
+        os.remove(output_path)
+
+
+def is_up_to_date(
+    image_path,
+    operation,
+    options,
+    output_dir,
+    registry=None,
+    output_archive=None,
+):
+    """出力が既にあり、入力より新しい場合は True を返す
+
+    出力の名前は registry (outputs.NameRegistry) で割り当て済みのものを使う。
+    名前が割り当てられていない入力は、まだ処理していないものとして扱う。
+    output_archive (sources.OutputArchive) を指定した場合は、出力ディレクトリの
+    代わりにアーカイブのメンバーを確認する。
+    """
+    if operation == OPERATION_DERIVATIVES:
+        # 出力のパスが元画像のサイズで決まるため、判定しない
+        return False
+    if registry is None:
+        registry = outputs.NameRegistry(output_dir)
+    subdir, key = outputs.name_claim(
+        image_path,
+        lambda path: output_name_key(path, operation, options),
+        name_root(options),
+    )
+    name_suffix = registry.suffix(image_path, key)
+    if name_suffix is None:
+        return False
+    output_path = get_output_path(
+        image_path,
+        operation,
+        options,
+        os.path.join(output_dir, subdir),
+        name_suffix,
+    )
+    output_paths = [output_path]
+    if is_auto_format(operation, options):
+        # 選ばれた形式が分からないため、候補の形式の出力をすべて確認する
+        base_path, _ = os.path.splitext(output_path)
+        output_paths = [
+            f"{base_path}.{image_format}"
+            for image_format in [
+                *autoformat.CANDIDATE_FORMATS,
+                *animation.ANIMATED_FORMATS,
+            ]
+        ]
+    try:
+        source_mtime = sources.stat_source(image_path)[1]
+    except OSError:
+        return False
+    for output_path in output_paths:
+        if output_archive is not None:
+            member_mtime = output_archive.names.get(
+                os.path.relpath(output_path, output_dir)
+            )
+            if member_mtime is not None and member_mtime * 1e9 >= source_mtime:
+                return True
+            continue
+        try:
+            if os.stat(output_path).st_mtime_ns >= source_mtime:
+                return True
+        except OSError:
+            continue
+    return False
+
+
+def watch(
+    directories,
+    operation,
+    options,
+    output_dir,
+    executor_type=DEFAULT_EXECUTOR,
+    max_workers=DEFAULT_MAX_WORKERS,
+    queue_size=None,
+    settle_seconds=None,
+):
+    """ディレクトリを監視し、追加・更新された画像を処理し続ける
+
+    iter_process と同じく (入力パス, 結果, 例外) を返し続けるジェネレーター。
+    出力が入力より新しい画像は処理済みとして飛ばすため、再起動しても同じ画像を
+    処理し直さない。出力ディレクトリが監視対象の中にあっても、出力は対象にしない。
+    queue_size・settle_seconds が None の場合は watcher の既定値を使う。
+    """
+    import watcher
+
+    if queue_size is None:
+        queue_size = watcher.DEFAULT_QUEUE_SIZE
+    if settle_seconds is None:
+        settle_seconds = watcher.DEFAULT_SETTLE_SECONDS
+    output_root = os.path.join(os.path.abspath(output_dir), "")
+    if options.get("mirror_dirs") and not options.get("mirror_root"):
+        # バッチごとに基準のフォルダが変わらないよう、監視対象から決める
+        options = dict(options, mirror_root=outputs.input_root(directories))
+    # 名前の割り当てはバッチをまたいで共有し、後のバッチが前の出力を上書きしない
+    registry = outputs.NameRegistry(output_dir)
+    # アーカイブは監視中ずっと開いておき、再起動時は既存のものに追加する
+    output_archive = None
+    if options.get("output_archive"):
+        ext = sources.archive_extension(options["output_archive"]).lower()
+        if ext not in (".zip", ".tar"):
+            # 圧縮したTARは追加できず、再起動時に前の出力を消してしまう
+            raise ValueError(
+                "監視中の出力には、追加できるZIPか無圧縮のTARを指定してください"
+            )
+        output_archive = sources.OutputArchive(
+            options["output_archive"], append=True, replace=True
+        )
+
+    def accept(path):
+        return (
+            is_valid_image(path)
+            and not os.path.abspath(path).startswith(output_root)
+            and not is_up_to_date(
+                path, operation, options, output_dir, registry, output_archive
+            )
+        )
+
+    folder_watcher = watcher.Watcher(
+        directories,
+        accept,
+        queue_size=queue_size,
+        settle_seconds=settle_seconds,
+    )
+    folder_watcher.start()
+    try:
+        # プロセスの起動を繰り返さないよう、Executorは監視中ずっと使い回す
+        with create_executor(executor_type, max_workers) as executor:
+            while True:
+                batch = folder_watcher.next_batch(max_workers * 2)
+                if batch:
+                    yield from iter_process(
+                        batch,
+                        operation,
+                        options,
+                        output_dir,
+                        executor_type,
+                        max_workers,
+                        executor=executor,
+                        registry=registry,
+                        output_archive=output_archive,
+                    )
+    finally:
+        folder_watcher.stop()
+        if output_archive is not None:
+            output_archive.close()
+
+
+def build_batch_palette(image_paths, options):
+    """バッチ内のPNGから共通のパレットを作成する"""
+    png_paths = [path for path in image_paths if path.lower().endswith(".png")]
+    if not png_paths:
+        return None
+    palette = quantize.build_shared_palette(
+        png_paths,
+        PNG_COLORS,
+        options.get("quantize_method", quantize.DEFAULT_QUANTIZE_METHOD),
+    )
+    logger.debug(f"共通パレットを作成しました ({len(png_paths)}枚中)")
+    return palette
+
+
+def manifest_record(image_path, operation, options, result):
+    return {
+        "source": os.path.abspath(image_path),
+        "output_path": result["output_path"],
+        "operation": operation,
+        "params": cache_params(operation, options),
+        "cache_key": result["cache_key"],
+        "cached": result["cached"],
+        "bytes": os.path.getsize(result["output_path"]),
+    }
+
+
+def expand_inputs(inputs, stream=None):
+    """グロブ・ディレクトリ・アーカイブ・標準入力 ("-") から画像のパスを列挙する
+
+    アーカイブ内の画像は「アーカイブのパス::メンバー名」の形式で返す。
+    """
+    stream = stream or sys.stdin
+    for item in inputs:
+        if item == "-":
+            candidates = (line.strip() for line in stream)
+        elif os.path.isdir(item):
+            candidates = [item]
+        else:
+            candidates = sorted(glob.glob(item)) or [item]
+
+        yield from sources.iter_sources(
+            filter(None, candidates), is_valid_image
+        )
+
+
+def positive_int(value):
+    """argparse の type: 1以上の整数"""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(
+            f"1以上の整数を指定してください: {value}"
+        )
+    return number
+
+
+def build_parser():
+    import watcher
+
+    parser = argparse.ArgumentParser(
+        prog="python -m processor",
+        description="画像の圧縮・形式変更・リサイズを一括で行います。",
+    )
+    parser.add_argument("operation", choices=list(CLI_OPERATIONS))
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help='画像ファイル・グロブ・ディレクトリ ("-" で標準入力から読み込み)',
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default=os.path.join(
+            os.path.expanduser("~"), "Downloads", "edited_fig"
+        ),
+    )
+    parser.add_argument(
+        "--steps",
+        nargs="+",
+        choices=PIPELINE_STEPS,
+        default=DEFAULT_OPTIONS["pipeline_steps"],
+        help="pipeline で実行する処理 (resize → convert → compress の順に適用)",
+    )
+    parser.add_argument(
+        "--preset",
+        help="保存したプリセットの名前またはファイル (指定した引数より優先)",
+    )
+    parser.add_argument(
+        "--save-preset", help="今回の設定をプリセットとして保存する"
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        choices=range(1, 11),
+        default=DEFAULT_OPTIONS["compress_quality"],
+        help="圧縮後の品質 (1-10)",
+    )
+    parser.add_argument(
+        "--target-kb",
+        type=int,
+        help="圧縮後のファイルサイズの上限 (KB)。指定時は上限内で最高の品質を探索する",
+    )
+    parser.add_argument(
+        "--max-passes",
+        type=int,
+        default=DEFAULT_MAX_ENCODE_PASSES,
+        help="目標サイズ指定時のエンコードの最大試行回数",
+    )
+    parser.add_argument(
+        "--quantize",
+        choices=list(quantize.QUANTIZE_METHODS),
+        default=DEFAULT_OPTIONS["quantize_method"],
+        help="PNG圧縮時の減色エンジン",
+    )
+    parser.add_argument(
+        "--shared-palette",
+        action="store_true",
+        help="似た画像のPNGで共通のパレットを使い回す",
+    )
+    parser.add_argument(
+        "--format",
+        choices=TARGET_FORMATS + [autoformat.AUTO_FORMAT],
+        default=DEFAULT_OPTIONS["target_format"],
+        help="auto: 画像ごとに JPEG/WebP/PNG を試し、最も小さい形式を選ぶ",
+    )
+    parser.add_argument(
+        "--min-psnr",
+        type=float,
+        default=DEFAULT_OPTIONS["auto_min_psnr"],
+        help="--format auto で候補とする画質の下限 (dB)",
+    )
+    parser.add_argument(
+        "--icc",
+        choices=colorconvert.ICC_MODES,
+        default=DEFAULT_OPTIONS["icc_mode"],
+        help="keep: ICCプロファイルを引き継ぐ / srgb: sRGBに変換して埋め込まない",
+    )
+    parser.add_argument(
+        "--by",
+        choices=["width", "height"],
+        default=DEFAULT_OPTIONS["resize_by"],
+    )
+    parser.add_argument(
+        "--value", type=int, default=DEFAULT_OPTIONS["resize_value"]
+    )
+    parser.add_argument(
+        "--fast-resize",
+        action="store_true",
+        help="縮小デコードと段階的な縮小でリサイズを高速化する (画質はわずかに低下)",
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="巨大な画像を帯状に読み込むなど、メモリ使用量を抑えて処理する",
+    )
+    parser.add_argument(
+        "--memory-limit-mb",
+        type=int,
+        help="ワーカー1つあたりのメモリ上限 (MB)。同時に処理する画像数を調整し、"
+        "上限を超える画像は省メモリで処理する",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="同じ画像・同じ設定の処理結果をキャッシュから再利用する",
+    )
+    parser.add_argument("--cache-dir", default=DEFAULT_OPTIONS["cache_dir"])
+    parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=DEFAULT_OPTIONS["cache_max_bytes"] // (1024 * 1024),
+    )
+    parser.add_argument(
+        "--executor", choices=EXECUTOR_TYPES, default=DEFAULT_EXECUTOR
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=DEFAULT_MAX_WORKERS
+    )
+    parser.add_argument(
+        "--widths",
+        type=positive_int,
+        nargs="+",
+        default=DEFAULT_OPTIONS["derivative_widths"],
+        help="derivatives で作成する幅",
+    )
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=TARGET_FORMATS,
+        default=DEFAULT_OPTIONS["derivative_formats"],
+        help="derivatives で作成する形式",
+    )
+    parser.add_argument(
+        "--no-rotate",
+        dest="lossless_rotate",
+        action="store_false",
+        help="lossless で向きの補正を行わない",
+    )
+    parser.add_argument(
+        "--keep-metadata",
+        action="store_true",
+        help="lossless でEXIFなどのメタデータを削除しない",
+    )
+    parser.add_argument(
+        "--progressive",
+        action="store_true",
+        help="lossless でプログレッシブ形式に変換する (jpegtran が必要)",
+    )
+    parser.add_argument(
+        "--optimize-huffman",
+        action="store_true",
+        help="lossless でハフマン表を最適化する (jpegtran が必要)",
+    )
+    parser.add_argument(
+        "--mirror-dirs",
+        action="store_true",
+        help="入力のフォルダの構成を出力先にも再現する",
+    )
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=DEFAULT_OPTIONS["io_workers"],
+        help="出力の書き込みを行うスレッド数 (0 でワーカーが直接書き込む)",
+    )
+    parser.add_argument(
+        "--output-archive",
+        metavar="FILE",
+        help="出力を1つのアーカイブ (.zip/.tar/.tar.gz など) にまとめる",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="入力のディレクトリを監視し、追加された画像を処理し続ける",
+    )
+    parser.add_argument(
+        "--settle-seconds",
+        type=float,
+        default=watcher.DEFAULT_SETTLE_SECONDS,
+        help="この秒数だけ変更のなかったファイルを書き込み済みとみなす",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=watcher.DEFAULT_QUEUE_SIZE,
+        help="処理待ちの上限 (超えると監視を待たせる)",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="ファイルごとの段階別の処理時間をJSON Lines形式で出力する",
+    )
+    parser.add_argument(
+        "--journal",
+        action="store_true",
+        help="ファイルごとの状態を記録し、中断時に python -m journal で"
+        "残りと失敗の一覧を出力できるようにする",
+    )
+    parser.add_argument("--log-level", default=log_level)
+    return parser
+
+
+def options_from_args(args):
+    return {
+        "compress_quality": args.quality,
+        "target_format": args.format,
+        "icc_mode": args.icc,
+        "auto_min_psnr": args.min_psnr,
+        "resize_by": args.by,
+        "resize_value": args.value,
+        "fast_resize": args.fast_resize,
+        "target_bytes": args.target_kb * 1024 if args.target_kb else None,
+        "max_encode_passes": args.max_passes,
+        "quantize_method": args.quantize,
+        "shared_palette": args.shared_palette,
+        "low_memory": args.low_memory,
+        "memory_limit": (
+            args.memory_limit_mb * 1024 * 1024
+            if args.memory_limit_mb
+            else None
+        ),
+        "pipeline_steps": args.steps,
+        "use_cache": args.cache,
+        "cache_dir": args.cache_dir,
+        "cache_max_bytes": args.cache_size_mb * 1024 * 1024,
+        "derivative_widths": args.widths,
+        "derivative_formats": args.formats,
+        "lossless_rotate": args.lossless_rotate,
+        "strip_metadata": not args.keep_metadata,
+        "progressive": args.progressive,
+        "optimize_huffman": args.optimize_huffman,
+        "output_archive": args.output_archive,
+        "mirror_dirs": args.mirror_dirs,
+        "mirror_root": (
+            outputs.input_root(args.inputs) if args.mirror_dirs else None
+        ),
+        "io_workers": max(args.io_workers, 0),
+    }
+
+
+def print_result(image_path, result, error):
+    if error is not None:
+        logger.error(f"エラー ({image_path}): {str(error)}")
+        return
+    if "quantize_seconds" in result:
+        logger.info(
+            f"{image_path}: 減色 {result['quantize_method']} "
+            f"{result['quantize_seconds'] * 1000:.1f}ms"
+        )
+    if "variants" in result:
+        for variant in result["variants"]:
+            print(
+                f"{variant['path']} ({variant['width']}x"
+                f"{variant['height']}, {variant['bytes']}B)"
+            )
+    elif "encode_passes" in result:
+        print(
+            f"{result['output_path']} "
+            f"({result['bytes']}B, 試行: {result['encode_passes']}回)"
+        )
+    elif "lossless" in result:
+        info = result["lossless"]
+        print(
+            f"{result['output_path']} ({result['bytes']}B, "
+            f"向き: {info['orientation']}, "
+            f"回転: {'あり' if info['rotated'] else 'なし'}, "
+            f"削除: {info['stripped_bytes']}B)"
+        )
+    elif "frames" in result:
+        print(
+            f"{result['output_path']} "
+            f"({result['frames']}フレーム, {result['bytes']}B)"
+        )
+    elif "trials" in result:
+        print(
+            f"{result['output_path']} "
+            f"({result['format']}, {result['bytes']}B)"
+        )
+    else:
+        print(result["output_path"])
+
+
+def run_watch(args, options):
+    """--watch の場合。Ctrl+C で終了するまで処理し続ける"""
+    if not all(os.path.isdir(path) for path in args.inputs):
+        logger.error("監視の対象にはディレクトリを指定してください")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    logger.info(f"監視を開始しました: {', '.join(args.inputs)}")
+    try:
+        for image_path, result, error in watch(
+            args.inputs,
+            CLI_OPERATIONS[args.operation],
+            options,
+            args.output_dir,
+            args.executor,
+            max(args.workers, 1),
+            queue_size=max(args.queue_size, 1),
+            settle_seconds=args.settle_seconds,
+        ):
+            print_result(image_path, result, error)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        logger.info("監視を終了しました")
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logger.set_level(args.log_level.upper())
+
+    options = options_from_args(args)
+    if args.preset:
+        options.update(presets.load_preset(args.preset))
+    if args.save_preset:
+        path = presets.save_preset(
+            args.save_preset, recipe_from_options(options)
+        )
+        logger.info(f"プリセットを保存しました: {path}")
+
+    if args.watch:
+        return run_watch(args, options)
+
+    image_paths = list(expand_inputs(args.inputs))
+    if not image_paths:
+        logger.error("処理対象の画像が見つかりません")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = resolve_mirror_root(image_paths, options)
+    job_journal = None
+    if args.journal:
+        import journal
+
+        job_journal = journal.Journal.create(
+            image_paths,
+            CLI_OPERATIONS[args.operation],
+            options,
+            args.output_dir,
+        )
+        logger.info(f"ジョブの記録: {job_journal.path}")
+    job = Job(len(image_paths), args.metrics, job_journal)
+
+    success_count = 0
+    error_count = 0
+    for image_path, result, error in iter_process(
+        image_paths,
+        CLI_OPERATIONS[args.operation],
+        options,
+        args.output_dir,
+        args.executor,
+        max(args.workers, 1),
+        job,
+    ):
+        print_result(image_path, result, error)
+        if error is None:
+            success_count += 1
+        else:
+            error_count += 1
+
+    logger.info(
+        f"成功: {success_count}, エラー: {error_count} "
+        f"({job.elapsed():.2f}秒, {job.throughput():.2f}枚/秒)"
+    )
+    return 0 if error_count == 0 else 2
+
+
+if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+
+        multiprocessing.freeze_support()
+    sys.exit(main())
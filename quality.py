@@ -0,0 +1,65 @@
+"""エンコード結果の画質の指標 (PSNR と SSIM)
+
+どちらも元の画像とエンコード後にデコードし直した画像を比較する。
+画素ごとの計算は ImageChops と ImageStat に任せ、Python のループはブロック単位に留める。
+"""
+
+import math
+
+from PIL import ImageChops, ImageStat
+
+SSIM_BLOCK = 32
+# SSIM の安定化定数 (8bit, K1=0.01, K2=0.03)
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def psnr(original, encoded):
+    diff = ImageChops.difference(original, encoded)
+    mse = sum(rms**2 for rms in ImageStat.Stat(diff).rms) / len(
+        diff.getbands()
+    )
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255**2 / mse)
+
+
+def ssim(original, encoded, block=SSIM_BLOCK):
+    """グレースケールでブロックごとに SSIM を求め、平均を返す
+
+    共分散は (x+y)/2 の分散から求める: cov = 2*var((x+y)/2) - (var_x + var_y)/2
+    """
+    x_img = original.convert("L")
+    y_img = encoded.convert("L")
+    mean_img = ImageChops.add(x_img, y_img, scale=2)
+    width, height = x_img.size
+    scores = []
+    for top in range(0, max(height - block, 0) + 1, block):
+        for left in range(0, max(width - block, 0) + 1, block):
+            box = (
+                left,
+                top,
+                min(left + block, width),
+                min(top + block, height),
+            )
+            x = ImageStat.Stat(x_img.crop(box))
+            y = ImageStat.Stat(y_img.crop(box))
+            m = ImageStat.Stat(mean_img.crop(box))
+            mean_x, mean_y = x.mean[0], y.mean[0]
+            var_x, var_y = x.var[0], y.var[0]
+            cov = 2 * m.var[0] - (var_x + var_y) / 2
+            scores.append(
+                ((2 * mean_x * mean_y + SSIM_C1) * (2 * cov + SSIM_C2))
+                / (
+                    (mean_x**2 + mean_y**2 + SSIM_C1)
+                    * (var_x + var_y + SSIM_C2)
+                )
+            )
+    return sum(scores) / len(scores) if scores else 1.0
+
+
+def comparable(img):
+    """画質の比較用に、アルファやパレットを除いたモードに揃える"""
+    if img.mode in ("RGB", "L"):
+        return img
+    return img.convert("RGBA").convert("RGB")
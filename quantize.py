@@ -0,0 +1,113 @@
+"""PNG圧縮のための減色処理
+
+減色のエンジンを選択でき、透過を含む画像も扱えるようにモードを整えてから減色する。
+スクリーンショットやアイコンなど似た画像をまとめて処理する場合は、
+一部の画像から作った共通のパレットを全体で使い回すこともできる。
+"""
+
+import time
+
+from PIL import Image, features
+
+import colorconvert
+import settings
+import sources
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+QUANTIZE_METHODS = {
+    "mediancut": Image.Quantize.MEDIANCUT,
+    "maxcoverage": Image.Quantize.MAXCOVERAGE,
+    "fastoctree": Image.Quantize.FASTOCTREE,
+    "libimagequant": Image.Quantize.LIBIMAGEQUANT,
+}
+DEFAULT_QUANTIZE_METHOD = settings.DEFAULT_QUANTIZE_METHOD
+# 透過を含む画像 (RGBA) に対応しているエンジン
+ALPHA_METHODS = ["fastoctree", "libimagequant"]
+
+# 共通パレットの作成に使う画像の枚数と、1枚あたりの縮小サイズ
+PALETTE_SAMPLE_COUNT = 16
+PALETTE_SAMPLE_SIZE = (128, 128)
+
+
+def available_methods():
+    methods = list(QUANTIZE_METHODS)
+    if not features.check_feature("libimagequant"):
+        methods.remove("libimagequant")
+    return methods
+
+
+def prepare_mode(img):
+    """減色できるモード (RGB/RGBA) に変換する
+
+    16ビットのグレースケールやCMYKも colorconvert で正しい色のRGBにする。
+    """
+    return colorconvert.convert_modes(img, colorconvert.RGB_MODES)
+
+
+def resolve_method(method, alpha):
+    """使用できない組み合わせの場合は fastoctree に切り替える"""
+    if method not in available_methods():
+        logger.debug(f"{method} は使用できないため fastoctree を使用します")
+        return DEFAULT_QUANTIZE_METHOD
+    if alpha and method not in ALPHA_METHODS:
+        return DEFAULT_QUANTIZE_METHOD
+    return method
+
+
+def palette_image(palette):
+    """getpalette() の値からパレット用の画像を作る"""
+    img = Image.new("P", (1, 1))
+    img.putpalette(palette)
+    return img
+
+
+def quantize_image(img, colors, method=DEFAULT_QUANTIZE_METHOD, palette=None):
+    """減色した画像と使用したエンジン名、処理時間 (秒) を返す
+
+    palette を指定した場合は、透過を含まない画像に限り共通パレットへ割り当てる。
+    """
+    start = time.perf_counter()
+    img = prepare_mode(img)
+    alpha = img.mode == "RGBA"
+
+    if palette is not None and not alpha:
+        quantized = img.quantize(
+            palette=palette_image(palette), dither=Image.Dither.NONE
+        )
+        used = "palette"
+    else:
+        used = resolve_method(method, alpha)
+        quantized = img.quantize(colors=colors, method=QUANTIZE_METHODS[used])
+    return quantized, used, time.perf_counter() - start
+
+
+def build_shared_palette(image_paths, colors, method=DEFAULT_QUANTIZE_METHOD):
+    """先頭の数枚を縮小して並べた画像から、共通のパレットを作成する"""
+    samples = []
+    for path in image_paths[:PALETTE_SAMPLE_COUNT]:
+        try:
+            with Image.open(sources.open_source(path)) as img:
+                img.draft("RGB", PALETTE_SAMPLE_SIZE)
+                # 色の分布だけを使うため、縦横比は保たずに揃える
+                sample = prepare_mode(img).convert("RGB")
+                samples.append(sample.resize(PALETTE_SAMPLE_SIZE))
+        except Exception as e:
+            logger.warning(f"パレット作成に使えない画像です ({path}): {e}")
+    if not samples:
+        return None
+    return palette_from_samples(samples, colors, method)
+
+
+def palette_from_samples(samples, colors, method=DEFAULT_QUANTIZE_METHOD):
+    """PALETTE_SAMPLE_SIZE に縮小したRGBの画像を並べて減色し、パレットを返す"""
+    width, height = PALETTE_SAMPLE_SIZE
+    montage = Image.new("RGB", (width * len(samples), height))
+    for i, sample in enumerate(samples):
+        montage.paste(sample, (i * width, 0))
+
+    used = resolve_method(method, False)
+    quantized = montage.quantize(colors=colors, method=QUANTIZE_METHODS[used])
+    return quantized.getpalette()
@@ -0,0 +1,131 @@
+"""処理の種類・段階と設定の既定値
+
+GUIの起動時に必要な値だけをまとめたモジュール。Pillow や画像処理の
+モジュールには依存しないため、processor などは処理を始めるときに読み込める。
+減色の方式など各モジュールの既定値もここで定義し、各モジュールから参照する。
+"""
+
+import os
+
+import cache
+import outputs
+
+OPERATION_COMPRESS = "圧縮"
+OPERATION_FORMAT = "形式変更"
+OPERATION_RESIZE = "リサイズ"
+OPERATION_PIPELINE = "パイプライン"
+# 1回のデコードで複数の幅・形式の派生画像を作成する
+OPERATION_DERIVATIVES = "派生サイズ"
+# JPEGを再エンコードせずに向きの補正・メタデータの削除を行う
+OPERATION_LOSSLESS = "無劣化JPEG"
+
+# パイプラインの各段階。1回のデコードとエンコードの間でこの順に適用する
+STEP_RESIZE = "resize"
+STEP_CONVERT = "convert"
+STEP_COMPRESS = "compress"
+PIPELINE_STEPS = [STEP_RESIZE, STEP_CONVERT, STEP_COMPRESS]
+
+# 単独の処理は、1段階だけのパイプラインとして実行する
+OPERATION_STEPS = {
+    OPERATION_COMPRESS: [STEP_COMPRESS],
+    OPERATION_FORMAT: [STEP_CONVERT],
+    OPERATION_RESIZE: [STEP_RESIZE],
+}
+
+# CLIのサブコマンド名と処理の対応
+CLI_OPERATIONS = {
+    "compress": OPERATION_COMPRESS,
+    "convert": OPERATION_FORMAT,
+    "resize": OPERATION_RESIZE,
+    "pipeline": OPERATION_PIPELINE,
+    "derivatives": OPERATION_DERIVATIVES,
+    "lossless": OPERATION_LOSSLESS,
+}
+
+SUPPORTED_EXTENSIONS = [
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".webp",
+    ".tiff",
+    ".bmp",
+    ".gif",
+]
+TARGET_FORMATS = ["jpeg", "png", "webp", "tiff", "bmp", "gif"]
+# 画像ごとに形式を選ぶ場合の変換先の指定 (autoformat)
+AUTO_FORMAT = "auto"
+# auto で候補として認める画質の下限 (dB)
+DEFAULT_MIN_PSNR = 35.0
+# ICCプロファイルの扱い (colorconvert)
+ICC_MODES = ["keep", "srgb"]
+DEFAULT_ICC_MODE = "keep"
+DEFAULT_QUANTIZE_METHOD = "fastoctree"
+# 派生サイズで作成する幅と形式 (derivatives)
+DEFAULT_DERIVATIVE_WIDTHS = [320, 640, 1280, 2560]
+DEFAULT_DERIVATIVE_FORMATS = ["jpeg", "webp"]
+
+DEFAULT_COMPRESS_RATE = 7
+DEFAULT_RESIZE_VALUE = 800
+DEFAULT_EXECUTOR = "process"
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+EXECUTOR_TYPES = ["process", "thread"]
+DEFAULT_MAX_ENCODE_PASSES = 8
+
+DEFAULT_OPTIONS = {
+    "compress_quality": DEFAULT_COMPRESS_RATE,
+    "target_format": "jpeg",
+    "icc_mode": DEFAULT_ICC_MODE,
+    "auto_min_psnr": DEFAULT_MIN_PSNR,
+    "resize_by": "width",
+    "resize_value": DEFAULT_RESIZE_VALUE,
+    "fast_resize": False,
+    "target_bytes": None,
+    "quantize_method": DEFAULT_QUANTIZE_METHOD,
+    "shared_palette": False,
+    "low_memory": False,
+    "memory_limit": None,
+    "max_encode_passes": DEFAULT_MAX_ENCODE_PASSES,
+    "use_cache": False,
+    "cache_dir": cache.DEFAULT_CACHE_DIR,
+    "cache_max_bytes": cache.DEFAULT_CACHE_MAX_BYTES,
+    "pipeline_steps": list(PIPELINE_STEPS),
+    "derivative_widths": list(DEFAULT_DERIVATIVE_WIDTHS),
+    "derivative_formats": list(DEFAULT_DERIVATIVE_FORMATS),
+    "lossless_rotate": True,
+    "strip_metadata": True,
+    "progressive": False,
+    "optimize_huffman": False,
+    "output_archive": None,
+    "mirror_dirs": False,
+    "mirror_root": None,
+    "io_workers": outputs.DEFAULT_IO_WORKERS,
+}
+
+
+def is_valid_image(file_path):
+    _, ext = os.path.splitext(file_path)
+    return ext.lower() in SUPPORTED_EXTENSIONS
+
+
+def calc_resize(size, resize_by, resize_value):
+    """指定された辺の長さに合わせて、縦横比を保った新しいサイズを返す"""
+    width, height = size
+    if resize_by == "width":
+        new_width = resize_value
+        new_height = int(height * (new_width / width))
+    else:
+        new_height = resize_value
+        new_width = int(width * (new_height / height))
+    return new_width, new_height
+
+
+def parse_widths(text):
+    """カンマ区切りの幅の指定を、正の整数のリストにする
+
+    空の場合は空のリストを返す (処理時に既定の幅を使う)。
+    """
+    widths = [int(value) for value in text.split(",") if value.strip()]
+    invalid = [width for width in widths if width <= 0]
+    if invalid:
+        raise ValueError(f"幅には1以上の整数を指定してください: {invalid[0]}")
+    return widths
@@ -0,0 +1,421 @@
+"""入力の列挙と、ZIP/TARアーカイブ内の画像の読み込み
+
+ディレクトリは再帰的に、アーカイブはメンバーを展開せずにジェネレーターで列挙する。
+アーカイブ内の画像は「アーカイブのパス::メンバー名」の形式のパスで表し、
+処理時には open_source でアーカイブから直接読み込む (ディスクには展開しない)。
+ヘッダーだけを読む場合は open_stream でメンバー全体をメモリに読み込まずに開く。
+出力を1つのアーカイブにまとめる場合は OutputArchive に順に追加する。
+"""
+
+import hashlib
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+import warnings
+import zipfile
+
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+MEMBER_SEPARATOR = "::"
+# SourceScanner が結果をまとめて渡す件数
+SCAN_CHUNK_SIZE = 500
+ZIP_EXTENSIONS = [".zip"]
+TAR_EXTENSIONS = [
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+]
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + TAR_EXTENSIONS
+
+
+def is_archive(path):
+    return path.lower().endswith(tuple(ARCHIVE_EXTENSIONS))
+
+
+def member_path(archive_path, member):
+    return f"{archive_path}{MEMBER_SEPARATOR}{member}"
+
+
+def split_member(path):
+    """(アーカイブのパス, メンバー名) を返す。通常のファイルはメンバー名が None"""
+    if MEMBER_SEPARATOR in path:
+        archive_path, member = path.split(MEMBER_SEPARATOR, 1)
+        if is_archive(archive_path):
+            return archive_path, member
+    return path, None
+
+
+def is_member(path):
+    return split_member(path)[1] is not None
+
+
+def source_basename(path):
+    """出力のファイル名の元にする名前 (アーカイブ内の画像はメンバーのファイル名)"""
+    archive_path, member = split_member(path)
+    return os.path.basename(member if member is not None else archive_path)
+
+
+def iter_directory(directory):
+    for dir_path, dir_names, names in os.walk(directory):
+        dir_names.sort()
+        for name in sorted(names):
+            yield os.path.join(dir_path, name)
+
+
+def iter_archive(archive_path):
+    """アーカイブ内のファイルのパスを、中身を読まずに (TARはヘッダーだけ) 列挙する"""
+    if archive_path.lower().endswith(tuple(ZIP_EXTENSIONS)):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield member_path(archive_path, info.filename)
+    else:
+        with tarfile.open(archive_path) as archive:
+            for info in archive:
+                if info.isfile():
+                    yield member_path(archive_path, info.name)
+
+
+def iter_sources(inputs, accept):
+    """ファイル・ディレクトリ・アーカイブから、accept を満たすパスを順に返す
+
+    ディレクトリ内のアーカイブも展開して列挙する。
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = iter_directory(item)
+        else:
+            paths = [item]
+
+        for path in paths:
+            if is_archive(path):
+                try:
+                    yield from filter(accept, iter_archive(path))
+                except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+                    logger.warning(f"アーカイブを読み込めません ({path}): {e}")
+            elif accept(path):
+                yield path
+
+
+class SourceScanner:
+    """iter_sources による列挙を別スレッドで行う
+
+    ネットワーク越しのディレクトリの走査や圧縮したTARのメンバーの列挙には
+    時間がかかるため、結果は chunk_size 件ずつ results キューに入れる。
+    Tkのメインループからは poll で取り出して画面に反映する。
+    """
+
+    def __init__(self, chunk_size=SCAN_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.results = queue.Queue()
+        self.generation = 0
+
+    def submit(self, inputs, accept):
+        thread = threading.Thread(
+            target=self._scan,
+            args=(list(inputs), accept, self.generation),
+            daemon=True,
+        )
+        thread.start()
+
+    def cancel(self):
+        """取り消し前に始めた列挙を止め、その結果を捨てる"""
+        self.generation += 1
+
+    def _scan(self, inputs, accept, generation):
+        chunk = []
+        for path in iter_sources(inputs, accept):
+            if generation != self.generation:
+                return
+            chunk.append(path)
+            if len(chunk) >= self.chunk_size:
+                self.results.put((generation, chunk))
+                chunk = []
+        if chunk:
+            self.results.put((generation, chunk))
+
+    def poll(self):
+        """列挙済みのパスをブロックせずにすべて取り出す"""
+        paths = []
+        while True:
+            try:
+                generation, chunk = self.results.get_nowait()
+            except queue.Empty:
+                return paths
+            if generation == self.generation:
+                paths.extend(chunk)
+
+
+class ArchiveReader:
+    """開いたままのアーカイブからメンバーを読み込む
+
+    ZIPは中央ディレクトリ、TARはメンバーの一覧を最初の1回だけ読み込む。
+    圧縮されたTARは前方へのシークでしか読み進められないため、
+    列挙した順に読み込むと展開は1回で済む。
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.lock = threading.Lock()
+        self.compressed = False
+        if archive_path.lower().endswith(tuple(ZIP_EXTENSIONS)):
+            self.archive = zipfile.ZipFile(archive_path)
+            self.members = None
+        else:
+            self.archive = tarfile.open(archive_path)
+            self.members = {info.name: info for info in self.archive}
+            self.compressed = archive_extension(archive_path) != ".tar"
+
+    def read(self, member):
+        # TarFile はスレッドセーフでないため、読み込みは1つずつ行う
+        with self.lock:
+            if self.members is None:
+                return self.archive.read(member)
+            return self.archive.extractfile(self.members[member]).read()
+
+    def open(self, member):
+        """メンバーを読み込み用のファイルオブジェクトで返す
+
+        ZIPのメンバーは ZipFile が共有のファイルの読み込みをロックするため、
+        そのまま開く。無圧縮のTARは読み込みごとにロックを取るストリームにする。
+        圧縮されたTARは後ろへのシークで先頭から展開し直すことになるため、
+        メンバー全体を読み込む。
+        """
+        if self.members is None:
+            return self.archive.open(member)
+        if self.compressed:
+            return io.BytesIO(self.read(member))
+        return io.BufferedReader(
+            LockedStream(
+                self.archive.extractfile(self.members[member]), self.lock
+            )
+        )
+
+    def size(self, member):
+        if self.members is None:
+            return self.archive.getinfo(member).file_size
+        return self.members[member].size
+
+    def close(self):
+        self.archive.close()
+
+
+class LockedStream(io.RawIOBase):
+    """共有のファイルから読むストリームを、lock を取りながら読み込む"""
+
+    def __init__(self, fileobj, lock):
+        super().__init__()
+        self.fileobj = fileobj
+        self.lock = lock
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        with self.lock:
+            data = self.fileobj.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self.lock:
+            return self.fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_reader(archive_path):
+    """アーカイブごとに ArchiveReader を使い回す
+
+    アーカイブが更新された場合は開き直す。fork で親から引き継いだものは
+    ファイルの読み込み位置を親と共有してしまうため、使わずに開き直す。
+    """
+    key = (os.getpid(), os.stat(archive_path).st_mtime_ns)
+    with _readers_lock:
+        reader, reader_key = _readers.get(archive_path, (None, None))
+        if reader is None or reader_key != key:
+            if reader is not None and reader_key[0] == key[0]:
+                reader.close()
+            reader = ArchiveReader(archive_path)
+            _readers[archive_path] = (reader, key)
+        return reader
+
+
+def close_readers():
+    pid = os.getpid()
+    with _readers_lock:
+        for reader, (reader_pid, _) in _readers.values():
+            if reader_pid == pid:
+                reader.close()
+        _readers.clear()
+
+
+def read_source(path):
+    archive_path, member = split_member(path)
+    if member is None:
+        with open(path, "rb") as f:
+            return f.read()
+    return get_reader(archive_path).read(member)
+
+
+def open_source(path):
+    """Image.open に渡せるパスまたはファイルオブジェクトを返す"""
+    if not is_member(path):
+        return path
+    return io.BytesIO(read_source(path))
+
+
+def open_stream(path):
+    """ヘッダーだけを読む場合に Image.open に渡すパスまたはファイルオブジェクト
+
+    アーカイブ内の画像もメンバー全体をメモリに読み込まずに開く。
+    """
+    archive_path, member = split_member(path)
+    if member is None:
+        return path
+    return get_reader(archive_path).open(member)
+
+
+def stat_source(path):
+    """(サイズ, 更新時刻) を返す。アーカイブ内の画像の更新時刻はアーカイブのもの"""
+    archive_path, member = split_member(path)
+    stat = os.stat(archive_path)
+    if member is None:
+        return stat.st_size, stat.st_mtime_ns
+    return get_reader(archive_path).size(member), stat.st_mtime_ns
+
+
+def hash_source(path, hash_file):
+    """内容のハッシュを返す。通常のファイルは hash_file (パスを受け取る関数) を使う"""
+    if not is_member(path):
+        return hash_file(path)
+    return hashlib.sha256(read_source(path)).hexdigest()
+
+
+# TARの拡張子 -> tarfile の圧縮方式
+TAR_COMPRESSIONS = {
+    ".gz": "gz",
+    ".tgz": "gz",
+    ".bz2": "bz2",
+    ".tbz2": "bz2",
+    ".xz": "xz",
+    ".txz": "xz",
+}
+
+
+def archive_extension(path):
+    """アーカイブの拡張子 (.tar.gz などは2つ分)。アーカイブでなければ ValueError"""
+    lower = path.lower()
+    for ext in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if lower.endswith(ext):
+            return path[len(path) - len(ext) :]
+    raise ValueError(f"対応していないアーカイブの形式です: {path}")
+
+
+def can_append(archive_path):
+    """既存のアーカイブに追加できる場合は True (圧縮したTARや壊れたものは不可)"""
+    ext = archive_extension(archive_path).lower()
+    if ext in ZIP_EXTENSIONS:
+        return zipfile.is_zipfile(archive_path)
+    if ext != ".tar":
+        return False
+    try:
+        return tarfile.is_tarfile(archive_path)
+    except OSError:
+        return False
+
+
+class OutputArchive:
+    """出力ファイルを1つのアーカイブ (ZIP/TAR) に順に追加する
+
+    画像は圧縮済みのため、ZIPは無圧縮で格納する。
+    append が真で既存のアーカイブがある場合は、既存のメンバーを残して追加する
+    (追加できない形式や壊れたアーカイブは ValueError)。
+    replace が真の場合は、同じ名前のメンバーも追加する (展開時は後のものが使われる)。
+    names はメンバー名 -> 更新時刻 (秒)。
+    """
+
+    def __init__(self, archive_path, append=False, replace=False):
+        self.archive_path = archive_path
+        self.replace = replace
+        self.names = {}
+        ext = archive_extension(archive_path).lower()
+        mode = "w"
+        if append and os.path.exists(archive_path):
+            if not can_append(archive_path):
+                raise ValueError(
+                    f"既存のアーカイブに追加できません: {archive_path}"
+                )
+            mode = "a"
+        if ext in ZIP_EXTENSIONS:
+            self.archive = zipfile.ZipFile(
+                archive_path, mode, zipfile.ZIP_STORED
+            )
+            # ZIPの時刻は2秒単位で切り捨てられているため、その分を加える
+            self.names.update(
+                (
+                    info.filename,
+                    time.mktime(info.date_time + (0, 0, -1)) + 2,
+                )
+                for info in self.archive.infolist()
+            )
+        else:
+            compression = TAR_COMPRESSIONS.get(os.path.splitext(ext)[1], "")
+            self.archive = tarfile.open(
+                archive_path, f"{mode}:{compression}" if compression else mode
+            )
+            if mode == "a":
+                self.names.update(
+                    (info.name, info.mtime)
+                    for info in self.archive.getmembers()
+                )
+
+    def add(self, path, name=None):
+        """ファイルを追加する
+
+        同じ名前が既にある場合は、replace が偽なら追加せず False を返す。
+        """
+        name = name or os.path.basename(path)
+        if name in self.names and not self.replace:
+            logger.warning(f"同じ名前のファイルは追加しません: {name}")
+            return False
+        self.names[name] = os.path.getmtime(path)
+        if isinstance(self.archive, zipfile.ZipFile):
+            with warnings.catch_warnings():
+                # 同じ名前のメンバーの追加は意図したもの
+                warnings.simplefilter("ignore", UserWarning)
+                self.archive.write(path, name)
+        else:
+            self.archive.add(path, name)
+        return True
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,193 @@
+"""プレビュー用のサムネイルの作成とキャッシュ
+
+JPEGは draft で縮小デコードを行い、サムネイルのサイズに必要な解像度だけを展開する。
+作成したサムネイルはパス・更新時刻・サイズをキーに、メモリ (合計の画素のバイト数が
+上限以内のLRU) とディスク (合計のファイルサイズが上限以内のLRU) の両方にキャッシュする。
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+import cache
+import memory
+import quantize
+import sources
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+THUMBNAIL_SIZE = (128, 128)
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "edited_fig_thumbnails"
+)
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 256 * 1024 * 1024
+DEFAULT_LOADER_WORKERS = 4
+# ディスクキャッシュの容量を確認する間隔 (書き込み回数)
+EVICT_INTERVAL = 200
+
+
+def thumbnail_key(path, size=THUMBNAIL_SIZE):
+    file_size, mtime = sources.stat_source(path)
+    payload = json.dumps([os.path.abspath(path), mtime, file_size, size])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    with Image.open(sources.open_source(path)) as img:
+        # 読み込み前に呼ぶ必要がある。JPEG以外では何もしない
+        img.draft("RGB", size)
+        img.thumbnail(size, Image.LANCZOS, reducing_gap=2.0)
+        # 向きの補正は縮小後の小さな画像に対して行う
+        thumbnail = ImageOps.exif_transpose(img)
+    if thumbnail.mode not in ("RGB", "RGBA", "L"):
+        thumbnail = quantize.prepare_mode(thumbnail)
+    return thumbnail
+
+
+class ThumbnailCache:
+    def __init__(
+        self,
+        cache_dir=DEFAULT_CACHE_DIR,
+        memory_bytes=DEFAULT_MEMORY_BYTES,
+        disk_bytes=DEFAULT_DISK_BYTES,
+    ):
+        self.memory_bytes = memory_bytes
+        self.memory_used = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk = cache.ResultCache(cache_dir, disk_bytes)
+        self.writes = 0
+
+    def get(self, key):
+        with self.lock:
+            img = self.entries.get(key)
+            if img is not None:
+                self.entries.move_to_end(key)
+                return img
+
+        entry = self.disk.entry_path(key, ".png")
+        if not os.path.exists(entry):
+            return None
+        try:
+            with Image.open(entry) as f:
+                img = f.copy()
+            # LRUのため最終利用時刻を更新する
+            os.utime(entry)
+        except OSError as e:
+            logger.debug(f"サムネイルのキャッシュを読み込めません: {e}")
+            return None
+        self._remember(key, img)
+        return img
+
+    def put(self, key, img):
+        self._remember(key, img)
+
+        entry = self.disk.entry_path(key, ".png")
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_path = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmp_path, format="PNG")
+            os.replace(tmp_path, entry)
+        except OSError as e:
+            logger.debug(f"サムネイルのキャッシュを書き込めません: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % EVICT_INTERVAL == 0
+        if evict:
+            self.disk.evict()
+
+    def _remember(self, key, img):
+        """メモリ上のキャッシュに追加し、上限を超えた分を古いものから捨てる"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.entries[key] = img
+            self.memory_used += memory.image_bytes(img.size, img.mode)
+            while (
+                self.memory_used > self.memory_bytes and len(self.entries) > 1
+            ):
+                _, old = self.entries.popitem(last=False)
+                self.memory_used -= memory.image_bytes(old.size, old.mode)
+
+    def clear_memory(self):
+        with self.lock:
+            self.entries.clear()
+            self.memory_used = 0
+
+
+class ThumbnailLoader:
+    """要求されたファイルのサムネイルを別スレッドで作成する
+
+    結果は results キューに (パス, サムネイル, 例外) の形で入る。
+    表示範囲が変わった場合は cancel で未着手の要求を捨ててから request する。
+    """
+
+    def __init__(
+        self,
+        thumbnail_cache=None,
+        size=THUMBNAIL_SIZE,
+        max_workers=DEFAULT_LOADER_WORKERS,
+    ):
+        self.cache = thumbnail_cache or ThumbnailCache()
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.results = queue.Queue()
+        self.generation = 0
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def request(self, paths):
+        generation = self.generation
+        for path in paths:
+            with self.lock:
+                if path in self.pending:
+                    continue
+                self.pending.add(path)
+            self.executor.submit(self._load, path, generation)
+
+    def cancel(self):
+        self.generation += 1
+        with self.lock:
+            self.pending.clear()
+
+    def _load(self, path, generation):
+        try:
+            if generation != self.generation:
+                return
+            key = thumbnail_key(path, self.size)
+            img = self.cache.get(key)
+            if img is None:
+                img = make_thumbnail(path, self.size)
+                self.cache.put(key, img)
+            self.results.put((path, img, None))
+        except Exception as e:
+            logger.debug(f"サムネイルを作成できません ({path}): {e}")
+            self.results.put((path, None, e))
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def poll(self):
+        """作成済みの結果をブロックせずにすべて取り出す"""
+        items = []
+        while True:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                return items
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,255 @@
+"""入力ディレクトリを監視し、追加・更新されたファイルを順に受け渡す
+
+Linuxでは inotify で変更を受け取り、使用できない環境ではディレクトリを定期的に走査する。
+書き込み中のファイルを渡さないよう、一定時間 (settle_seconds) サイズと更新時刻が
+変わらなかったファイルだけを ready キューに入れる。キューは上限付きで、処理が
+追いつかない間は監視側が待つ (inotify のイベントはカーネル側に溜まり、
+溢れた場合は走査し直す)。
+"""
+
+import ctypes
+import ctypes.util
+import os
+import queue
+from collections import OrderedDict
+import select
+import struct
+import sys
+import threading
+import time
+
+from logger import Logger
+
+log_level = "WARNING"
+logger = Logger(log_level)
+
+DEFAULT_SETTLE_SECONDS = 1.0
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_QUEUE_SIZE = 64
+# キューが空くのを待つ間に、停止の要求を確認する間隔 (秒)
+PUT_TIMEOUT = 0.5
+# 受け渡し済みとして覚えておくファイル数の上限。古いものから忘れる
+# (忘れたファイルが再び渡されても、処理済みの判定で書き出しは省かれる)
+MAX_DELIVERED = 10000
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+def file_state(path):
+    """変更の判定に使う (サイズ, 更新時刻) を返す。ファイルがなければ None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def iter_files(directory):
+    for dir_path, _, names in os.walk(directory):
+        for name in sorted(names):
+            yield os.path.join(dir_path, name)
+
+
+class InotifySource:
+    """inotify で、監視対象のディレクトリ内で変更のあったパスを受け取る"""
+
+    def __init__(self, directories):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 に失敗しました")
+        self.watches = {}
+        for directory in directories:
+            self.add_tree(directory)
+
+    def add_tree(self, directory):
+        """サブディレクトリも含めて監視に加え、既に置かれているファイルを返す"""
+        paths = []
+        for dir_path, _, names in os.walk(directory):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(dir_path), WATCH_MASK
+            )
+            if wd < 0:
+                raise OSError(
+                    ctypes.get_errno(), f"監視を追加できません: {dir_path}"
+                )
+            self.watches[wd] = dir_path
+            paths.extend(os.path.join(dir_path, name) for name in names)
+        return paths
+
+    def read(self, timeout):
+        """変更のあったファイルのパスを返す
+
+        イベントが溢れて取りこぼした可能性がある場合は、None を含める。
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, READ_SIZE)
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                paths.append(None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    paths.extend(self.add_tree(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                # 作成 (IN_CREATE) の時点では書き込み中のため、完了を待つ
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """書き込みの終わったファイルのパスを ready キューに入れる監視スレッド
+
+    accept(パス) が False を返すファイル (対象外の形式や処理済みのもの) は無視する。
+    """
+
+    def __init__(
+        self,
+        directories,
+        accept,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        settle_seconds=DEFAULT_SETTLE_SECONDS,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        use_inotify=True,
+    ):
+        self.directories = list(directories)
+        self.accept = accept
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.ready = queue.Queue(queue_size)
+        # 書き込みの完了を待っているファイル: パス -> (最後に変化した時刻, 状態)
+        self.pending = {}
+        # キューに入れた時点の状態。同じ内容のファイルを二度渡さない
+        # 古い順に並べ、MAX_DELIVERED 件を超えたら先頭から捨てる
+        self.delivered = OrderedDict()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.source = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self.source = InotifySource(self.directories)
+            except (OSError, AttributeError) as e:
+                logger.warning(
+                    f"inotify を使用できないため定期的に走査します: {e}"
+                )
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.source is not None:
+            self.source.close()
+
+    def run(self):
+        # 起動前に置かれていたファイルも対象にする
+        self.rescan()
+        while not self.stop_event.is_set():
+            if self.source is not None:
+                # 停止の要求と完了待ちのファイルの静止を確認するため、定期的に起きる
+                timeout = min(self.settle_seconds, PUT_TIMEOUT)
+                for path in self.source.read(timeout):
+                    if path is None:
+                        logger.warning("イベントを取りこぼしたため走査します")
+                        self.rescan()
+                    else:
+                        self.touch(path)
+            else:
+                self.stop_event.wait(self.poll_interval)
+                self.rescan()
+            self.flush_settled()
+
+    def rescan(self):
+        found = set()
+        for directory in self.directories:
+            for path in iter_files(directory):
+                found.add(path)
+                if path not in self.pending and self.delivered.get(
+                    path
+                ) != file_state(path):
+                    self.touch(path)
+        # 削除・移動されたファイルの記録を捨てる
+        for path in [path for path in self.delivered if path not in found]:
+            del self.delivered[path]
+
+    def touch(self, path):
+        state = file_state(path)
+        if state is None or not self.accept(path):
+            return
+        self.pending[path] = (time.monotonic(), state)
+
+    def flush_settled(self):
+        now = time.monotonic()
+        for path, (changed_at, state) in list(self.pending.items()):
+            current = file_state(path)
+            if current is None:
+                # 完了前に削除・移動された
+                del self.pending[path]
+            elif current != state:
+                self.pending[path] = (now, current)
+            elif now - changed_at >= self.settle_seconds:
+                del self.pending[path]
+                if self.delivered.get(path) != current:
+                    self.remember(path, current)
+                    self.put(path)
+
+    def remember(self, path, state):
+        self.delivered[path] = state
+        self.delivered.move_to_end(path)
+        while len(self.delivered) > MAX_DELIVERED:
+            self.delivered.popitem(last=False)
+
+    def put(self, path):
+        # キューが一杯の間は待ち、処理側に合わせて監視を遅らせる
+        while not self.stop_event.is_set():
+            try:
+                self.ready.put(path, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+    def next_batch(self, limit, timeout=PUT_TIMEOUT):
+        """1件以上届くまで待ち、その時点でキューにあるものを最大 limit 件返す
+
+        timeout 秒以内に届かなければ空のリストを返す。
+        """
+        try:
+            batch = [self.ready.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < limit:
+            try:
+                batch.append(self.ready.get_nowait())
+            except queue.Empty:
+                break
+        return batch